@@ -7,7 +7,7 @@
 .. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
 """
 
-import numpy, sys, os, time, subprocess, glob
+import numpy, sys, os, time, subprocess, glob, ast
 from os import PathLike
 from typing import List, Union
 sys.path.insert(0,"../../smodels" )
@@ -102,9 +102,7 @@ def baseDir():
 
 def tempDir():
     """ our temp dir """
-    current_dir = os.getcwd()
-    ret = os.path.join(current_dir, "temp")
-    #ret = baseDir()+"/temp/"
+    ret = os.path.join(baseDir(), "temp")
     while ret.find("//")>0:
         ret = ret.replace("//","/")
     if not os.path.exists ( ret ):
@@ -423,7 +421,7 @@ def getListOfCutlangMasses( topo, sqrts=13, ana=None ):
     if ana != None:
         sana = ana.replace("_","-").upper()
         sana += "*"
-    pattern = f"cutlang_results/{sana}/ANA_{topo}_*/output/*embaked"
+    pattern = f"{baseDir()}/cutlang_results/{sana}/ANA_{topo}_*/output/*embaked"
     files = glob.glob( pattern )
     for f in files:
         fname = f.replace(".embaked","")
@@ -464,11 +462,11 @@ def getEmbakedName(analysisId : str, topo : str, recaster : str ) -> str:
     :param analysisId: the analysis name, e.g. ATLAS-SUSY-2018-22
     :param topo: the topology name, e.g. T1
     :param recaster: the recaster, either of MA5, adl, cm2
-    :returns: e.g. ATLAS-SUSY-2018-22.T5WW.cm2.embaked
+    :returns: e.g. <basedir>/embaked/ATLAS-SUSY-2018-22.T5WW.cm2.embaked
     """
     retval = ".".join([analysisId.upper().replace("_", "-"), topo ])
     retval = ".".join([retval, recaster, "embaked"])
-    retval = f"embaked/{retval}"
+    retval = os.path.join(baseDir(), "embaked", retval)
     return retval
 
 def writeEmbaked ( effs : dict, effi_file : PathLike, masses, recaster : str ):
@@ -479,16 +477,25 @@ def writeEmbaked ( effs : dict, effi_file : PathLike, masses, recaster : str ):
     :param recaster: the name of the recaster, MA5, adl, or cm2
     """
     def lock ( lockfile ):
-        """ lock me """
+        """ lock me, atomically, so that also threads can write """
         ctr=0
-        while os.path.exists ( lockfile ):
-            ctr+=1
-            if ctr>100:
-                os.unlink ( lockfile )
-            time.sleep ( .2 )
-        f = open ( lockfile, "wt" )
-        f.write ( f"# locked {time.asctime()}\n" )
-        f.close()
+        while True:
+            try:
+                fd = os.open ( lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY )
+                break
+            except FileExistsError as e:
+                ctr+=1
+                if ctr>100:
+                    ## stale
+                    try:
+                        os.unlink ( lockfile )
+                    except FileNotFoundError as e:
+                        pass
+                    ctr = 0
+                time.sleep ( .2 )
+        with os.fdopen ( fd, "wt" ) as f:
+            f.write ( f"# locked {time.asctime()}\n" )
+            f.close()
 
     lockfile = effi_file+".lock"
     if recaster not in [ "adl", "cm2", "MA5" ]:
@@ -498,36 +505,39 @@ def writeEmbaked ( effs : dict, effi_file : PathLike, masses, recaster : str ):
             os.unlink ( lockfile )
         sys.exit()
         
-    if not os.path.exists ( "embaked" ):
-        os.mkdir ( "embaked" )
+    dirname = os.path.dirname ( effi_file )
+    if dirname != "":
+        os.makedirs ( dirname, exist_ok=True )
+    import tracer
     try:
         lock ( lockfile )
-        print ( f"[bakeryHelpers] adding point {masses} to {effi_file}" )
-        previousEffs = {}
-        if os.path.exists ( effi_file ):
-            g = open ( effi_file, "rt" )
-            previousEffs = eval(g.read())
-            g.close()
-        previousEffs[masses]=effs
-        nregions = len(effs)
-        npoints = len(previousEffs)
-        f = open ( effi_file, "wt" )
-        f.write ( f"# EM-Baked {time.asctime()}. {npoints} points, {nregions} signal regions, checkmate2(direct)\n" )
-        f.write( "{" )
-        masses = list ( previousEffs.keys() )
-        masses.sort()
-        for m in masses:
-            v = previousEffs[m]
-            f.write(str(m)+":"+str(v)+",\n")
-        f.write ( "}\n" )
-        f.close()
+        with tracer.span ( "embaked_write", recaster = recaster ):
+            print ( f"[bakeryHelpers] adding point {masses} to {effi_file}" )
+            previousEffs = {}
+            if os.path.exists ( effi_file ):
+                g = open ( effi_file, "rt" )
+                previousEffs = ast.literal_eval(g.read())
+                g.close()
+            previousEffs[masses]=effs
+            nregions = len(effs)
+            npoints = len(previousEffs)
+            f = open ( effi_file, "wt" )
+            f.write ( f"# EM-Baked {time.asctime()}. {npoints} points, {nregions} signal regions, checkmate2(direct)\n" )
+            f.write( "{" )
+            masses = list ( previousEffs.keys() )
+            masses.sort()
+            for m in masses:
+                v = previousEffs[m]
+                f.write(str(m)+":"+str(v)+",\n")
+            f.write ( "}\n" )
+            f.close()
     except Exception as e:
         print ( f"[bakeryHelpers] Exception {e}" )
     if os.path.exists ( lockfile ):
         os.unlink ( lockfile )
 
 def getListOfMA5Masses ( topo, sqrts, ana ):
-    dirname = "ma5results/"
+    dirname = os.path.join ( baseDir(), "ma5results" )
     extension = "dat"
     fname=f"{dirname}/{topo}_*.{extension}"
     files = glob.glob( fname )
@@ -538,7 +548,7 @@ def getListOfMA5Masses ( topo, sqrts, ana ):
             txt= handle.read()
             if not ana in txt:
                 continue
-        f = f.replace( dirname, "" )
+        f = os.path.basename ( f )
         f = f.replace( topo+"_", "" )
         f = f.replace( "."+extension, "" )
         p1 = f.find(".")
@@ -674,7 +684,8 @@ def execute( cmd:List[str], logfile:str=None, maxLength=100, cwd:str=None,
                       if == -1 then all output will be printed
     :param cmd       List of strings that make the command
                      e.g. ["cp", "foo", "bar"]
-    :param logfile   File where command and its output will be written
+    :param logfile   File where command and its output will be written,
+                     see runner.run
     :param cwd       Directory where the command should be executed
     :param exit_on_fail  Whether to invoke sys.exit() on nonzero return value
     :return return value of the command
@@ -692,44 +703,40 @@ def execute( cmd:List[str], logfile:str=None, maxLength=100, cwd:str=None,
     ctr=0
     while ctr < 5:
         try:
-            proc = subprocess.Popen( cmd, cwd=cwd, stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT, shell=shell )
-            for c in iter(lambda: proc.stdout.read(1), b""):
-                sys.stdout.buffer.write(c)
-            #    # f.buffer.write(c)
-            #out, err = proc.communicate()
-            #print(out.decode('utf-8'))
-            #print(err.decode('utf-8'))
-            proc.wait()
-            if logfile is not None:
-                with open(logfile, "a") as log:
-                    log.write(f'exec: {directory} $$ {scmd}')
-            if not (proc.returncode == 0):
+            import runner
+            r = runner.run ( cmd, logfile = logfile, cwd = cwd, echo = True )
+            if not (r["returncode"] == 0):
                 print(f"[helpers] Executed process: \n{scmd}\n\nin"
                             f" directory:\n{directory}\n\nproduced an error\n\n"
-                            f"value {proc.returncode}.")
+                            f"value {r['returncode']}.")
                 if exit_on_fail is True:
                     sys.exit()
-            return proc.returncode
+            return r["returncode"]
         except BlockingIOError as e:
             print( "[helpers] ran into blocking io error. wait a bit then try again." )
             time.sleep ( random.uniform(1,10)+ctr*30 )
             ctr += 1
         sys.exit()
 
-def checkDelphesInstall( installdir : PathLike = "delphes",
+def checkDelphesInstall( installdir : Union[PathLike,None] = None,
                          autocompile : bool = True ) -> bool:
     """ check if we have a functioning delphes installation at 
     installdir 
+    :param installdir: default is delphes/ in the base directory
     :returns: True, if all is ok
     """
+    if installdir is None:
+        installdir = os.path.join ( baseDir(), "delphes" )
     if not os.path.isdir( installdir ):
         print("[delphesInstaller] Delphes directory missing, download from github!")
         if True: # self._confirmation("Download from github?"):
-            args = ['git', 'clone', '-b', '3.5.0', 'https://github.com/delphes/delphes']
+            installdir = os.path.abspath ( installdir )
+            args = ['git', 'clone', '-b', '3.5.0', 'https://github.com/delphes/delphes',
+                    installdir ]
             #args = ['git', 'clone', 'https://github.com/delphes/delphes']
             execute(args, exit_on_fail=True)
-            args = [ 'cp', 'templates/delphes_card_CMS.tcl', 'delphes/cards/' ]
+            args = [ 'cp', os.path.join ( baseDir(), 'templates/delphes_card_CMS.tcl' ),
+                     os.path.join ( installdir, 'cards/' ) ]
             execute(args, exit_on_fail=True)
         else:
             print("[delphesInstaller] ERROR: No Delphes dir. Exiting.")
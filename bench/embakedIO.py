@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: embakedIO
+   :synopsis: scaling benchmark of the reading and writing of embaked
+              files: bakeryHelpers.writeEmbaked, emCreator.createEmbakedFile,
+              emCreator.massesInEmbakedFile, utils/mergeEmbaked.merge and
+              utils/checkEmbaked.check, on synthetic files of N points with
+              M signal regions each, and writeEmbaked also with many
+              concurrent writers. reports latency, throughput (points
+              processed per second for the single calls, calls per second
+              for the concurrent writers), the increase of the peak rss,
+              and counts points lost by concurrent writers.
+              with a baseline from an earlier run (-o), it is a gate:
+              the exit code is 1 if anything got slower than the tolerance
+              allows, or if points got lost.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, json, random, tempfile, shutil, resource, io
+import multiprocessing
+from contextlib import redirect_stdout
+from typing import Dict, List, Callable
+
+benchdir = os.path.dirname ( os.path.abspath ( __file__ ) )
+basedir = os.path.dirname ( benchdir )
+sys.path.insert ( 0, basedir )
+
+topo = "T2"
+analysis = "CMS-SUS-19-006"
+
+def synthetic ( npoints : int, nsrs : int, seed : int = 0 ) -> Dict:
+    """ npoints mass points with nsrs signal regions each, with the
+        bookkeeping entries that the bakery writes """
+    rnd = random.Random ( seed )
+    ret = {}
+    tstamp = time.strftime ( "%Y-%m-%d_%H:%M:%S" )
+    i = 0
+    while len(ret) < npoints:
+        masses = ( 200 + 10 * ( i // 500 ), 10 + 2 * ( i % 500 ) )
+        i += 1
+        effs = { f"SR{j}": round ( rnd.random() * .1, 6 ) for j in range(nsrs) }
+        effs.update ( { "__t__": tstamp, "__nevents__": 10000, "__cpu__": 100.,
+                        "__rss__": 200. } )
+        ret[masses] = effs
+    return ret
+
+def newPoint ( D : Dict, nsrs : int, seed : int = 1 ):
+    """ a point that is not in D yet """
+    rnd = random.Random ( seed )
+    while True:
+        masses = ( rnd.randint ( 5000, 10**6 ), rnd.randint ( 0, 4999 ) )
+        if not masses in D:
+            return masses, { f"SR{j}": round ( rnd.random() * .1, 6 ) for j in range(nsrs) }
+
+def writeFile ( D : Dict, fname : str ):
+    """ write D in the format of writeEmbaked """
+    os.makedirs ( os.path.dirname ( fname ), exist_ok=True )
+    with open ( fname, "wt" ) as f:
+        f.write ( f"# EM-Baked {time.asctime()}. {len(D)} points, synthetic\n" )
+        f.write ( "{" )
+        for m in sorted ( D.keys() ):
+            f.write ( str(m)+":"+str(D[m])+",\n" )
+        f.write ( "}\n" )
+        f.close()
+
+def embakedFile ( recaster : str = "cm2" ) -> str:
+    return f"embaked/{analysis}.{topo}.{recaster}.embaked"
+
+def maxrss () -> float:
+    """ peak rss of this process, in MB """
+    return resource.getrusage ( resource.RUSAGE_SELF ).ru_maxrss / 1024.
+
+## the single call targets. each gets the synthetic points D, that are
+## already in the file, is run in the working directory, and returns a
+## function that is then timed
+def setupWriteEmbaked ( D : Dict, nsrs : int ) -> Callable:
+    import bakeryHelpers
+    writeFile ( D, embakedFile() )
+    masses, effs = newPoint ( D, nsrs )
+    return lambda: bakeryHelpers.writeEmbaked ( effs, embakedFile(), masses, "cm2" )
+
+def setupCreateEmbakedFile ( D : Dict, nsrs : int ) -> Callable:
+    import emCreator
+    writeFile ( D, embakedFile() )
+    values = { k: dict(v) for k,v in D.items() }
+    masses, effs = newPoint ( D, nsrs )
+    effs.update ( { "__nevents__": 10000, "__cpu__": 100., "__rss__": 200. } )
+    values[masses] = effs
+    creator = emCreator.emCreator ( analysis, topo, 1, False, 13, [ "cm2" ] )
+    return lambda: emCreator.createEmbakedFile ( { analysis: values }, topo,
+            "cm2", {}, creator, False, False )
+
+def setupMassesInEmbakedFile ( D : Dict, nsrs : int ) -> Callable:
+    import emCreator
+    writeFile ( D, embakedFile() )
+    masses = list ( D.keys() )[len(D)//2]
+    return lambda: emCreator.massesInEmbakedFile ( masses, analysis, topo, [ "cm2" ] )
+
+def setupMerge ( D : Dict, nsrs : int ) -> Callable:
+    from utils import mergeEmbaked
+    keys = list ( D.keys() )
+    ## two files, that overlap by a tenth of the points
+    n1, n2 = int ( len(keys) * .55 ), int ( len(keys) * .45 )
+    writeFile ( { k: D[k] for k in keys[:n1] }, "merge/a.embaked" )
+    writeFile ( { k: D[k] for k in keys[n2:] }, "merge/b.embaked" )
+    return lambda: mergeEmbaked.merge ( [ "merge/a.embaked", "merge/b.embaked" ],
+                                        "merge/out.embaked", None )
+
+def setupCheck ( D : Dict, nsrs : int ) -> Callable:
+    from utils import checkEmbaked
+    writeFile ( D, f"embaked/{topo}.embaked" )
+    return lambda: checkEmbaked.check ( topo, False, False, False )
+
+targets = { "writeEmbaked": setupWriteEmbaked,
+            "createEmbakedFile": setupCreateEmbakedFile,
+            "massesInEmbakedFile": setupMassesInEmbakedFile,
+            "merge": setupMerge, "check": setupCheck }
+
+def environment ( workdir : str ):
+    """ run in workdir, and keep traces and metrics out of the bakery """
+    os.chdir ( workdir )
+    import tracer, metrics, emCreator
+    emCreator.embakeddir = os.path.join ( workdir, "embaked" )
+    tracer.tracedir = os.path.join ( workdir, "traces" )
+    metrics.textfile = os.path.join ( workdir, "metrics", "bench.prom" )
+
+def runTarget ( name : str, D : Dict, nsrs : int, workdir : str, queue ):
+    """ in a child process: set up, then time one call """
+    try:
+        environment ( workdir )
+        with redirect_stdout ( io.StringIO() ):
+            fn = targets[name] ( D, nsrs )
+            rss0 = maxrss()
+            t0 = time.time()
+            fn()
+            dt = time.time() - t0
+        queue.put ( { "latency": dt, "rss": maxrss() - rss0 } )
+    except ImportError as e:
+        queue.put ( { "skipped": str(e) } )
+
+def inChild ( target : Callable, args : tuple ) -> List:
+    """ run target in a forked child, return what it put in the queue """
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process ( target = target, args = args + ( queue, ) )
+    p.start()
+    ret = []
+    while p.is_alive() or not queue.empty():
+        try:
+            ret.append ( queue.get ( timeout = .1 ) )
+        except Exception as e:
+            pass
+    p.join()
+    return ret
+
+def benchTarget ( name : str, npoints : int, nsrs : int, repeat : int ) -> Dict:
+    D = synthetic ( npoints, nsrs )
+    latencies, rss = [], 0.
+    for r in range(repeat):
+        workdir = tempfile.mkdtemp ( prefix = "emcbench_io_" )
+        try:
+            for res in inChild ( runTarget, ( name, D, nsrs, workdir ) ):
+                if "skipped" in res:
+                    return { "target": name, "npoints": npoints, "writers": 1,
+                             "skipped": res["skipped"] }
+                latencies.append ( res["latency"] )
+                rss = max ( rss, res["rss"] )
+        finally:
+            shutil.rmtree ( workdir, ignore_errors = True )
+    latencies.sort()
+    latency = latencies[len(latencies)//2] if len(latencies)>0 else float("nan")
+    return { "target": name, "npoints": npoints, "writers": 1, "latency": latency,
+             "p95": latencies[-1] if len(latencies)>0 else float("nan"),
+             "throughput": npoints / latency if latency > 0. else 0.,
+             "rss": rss, "lost": 0 }
+
+def writer ( wid : int, ncalls : int, nsrs : int, workdir : str, start, queue ):
+    """ one of many concurrent writers: add ncalls points to the file """
+    import bakeryHelpers
+    environment ( workdir )
+    rnd = random.Random ( wid )
+    latencies = []
+    rss0 = maxrss()
+    start.wait()
+    with redirect_stdout ( io.StringIO() ):
+        for i in range(ncalls):
+            masses = ( 100000 + wid, i ) ## unique per writer and call
+            effs = { f"SR{j}": round ( rnd.random() * .1, 6 ) for j in range(nsrs) }
+            t0 = time.time()
+            bakeryHelpers.writeEmbaked ( effs, embakedFile(), masses, "cm2" )
+            latencies.append ( time.time() - t0 )
+    queue.put ( { "latencies": latencies, "rss": maxrss() - rss0 } )
+
+def benchWriters ( npoints : int, nsrs : int, nwriters : int, ncalls : int ) -> Dict:
+    """ nwriters processes add ncalls points each to the same file """
+    workdir = tempfile.mkdtemp ( prefix = "emcbench_io_" )
+    try:
+        os.chdir ( workdir )
+        writeFile ( synthetic ( npoints, nsrs ), embakedFile() )
+        start = multiprocessing.Event()
+        queue = multiprocessing.Queue()
+        procs = [ multiprocessing.Process ( target = writer, args = ( i, ncalls,
+                  nsrs, workdir, start, queue ) ) for i in range(nwriters) ]
+        for p in procs:
+            p.start()
+        t0 = time.time()
+        start.set()
+        results = []
+        while len(results) < nwriters and any ( [ p.is_alive() for p in procs ] ) or not queue.empty():
+            try:
+                results.append ( queue.get ( timeout = .1 ) )
+            except Exception as e:
+                pass
+        wall = time.time() - t0
+        for p in procs:
+            p.join()
+        with open ( embakedFile(), "rt" ) as f:
+            final = len ( eval ( f.read() ) )
+            f.close()
+    finally:
+        os.chdir ( benchdir )
+        shutil.rmtree ( workdir, ignore_errors = True )
+    latencies = sorted ( sum ( [ r["latencies"] for r in results ], [] ) )
+    ndone = len(latencies)
+    return { "target": "writeEmbaked", "npoints": npoints, "writers": nwriters,
+             "latency": latencies[ndone//2] if ndone>0 else float("nan"),
+             "p95": latencies[int(ndone*.95)] if ndone>0 else float("nan"),
+             "throughput": ndone / wall if wall > 0. else 0.,
+             "rss": max ( [ r["rss"] for r in results ] + [ 0. ] ),
+             "lost": npoints + nwriters * ncalls - final }
+
+def key ( r : Dict ) -> str:
+    return f"{r['target']}@{r['npoints']}@{r['writers']}"
+
+def gate ( results : List, baselinefile : str, tolerance : float,
+           floor : float = .01 ) -> bool:
+    """ compare the latencies with the baseline.
+    :param floor: latencies that differ by less than this many seconds
+                  are considered equal
+    :returns: True, if the gate is passed
+    """
+    with open ( baselinefile, "rt" ) as f:
+        baseline = { key(r): r for r in json.load ( f )["results"] }
+        f.close()
+    passed = True
+    for r in results:
+        if r.get ( "lost", 0 ) > 0:
+            print ( f"[embakedIO] {key(r)}: {r['lost']} points lost" )
+            passed = False
+        b = baseline.get ( key(r), None )
+        if b is None or "latency" not in b or "latency" not in r:
+            continue
+        limit = max ( b["latency"] * ( 1. + tolerance ), b["latency"] + floor )
+        if r["latency"] > limit:
+            print ( f"[embakedIO] {key(r)}: latency {r['latency']:.3f}s, baseline {b['latency']:.3f}s" )
+            passed = False
+    print ( f"[embakedIO] gate {'passed' if passed else 'failed'} (baseline {baselinefile}, tolerance {tolerance:.0%})" )
+    return passed
+
+def printResult ( r : Dict ):
+    if "skipped" in r:
+        print ( "%-20s %8d %7d  skipped: %s" % ( r["target"], r["npoints"], r["writers"], r["skipped"] ) )
+        return
+    print ( "%-20s %8d %7d %10.4f %10.4f %12.1f %8.1f %6d" % ( r["target"], r["npoints"],
+            r["writers"], r["latency"], r["p95"], r["throughput"], r["rss"], r["lost"] ) )
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='scaling benchmark of the embaked file i/o.')
+    argparser.add_argument ( '-n', '--npoints', help='numbers of points in the files, comma separated [1000,10000]',
+                             type=str, default="1000,10000" )
+    argparser.add_argument ( '-M', '--nsrs', help='signal regions per point [20]',
+                             type=int, default=20 )
+    argparser.add_argument ( '-T', '--targets', help='what to benchmark, comma separated [%s]' % ",".join ( targets.keys() ),
+                             type=str, default=",".join ( targets.keys() ) )
+    argparser.add_argument ( '-w', '--writers', help='numbers of concurrent writers for writeEmbaked, comma separated. empty means none [1,4,16]',
+                             type=str, default="1,4,16" )
+    argparser.add_argument ( '-c', '--ncalls', help='points added by each concurrent writer [4]',
+                             type=int, default=4 )
+    argparser.add_argument ( '-r', '--repeat', help='repeat every single call measurement, report the median [3]',
+                             type=int, default=3 )
+    argparser.add_argument ( '-o', '--output', help='write the results to this json file [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-b', '--baseline', help='compare with the results of an earlier run, exit code 1 if there is a regression [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-t', '--tolerance', help='relative slowdown tolerated by the gate [.25]',
+                             type=float, default=.25 )
+    args = argparser.parse_args()
+    multiprocessing.set_start_method ( "fork" )
+    os.chdir ( benchdir )
+    results = []
+    print ( "%-20s %8s %7s %10s %10s %12s %8s %6s" % ( "target", "points", "writers",
+            "latency[s]", "p95[s]", "throughput/s", "rss[MB]", "lost" ) )
+    for npoints in [ int(x) for x in args.npoints.split(",") ]:
+        for name in args.targets.split(","):
+            r = benchTarget ( name, npoints, args.nsrs, args.repeat )
+            printResult ( r )
+            results.append ( r )
+        for w in [ int(x) for x in args.writers.split(",") if x.strip() != "" ]:
+            r = benchWriters ( npoints, args.nsrs, w, args.ncalls )
+            printResult ( r )
+            results.append ( r )
+    if args.output is not None:
+        with open ( args.output, "wt" ) as f:
+            json.dump ( { "nsrs": args.nsrs, "results": results }, f, indent=1 )
+            f.close()
+    if args.baseline is not None and not gate ( results, args.baseline, args.tolerance ):
+        sys.exit ( 1 )
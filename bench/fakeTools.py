@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: fakeTools
+   :synopsis: stand-ins for mg5_aMC, madevent, ma5, CheckMATE, DelphesHepMC2
+              and CLA.sh, for benchmarking the orchestration without a physics
+              install. they parse the same command files as the real tools,
+              write outputs of realistic size and format at the same places
+              (hepmc.gz, lhe.gz, saf, dat), the root files of delphes and
+              cutlang are placeholders of realistic size only. then they
+              sleep or burn cpu for
+              the configured time. configured by the json dictionary in
+              EMCREATOR_FAKE, e.g.
+              {"mode":"cpu","mg5_launch":3.,"nevents":2000}
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, gzip, json, random, configparser, zlib
+from typing import Dict, List
+
+defaults = { "mode": "sleep", ## sleep or cpu
+             "mg5_output": .5, "mg5_launch": 2., "mg5_shower": 1.,
+             "ma5": 1., "cm2": 1., "delphes": 1., "cutlang": .5, ## seconds per call
+             "nevents": 1000, "nparticles": 50, ## size of the hepmc files
+             "nsrs": 20, ## signal regions per analysis
+}
+
+def config() -> Dict:
+    ret = dict ( defaults )
+    ret.update ( json.loads ( os.environ.get ( "EMCREATOR_FAKE", "{}" ) ) )
+    return ret
+
+def burn ( seconds : float, mode : str ):
+    """ spend seconds, sleeping or busy """
+    if seconds <= 0.:
+        return
+    if mode == "sleep":
+        time.sleep ( seconds )
+        return
+    t1 = time.time() + seconds
+    x = 0
+    while time.time() < t1:
+        for i in range(10000):
+            x += i*i
+
+def writeHepmc ( filename : str, nevents : int, nparticles : int = 50,
+                 seed : int = 0, masses : List = [ 1000., 100. ] ):
+    """ write a hepmc2 (IO_GenEvent) file with nevents events, gzipped if
+        the filename ends with .gz. per event: two beam protons, a pair
+        of mother particles of mass masses[0], decaying to a quark and
+        an invisible particle of mass masses[-1], and nparticles final
+        state pions as the underlying event. """
+    rnd = random.Random ( seed )
+    opener = gzip.open if filename.endswith ( ".gz" ) else open
+    mmother, minv = float(masses[0]), float(masses[-1])
+    with opener ( filename, "wt" ) as f:
+        f.write ( "\nHepMC::Version 2.06.09\n" )
+        f.write ( "HepMC::IO_GenEvent-START_EVENT_LISTING\n" )
+        for n in range(nevents):
+            lines = []
+            barcode = 0
+            def particle ( pid, status, endvertex, m ):
+                nonlocal barcode
+                barcode += 1
+                px, py = rnd.gauss ( 0., 50. ), rnd.gauss ( 0., 50. )
+                pz = rnd.gauss ( 0., 500. )
+                e = ( px**2 + py**2 + pz**2 + m**2 )**.5
+                lines.append ( "P %d %d %.10e %.10e %.10e %.10e %.10e %d 0 0 %d 0" % \
+                        ( barcode, pid, px, py, pz, e, m, status, endvertex ) )
+            lines.append ( "V -1 0 0 0 0 0 2 %d 0" % ( 2 + nparticles ) )
+            for i in range(2):
+                barcode += 1
+                lines.append ( "P %d 2212 0 0 %.10e 6.5e+03 9.38e-01 4 0 0 -1 0" % \
+                               ( barcode, 6.5e3 * ( 1 - 2*i ) ) )
+            particle ( 1000001, 22, -2, mmother )
+            particle ( -1000001, 22, -3, mmother )
+            for i in range(nparticles):
+                particle ( rnd.choice ( [ 211, -211, 111, 22 ] ), 1, 0, .13957 )
+            for v in [ -2, -3 ]:
+                lines.append ( "V %d 0 0 0 0 0 0 2 0" % v )
+                particle ( rnd.choice ( [ 1, 2, 3, 4 ] ), 1, 0, 0. )
+                particle ( 1000022, 1, 0, minv )
+            f.write ( "E %d -1 -1.0 -1.0 -1.0 0 -1 3 1 2 0 1 1.0\n" % n )
+            f.write ( "N 1 \"0\"\nU GEV MM\nC 1.0e+00 1.0e-02\n" )
+            f.write ( "F 21 21 1.0e-01 1.0e-01 1.0e+03 0 0 0 0\n" )
+            f.write ( "\n".join ( lines ) + "\n" )
+        f.write ( "HepMC::IO_GenEvent-END_EVENT_LISTING\n" )
+        f.close()
+
+def countEvents ( hepmcfile : str ) -> int:
+    """ read the hepmc file like a recaster would, count the events """
+    opener = gzip.open if hepmcfile.endswith ( ".gz" ) else open
+    n = 0
+    with opener ( hepmcfile, "rb" ) as f:
+        for line in f:
+            if line.startswith ( b"E " ):
+                n += 1
+        f.close()
+    return n
+
+def massesOf ( dirname : str ) -> List:
+    """ T2_1jet.1000_100 -> [ 1000., 100. ] """
+    try:
+        return [ float(x) for x in os.path.basename ( dirname ).split(".",1)[1].split("_") ]
+    except (IndexError,ValueError) as e:
+        return [ 1000., 100. ]
+
+def commands ( filename : str ) -> List:
+    with open ( filename, "rt" ) as f:
+        ret = [ l.strip() for l in f.readlines() ]
+        f.close()
+    return ret
+
+def writeLHE ( filename : str, nevents : int ):
+    with gzip.open ( filename, "wt" ) as f:
+        f.write ( "<LesHouchesEvents version=\"3.0\">\n<init>\n</init>\n" )
+        for i in range(nevents):
+            f.write ( "<event>\n 4 1 +1.0e+00 1.0e+03 7.5e-03 1.1e-01\n</event>\n" )
+        f.write ( "</LesHouchesEvents>\n" )
+        f.close()
+
+def shower ( Dir : str, cfg : Dict, tag : int ):
+    """ what pythia8 does: events/run_01/tag_<tag>_pythia8_events.hepmc.gz """
+    rundir = f"{Dir}/Events/run_01"
+    os.makedirs ( rundir, exist_ok=True )
+    writeHepmc ( f"{rundir}/tag_{tag}_pythia8_events.hepmc.gz", cfg["nevents"],
+                 cfg["nparticles"], seed = zlib.crc32 ( Dir.encode() ), masses = massesOf ( Dir ) )
+
+def mg5 ( cmdfile : str ):
+    """ mg5_aMC <cmdfile>: either "output <Dir>", or "launch <Dir>" """
+    cfg = config()
+    t0 = time.time()
+    stage = None
+    for line in commands ( cmdfile ):
+        if line.startswith ( "output " ):
+            stage = "mg5_output"
+            Dir = line.split()[1]
+            for d in [ "Cards", "bin", "Events", "SubProcesses", "Source" ]:
+                os.makedirs ( f"{Dir}/{d}", exist_ok=True )
+            ## the madevent of the process directory, used for reshowering
+            madevent = f"{Dir}/bin/madevent"
+            with open ( madevent, "wt" ) as f:
+                f.write ( "#!/usr/bin/env python3\n" )
+                f.write ( f"import sys\nsys.path.insert(0,{repr(os.path.dirname(os.path.abspath(__file__)))})\n" )
+                f.write ( "import fakeTools\nfakeTools.madevent ( sys.argv[1] )\n" )
+                f.close()
+            os.chmod ( madevent, 0o755 )
+        if line.startswith ( "launch " ):
+            stage = "mg5_launch"
+            Dir = line.split()[1]
+            rundir = f"{Dir}/Events/run_01"
+            os.makedirs ( rundir, exist_ok=True )
+            writeLHE ( f"{rundir}/unweighted_events.lhe.gz", cfg["nevents"] )
+            shower ( Dir, cfg, 1 )
+    if stage is None:
+        print ( f"[fakeTools] nothing to do in {cmdfile}" )
+        return
+    print ( f"[fakeTools] mg5 {stage} done" )
+    burn ( cfg[stage] - ( time.time() - t0 ), cfg["mode"] )
+
+def madevent ( cmdfile : str ):
+    """ <Dir>/bin/madevent <cmdfile>: only "pythia8 run_01" """
+    cfg = config()
+    t0 = time.time()
+    Dir = os.path.dirname ( os.path.dirname ( os.path.abspath ( sys.argv[0] ) ) )
+    tags = [ x for x in os.listdir ( f"{Dir}/Events/run_01" ) if x.startswith ( "tag_" ) ]
+    shower ( Dir, cfg, len(tags)+1 )
+    burn ( cfg["mg5_shower"] - ( time.time() - t0 ), cfg["mode"] )
+
+def writeSaf ( filename : str, nevents : int, nhistos : int = 100,
+               nbins : int = 50 ):
+    """ the saf file of ma5: global info of the sample, and histograms """
+    rnd = random.Random ( nevents )
+    with open ( filename, "wt" ) as f:
+        f.write ( "<SampleGlobalInfo>\n" )
+        f.write ( "# xsection    xsection_error    nevents    sum_weight+    sum_weight-\n" )
+        f.write ( f"  1.00e+00     0.00e+00          {nevents}       {nevents}.0        0.0\n" )
+        f.write ( "</SampleGlobalInfo>\n" )
+        for h in range(nhistos):
+            f.write ( f"<Histo>\n  <Description>\n    \"histo{h}\"\n  </Description>\n  <Data>\n" )
+            for b in range(nbins):
+                f.write ( "      %.6e  %.6e  # bin %d\n" % ( rnd.random(), 0., b ) )
+            f.write ( "  </Data>\n</Histo>\n" )
+        f.close()
+
+def writeCLsSummary ( filename : str, analyses : List, nsrs : int, nevents : int ):
+    """ CLs_output_summary.dat of ma5, nsrs signal regions per analysis """
+    rnd = random.Random ( nevents )
+    with open ( filename, "wt" ) as f:
+        f.write ( "# dataset_name  analysis_name  signal_region  sig95(exp)  sig95(obs)  1-CLs  efficiency  stat\n" )
+        for a in analyses:
+            for sr in range(nsrs):
+                eff = rnd.random() * .1
+                f.write ( "defaultset  %s  SR%d  %.4e  %.4e  %.4f  %.6e  %.6e\n" % \
+                          ( a, sr, 1., 1., .5, eff, eff / max(nevents,1)**.5 ) )
+        f.close()
+
+def writeCheckmateDat ( filename : str, nevents : int, nsrs : int ):
+    """ the myprocess_<ana>_signal.dat file of CheckMATE """
+    rnd = random.Random ( nevents )
+    with open ( filename, "wt" ) as f:
+        f.write ( f"MCEvents: {nevents}\n SumOfWeights: {nevents}.0\n" )
+        f.write ( f" SumOfWeights2: {nevents}.0\n NormEvents: 1.0\n XSect: 1 pb\n" )
+        f.write ( "SR  Sum_W  Sum_W2  Acc  N_Norm\n" )
+        for sr in range(nsrs):
+            eff = rnd.random() * .1
+            f.write ( "SR%d  %.4e  %.4e  %.6e  %.4e\n" % ( sr, eff*nevents, eff*nevents, eff, eff ) )
+        f.close()
+
+def ma5 ( cmdfile : str ):
+    """ ma5 -R -s <cmdfile>, in the ma5 working directory """
+    cfg = config()
+    t0 = time.time()
+    hepmcfile, ana = None, None
+    for line in commands ( cmdfile ):
+        if line.startswith ( "import " ):
+            hepmcfile = line.split()[1]
+        if line.startswith ( "submit " ):
+            ana = line.split()[1]
+    analyses = []
+    for line in commands ( "recast" ):
+        tokens = line.split()
+        if len(tokens)>2 and not line.startswith("#") and tokens[2] == "on":
+            analyses.append ( tokens[0] )
+    nevents = countEvents ( hepmcfile )
+    safdir = f"{ana}/Output/SAF"
+    os.makedirs ( f"{safdir}/defaultset", exist_ok=True )
+    writeSaf ( f"{safdir}/defaultset/defaultset.saf", nevents )
+    writeCLsSummary ( f"{safdir}/CLs_output_summary.dat", analyses, cfg["nsrs"],
+                      nevents )
+    print ( f"[fakeTools] ma5 recast {nevents} events for {','.join(analyses)}" )
+    burn ( cfg["ma5"] - ( time.time() - t0 ), cfg["mode"] )
+
+def checkmate ( inifile : str ):
+    """ CheckMATE <inifile> """
+    cfg = config()
+    t0 = time.time()
+    ini = configparser.ConfigParser()
+    ini.read ( inifile )
+    name = ini["Parameters"]["Name"]
+    outdir = ini["Parameters"]["OutputDirectory"]
+    analyses = [ a.strip() for a in ini["Parameters"]["Analyses"].split(",") ]
+    nevents = countEvents ( ini["myprocess"]["Events"] )
+    os.makedirs ( f"{outdir}/{name}/analysis", exist_ok=True )
+    for a in analyses:
+        writeCheckmateDat ( f"{outdir}/{name}/analysis/myprocess_{a}_signal.dat",
+                            nevents, cfg["nsrs"] )
+    print ( f"[fakeTools] checkmate {nevents} events for {','.join(analyses)}" )
+    burn ( cfg["cm2"] - ( time.time() - t0 ), cfg["mode"] )
+
+def placeholderRoot ( filename : str, nbytes : int ):
+    """ a file of nbytes that only looks like a root file from afar """
+    with open ( filename, "wb" ) as f:
+        f.write ( b"root\x00\x00\xf4\x4a" )
+        block = os.urandom ( 65536 )
+        while nbytes > 0:
+            f.write ( block[:nbytes] )
+            nbytes -= len(block)
+        f.close()
+
+def delphes ( argv : List ):
+    """ DelphesHepMC2 <card> <outfile> <hepmcfile> """
+    cfg = config()
+    t0 = time.time()
+    card, outfile, hepmcfile = argv[-3:]
+    nevents = countEvents ( hepmcfile )
+    placeholderRoot ( outfile, 2000 * nevents )
+    print ( f"[fakeTools] delphes simulated {nevents} events with {os.path.basename(card)}" )
+    burn ( cfg["delphes"] - ( time.time() - t0 ), cfg["mode"] )
+
+def cutlang ( argv : List ):
+    """ CLA.sh <delphesfile> DELPHES -i <adlfile>, in the runs directory """
+    cfg = config()
+    t0 = time.time()
+    inputfile, adlfile = argv[1], argv[-1]
+    name = os.path.basename ( adlfile ).split(".")[0]
+    placeholderRoot ( f"histoOut-{name}.root", 20000 * cfg["nsrs"] )
+    print ( f"[fakeTools] CLA ran {name} over {os.path.basename(inputfile)}" )
+    burn ( cfg["cutlang"] - ( time.time() - t0 ), cfg["mode"] )
+
+def install ( basedir : str ):
+    """ install the fake tools in basedir: mg5/, ma5/, cm2/, hepmc2/,
+        delphes/, CutLang/ """
+    here = os.path.dirname ( os.path.abspath ( __file__ ) )
+    def script ( path, call, argument = "sys.argv[-1]" ):
+        os.makedirs ( os.path.dirname ( path ), exist_ok=True )
+        with open ( path, "wt" ) as f:
+            f.write ( "#!/usr/bin/env python3\nimport sys\n" )
+            f.write ( f"sys.path.insert(0,{repr(here)})\n" )
+            f.write ( f"import fakeTools\nfakeTools.{call} ( {argument} )\n" )
+            f.close()
+        os.chmod ( path, 0o755 )
+    script ( f"{basedir}/mg5/bin/mg5_aMC", "mg5" )
+    with open ( f"{basedir}/mg5/VERSION", "wt" ) as f:
+        f.write ( "version = 3.5.0_fake\n" )
+        f.close()
+    pythiaconfig = f"{basedir}/mg5/HEPTools/bin/pythia8-config"
+    os.makedirs ( os.path.dirname ( pythiaconfig ), exist_ok=True )
+    with open ( pythiaconfig, "wt" ) as f:
+        f.write ( "#!/bin/sh\necho true\n" )
+        f.close()
+    os.chmod ( pythiaconfig, 0o755 )
+    script ( f"{basedir}/ma5/bin/ma5", "ma5" )
+    for d in [ "madanalysis", "tools/PADForSFS/Build" ]:
+        os.makedirs ( f"{basedir}/ma5/{d}", exist_ok=True )
+    script ( f"{basedir}/cm2/checkmate2/bin/CheckMATE", "checkmate" )
+    with open ( f"{basedir}/cm2/checkmate2/VERSION", "wt" ) as f:
+        f.write ( "2.0.37_fake\n" )
+        f.close()
+    fio = f"{basedir}/hepmc2/HepMC-2.06.11/fio"
+    os.makedirs ( fio, exist_ok=True )
+    open ( f"{fio}/libHepMCfio.la", "wt" ).close()
+    script ( f"{basedir}/delphes/DelphesHepMC2", "delphes", "sys.argv" )
+    os.makedirs ( f"{basedir}/delphes/cards", exist_ok=True )
+    script ( f"{basedir}/CutLang/runs/CLA.sh", "cutlang", "sys.argv" )
+    script ( f"{basedir}/CutLang/CLA/CLA.exe", "cutlang", "sys.argv" )
+    for d in [ "ADLLHCanalyses/CMS-SUS-19-006", "ADLAnalysisDrafts" ]:
+        os.makedirs ( f"{basedir}/CutLang/{d}", exist_ok=True )
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='stand-ins for the tools of the bakery.')
+    argparser.add_argument ( '-i', '--install', help='install the fake tools into this directory [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '--hepmc', help='write a fake hepmc file with -n events [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-n', '--nevents', help='number of events [1000]',
+                             type=int, default=1000 )
+    args = argparser.parse_args()
+    if args.install is not None:
+        install ( args.install )
+    if args.hepmc is not None:
+        writeHepmc ( args.hepmc, args.nevents )
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: orchestration
+   :synopsis: benchmark of the orchestration of the bakery (locking,
+              copying, globbing, bookkeeping), with the physics tools
+              replaced by the stand-ins of fakeTools.py. builds a sandbox
+              copy of the bakery for every run, with the fake mg5, ma5
+              and CheckMATE installed, runs mg5Wrapper.py or one of the
+              recaster drivers with 1..N processes, and reports points
+              per hour, and the orchestration overhead per point, i.e.
+              the wall time that is not spent in the (fake) tools.
+              cutlang is not among the modes: its delphes filtering and
+              efficiency extraction read real root files.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, json, shutil, subprocess, tempfile, glob
+from typing import Dict, List
+
+benchdir = os.path.dirname ( os.path.abspath ( __file__ ) )
+sys.path.insert ( 0, benchdir )
+sys.path.insert ( 1, os.path.dirname ( benchdir ) )
+import fakeTools
+
+basedir = os.path.dirname ( benchdir )
+## seconds spent in the fake tools per point, per mode
+toolStages = { "mg5": [ "mg5_output", "mg5_launch" ], "ma5": [ "ma5" ],
+               "cm2": [ "cm2" ] }
+## the stage in the traces that marks a finished point
+doneStages = { "mg5": "hepmc_move", "mg5+ma5": "recast", "mg5+cm2": "recast",
+               "ma5": "ma5", "cm2": "checkmate" }
+
+def sandbox ( workdir : str ):
+    """ a copy of the bakery in workdir, with the fake tools installed.
+        the python modules must be copied, not linked: the bakery finds
+        its base directory via the location of bakeryHelpers.py """
+    os.makedirs ( workdir, exist_ok=True )
+    for f in glob.glob ( f"{basedir}/*.py" ):
+        shutil.copy ( f, workdir )
+    shutil.copytree ( f"{basedir}/utils", f"{workdir}/utils",
+                      ignore = shutil.ignore_patterns ( "__pycache__" ) )
+    for d in [ "templates", "idm" ]:
+        os.symlink ( f"{basedir}/{d}", f"{workdir}/{d}" )
+    fakeTools.install ( workdir )
+
+def grid ( npoints : int ) -> str:
+    """ a T2 grid with npoints points, in the syntax of mg5Wrapper """
+    return f"({1000},{1000+50*npoints},50),(100,101,50)"
+
+def command ( mode : str, nprocs : int, npoints : int, analyses : str,
+              nevents : int ) -> List:
+    masses = grid ( npoints )
+    if mode.startswith ( "mg5" ):
+        ## the hepmc files are verified against the number of events we ask for
+        cmd = [ sys.executable, "mg5Wrapper.py", "-T", "T2", "-p", str(nprocs),
+                "-m", masses, "--analyses", analyses, "-n", str(nevents) ]
+        if mode == "mg5+ma5":
+            cmd += [ "-a" ]
+        if mode == "mg5+cm2":
+            cmd += [ "-a", "--checkmate" ]
+        return cmd
+    driver = { "ma5": "ma5Wrapper.py", "cm2": "cm2Wrapper.py" }[mode]
+    return [ sys.executable, driver, "-t", "T2", "-p", str(nprocs), "-m", masses,
+             "-a", analyses ]
+
+def prepareHepmcs ( workdir : str, npoints : int, nevents : int ):
+    """ the recaster drivers need the hepmc files in mg5results/ """
+    import bakeryHelpers
+    resultsdir = f"{workdir}/mg5results"
+    os.makedirs ( resultsdir, exist_ok=True )
+    for masses in bakeryHelpers.parseMasses ( grid ( npoints ) ):
+        smasses = "_".join ( map ( str, masses ) )
+        fakeTools.writeHepmc ( f"{resultsdir}/T2_{smasses}.13.hepmc.gz", nevents,
+                               masses = masses )
+
+def countDone ( workdir : str, mode : str ) -> int:
+    """ the number of successfully finished points, from the traces """
+    n = 0
+    for filename in glob.glob ( f"{workdir}/traces/*.jsonl" ):
+        with open ( filename, "rt" ) as f:
+            for line in f:
+                try:
+                    record = json.loads ( line )
+                except ValueError as e:
+                    continue
+                if record["stage"] == doneStages[mode] and record.get ( "ok", True ):
+                    n += 1
+            f.close()
+    return n
+
+def toolSeconds ( mode : str, cfg : Dict ) -> float:
+    """ the seconds per point that are spent in the fake tools """
+    ret = 0.
+    for tool in mode.split("+"):
+        ret += sum ( [ cfg[s] for s in toolStages[tool] ] )
+    return ret
+
+def runOnce ( mode : str, nprocs : int, npoints : int, analyses : str,
+              cfg : Dict, keep : bool = False ) -> Dict:
+    """ one run in a fresh sandbox """
+    workdir = tempfile.mkdtemp ( prefix=f"emcbench_{mode.replace('+','_')}_{nprocs}_" )
+    sandbox ( workdir )
+    env = dict ( os.environ )
+    env["EMCREATOR_FAKE"] = json.dumps ( cfg )
+    for k in [ "EMCREATOR_TRACEDIR", "EMCREATOR_METRICS_FILE" ]:
+        env.pop ( k, None )
+    if not mode.startswith ( "mg5" ):
+        prepareHepmcs ( workdir, npoints, cfg["nevents"] )
+    logfile = f"{workdir}/bench.log"
+    t0 = time.time()
+    with open ( logfile, "wt" ) as log:
+        p = subprocess.run ( command ( mode, nprocs, npoints, analyses, cfg["nevents"] ),
+                             cwd = workdir, env = env, stdout = log,
+                             stderr = subprocess.STDOUT )
+        log.close()
+    wall = time.time() - t0
+    ndone = countDone ( workdir, mode )
+    perpoint = toolSeconds ( mode, cfg )
+    ret = { "mode": mode, "nprocs": nprocs, "npoints": npoints, "done": ndone,
+            "wall": wall, "returncode": p.returncode,
+            "points_per_hour": ndone / wall * 3600. if wall > 0. else 0.,
+            "ideal_points_per_hour": 3600. / perpoint * min ( nprocs, npoints ) if perpoint > 0. else 0.,
+            "overhead_per_point": wall * min ( nprocs, npoints ) / max(ndone,1) - perpoint }
+    if keep or ndone < npoints:
+        ret["workdir"] = workdir
+        print ( f"[orchestration] {mode} -p {nprocs}: {ndone}/{npoints} points done, see {logfile}" )
+    else:
+        shutil.rmtree ( workdir, ignore_errors = True )
+    return ret
+
+def run ( modes : List, maxprocs : int, npoints : int, analyses : str,
+          cfg : Dict, keep : bool = False ) -> List:
+    results = []
+    print ( "%-8s %6s %6s %8s %10s %10s %11s" % ( "mode", "procs", "done", "wall[s]", "points/h",
+            "ideal/h", "overhead[s]" ) )
+    for mode in modes:
+        nprocs = 1
+        while nprocs <= maxprocs:
+            r = runOnce ( mode, nprocs, npoints, analyses, cfg, keep )
+            results.append ( r )
+            print ( "%-8s %6d %6d %8.1f %10.1f %10.1f %11.2f" % ( mode, nprocs, r["done"],
+                    r["wall"], r["points_per_hour"], r["ideal_points_per_hour"],
+                    r["overhead_per_point"] ) )
+            nprocs *= 2
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='benchmark the orchestration of the bakery, with fake physics tools.')
+    argparser.add_argument ( '-m', '--modes', help='what to run, comma separated: mg5 (generation only), mg5+ma5, mg5+cm2, ma5, cm2 (the recaster drivers) [mg5+ma5,ma5,cm2]',
+                             type=str, default="mg5+ma5,ma5,cm2" )
+    argparser.add_argument ( '-p', '--maxprocs', help='run with 1,2,4,... up to this many processes [4]',
+                             type=int, default=4 )
+    argparser.add_argument ( '-n', '--npoints', help='number of points in the grid [8]',
+                             type=int, default=8 )
+    argparser.add_argument ( '-a', '--analyses', help='analyses [cms_sus_19_006]',
+                             type=str, default="cms_sus_19_006" )
+    argparser.add_argument ( '-e', '--nevents', help='events per hepmc file [1000]',
+                             type=int, default=1000 )
+    argparser.add_argument ( '-s', '--seconds', help='seconds per call of a fake tool, e.g. mg5_launch=2,ma5=1 [%s]' % \
+                             ",".join ( [ f"{k}={v}" for k,v in fakeTools.defaults.items() if type(v)==float ] ),
+                             type=str, default="" )
+    argparser.add_argument ( '--cpu', help='burn cpu in the fake tools, instead of sleeping',
+                             action="store_true" )
+    argparser.add_argument ( '-k', '--keep', help='keep the sandboxes',
+                             action="store_true" )
+    argparser.add_argument ( '-o', '--output', help='write the results to this json file [None]',
+                             type=str, default=None )
+    args = argparser.parse_args()
+    cfg = dict ( fakeTools.defaults )
+    cfg["nevents"] = args.nevents
+    if args.cpu:
+        cfg["mode"] = "cpu"
+    for token in args.seconds.split(","):
+        if "=" in token:
+            k, v = token.split("=")
+            cfg[k.strip()] = float(v)
+    results = run ( args.modes.split(","), args.maxprocs, args.npoints, args.analyses,
+                    cfg, args.keep )
+    if args.output is not None:
+        with open ( args.output, "wt" ) as f:
+            json.dump ( { "config": cfg, "results": results }, f, indent=1 )
+            f.close()
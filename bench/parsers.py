@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: parsers
+   :synopsis: throughput of the parsers of the recaster outputs and of the
+              llp event files, on generated fixtures: emCreator.extractMA5
+              (CLs_output_summary.dat), emCreator.getNEvents (saf),
+              CutLangWrapper.extract_efficiencies_uproot (histoOut root
+              files, needs uproot), CM2Wrapper.extractEfficiencies,
+              emCreator.getMA5Statistics (xml .info) and
+              LLP/getEffs.getEventsFrom (lhe). reports MB/s and records/s
+              per parser. no physics tools needed.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, json, random, tempfile, shutil, io
+from contextlib import redirect_stdout
+from typing import Dict, Tuple
+
+benchdir = os.path.dirname ( os.path.abspath ( __file__ ) )
+basedir = os.path.dirname ( benchdir )
+sys.path.insert ( 0, benchdir )
+sys.path.insert ( 1, basedir )
+import fakeTools
+
+topo = "T2"
+masses = ( 1000, 100 )
+sqrts = 13
+
+## every fixture gets the working directory and the scale, writes its
+## files, and returns ( fn, nbytes, nrecords ), fn is what is timed
+def fixtureExtractMA5 ( workdir : str, scale : int ) -> Tuple:
+    import emCreator, bakeryHelpers
+    analyses = [ f"cms_sus_{i:02d}_{i:03d}" for i in range(10) ]
+    nsrs = 10 * scale
+    fname = bakeryHelpers.datFile ( workdir, topo, masses, sqrts )
+    fakeTools.writeCLsSummary ( fname, analyses, nsrs, 10000 )
+    creator = emCreator.emCreator ( ",".join(analyses), topo, 1, False, sqrts, [ "MA5" ] )
+    creator.resultsdir = workdir
+    return ( lambda: creator.extractMA5 ( masses ) ), os.stat ( fname ).st_size, len(analyses) * nsrs
+
+def fixtureGetNEvents ( workdir : str, scale : int ) -> Tuple:
+    import emCreator, bakeryHelpers
+    fname = bakeryHelpers.safFile ( workdir, topo, masses, sqrts )
+    nhistos = 10 * scale
+    fakeTools.writeSaf ( fname, 10000, nhistos = nhistos )
+    creator = emCreator.emCreator ( "cms_sus_19_006", topo, 1, False, sqrts, [ "MA5" ] )
+    creator.resultsdir = workdir
+    return ( lambda: creator.getNEvents ( masses ) ), os.stat ( fname ).st_size, nhistos
+
+def fixtureCutlang ( workdir : str, scale : int ) -> Tuple:
+    import uproot, numpy
+    from cutlangWrapper import CutLangWrapper
+    fname = os.path.join ( workdir, "histoOut-CMS-SUS-19-006.root" )
+    nregions = 10 * scale
+    with uproot.recreate ( fname ) as f:
+        for r in range(nregions):
+            ncuts = 12
+            values = numpy.array ( [ 10000. * .8**i for i in range(ncuts) ] )
+            f[f"SR{r}/cutflow"] = ( values, numpy.arange ( ncuts + 1, dtype=float ) )
+    ## the parser needs only the filters of the wrapper, not the installation
+    cl = CutLangWrapper.__new__ ( CutLangWrapper )
+    cl.filterRegions, cl.filterBins = set(), {}
+    return ( lambda: cl.extract_efficiencies_uproot ( fname, "CMS-SUS-19-006.adl" ) ), \
+           os.stat ( fname ).st_size, nregions
+
+def fixtureCheckmate ( workdir : str, scale : int ) -> Tuple:
+    from cm2Wrapper import CM2Wrapper
+    ## the parser needs only the paths of the wrapper, not the installation
+    cm2 = CM2Wrapper.__new__ ( CM2Wrapper )
+    cm2.cm2tempdir = f"{workdir}/cm2tempdir/"
+    cm2.cm2results = f"{workdir}/cm2results/"
+    cm2.analyses = "cms_sus_19_006"
+    cm2.topo = topo
+    cm2.instanceName = f"cms_sus_19_006_{topo}_1000_100"
+    nsrs = 100 * scale
+    fname = cm2.outputfile()
+    os.makedirs ( os.path.dirname ( fname ), exist_ok=True )
+    fakeTools.writeCheckmateDat ( fname, 10000, nsrs )
+    shutil.copyfile ( fname, cm2.outputfile ( final=True ) )
+    return cm2.extractEfficiencies, os.stat ( fname ).st_size, nsrs
+
+def fixtureMA5Statistics ( workdir : str, scale : int ) -> Tuple:
+    import emCreator
+    ana = "cms_sus_19_006"
+    Dir = f"{workdir}/ma5/tools/PAD/Build/SampleAnalyzer/User/Analyzer/"
+    os.makedirs ( Dir, exist_ok=True )
+    nsrs = 100 * scale
+    rnd = random.Random ( 0 )
+    fname = f"{Dir}/{ana}.info"
+    with open ( fname, "wt" ) as f:
+        f.write ( f"<analysis id=\"{ana}\">\n" )
+        f.write ( "  <lumi>137.</lumi>\n" )
+        for i in range(nsrs):
+            t = "signal" if i % 10 else "control"
+            f.write ( f"  <region type=\"{t}\" id=\"SR{i}\">\n" )
+            f.write ( f"    <nobs>{rnd.randint(0,1000)}</nobs>\n" )
+            f.write ( f"    <nb>{rnd.random()*1000:.2f}</nb>\n" )
+            f.write ( f"    <deltanb>{rnd.random()*50:.2f}</deltanb>\n" )
+            f.write ( "  </region>\n" )
+        f.write ( "</analysis>\n" )
+        f.close()
+    creator = emCreator.emCreator ( ana, topo, 1, False, sqrts, [ "MA5" ] )
+    creator.basedir = workdir
+    return ( lambda: creator.getMA5Statistics ( ana ) ), os.stat ( fname ).st_size, nsrs
+
+def fixtureLLPEvents ( workdir : str, scale : int ) -> Tuple:
+    sys.path.insert ( 0, os.path.join ( basedir, "LLP" ) )
+    import getEffs
+    nevents = 1000 * scale
+    rnd = random.Random ( 0 )
+    fname = f"{workdir}/events.lhe"
+    ## getEventsFrom drops the last line of every event, so the file must
+    ## end with </event>, as the ones of the llp production do
+    with open ( fname, "wt" ) as f:
+        f.write ( "<LesHouchesEvents version=\"1.0\">\n<header>\n</header>\n" )
+        for n in range(nevents):
+            f.write ( "<event>\n 2 1 1.0e+00\n # pdg px py pz E m trigger c000 c100 c200 c300\n" )
+            for pdg in [ 1000015, -1000015 ]:
+                px, py, pz = rnd.gauss ( 0, 300 ), rnd.gauss ( 0, 300 ), rnd.gauss ( 0, 800 )
+                m = 500.
+                e = ( px**2 + py**2 + pz**2 + m**2 )**.5
+                effs = " ".join ( [ "%.4f +- %.4f" % ( rnd.random(), rnd.random() * .01 ) for i in range(5) ] )
+                f.write ( " %d %.6e %.6e %.6e %.6e %.6e %s\n" % ( pdg, px, py, pz, e, m, effs ) )
+            f.write ( "</event>\n" )
+        f.close()
+    return ( lambda: getEffs.getEventsFrom ( fname ) ), os.stat ( fname ).st_size, nevents
+
+parsers = { "extractMA5": fixtureExtractMA5, "getNEvents": fixtureGetNEvents,
+            "extract_efficiencies_uproot": fixtureCutlang,
+            "extractEfficiencies": fixtureCheckmate,
+            "getMA5Statistics": fixtureMA5Statistics,
+            "getEventsFrom": fixtureLLPEvents }
+
+def bench ( name : str, scale : int, mintime : float ) -> Dict:
+    """ call the parser until mintime seconds have passed """
+    workdir = tempfile.mkdtemp ( prefix = "emcbench_parse_" )
+    try:
+        with redirect_stdout ( io.StringIO() ):
+            fn, nbytes, nrecords = parsers[name] ( workdir, scale )
+            fn() ## warm up, the file is in the page cache now
+            ncalls = 0
+            t0 = time.time()
+            while ncalls == 0 or time.time() - t0 < mintime:
+                fn()
+                ncalls += 1
+            dt = time.time() - t0
+    except ImportError as e:
+        return { "parser": name, "scale": scale, "skipped": str(e) }
+    finally:
+        shutil.rmtree ( workdir, ignore_errors = True )
+    return { "parser": name, "scale": scale, "bytes": nbytes, "records": nrecords,
+             "latency": dt / ncalls, "MBps": nbytes * ncalls / dt / 1e6,
+             "recordsps": nrecords * ncalls / dt }
+
+def printResult ( r : Dict ):
+    if "skipped" in r:
+        print ( "%-28s %6d  skipped: %s" % ( r["parser"], r["scale"], r["skipped"] ) )
+        return
+    print ( "%-28s %6d %10.1f %9d %11.5f %9.1f %12.0f" % ( r["parser"], r["scale"],
+            r["bytes"]/1e3, r["records"], r["latency"], r["MBps"], r["recordsps"] ) )
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='throughput of the result parsers, on generated fixtures.')
+    argparser.add_argument ( '-P', '--parsers', help='the parsers, comma separated [%s]' % ",".join ( parsers.keys() ),
+                             type=str, default=",".join ( parsers.keys() ) )
+    argparser.add_argument ( '-s', '--scales', help='sizes of the fixtures, comma separated. 1 is a typical file [1,10]',
+                             type=str, default="1,10" )
+    argparser.add_argument ( '-t', '--mintime', help='call every parser for at least so many seconds [1.]',
+                             type=float, default=1. )
+    argparser.add_argument ( '-o', '--output', help='write the results to this json file [None]',
+                             type=str, default=None )
+    args = argparser.parse_args()
+    results = []
+    print ( "%-28s %6s %10s %9s %11s %9s %12s" % ( "parser", "scale", "size[kB]", "records",
+            "latency[s]", "MB/s", "records/s" ) )
+    for scale in [ int(x) for x in args.scales.split(",") ]:
+        for name in args.parsers.split(","):
+            r = bench ( name, scale, args.mintime )
+            printResult ( r )
+            results.append ( r )
+    if args.output is not None:
+        with open ( args.output, "wt" ) as f:
+            json.dump ( results, f, indent=1 )
+            f.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: blockGzip
+   :synopsis: block gzip for the event files: a file is written as a
+              sequence of gzip members of blockSize uncompressed bytes each,
+              which is still a standard gzip file (gzip -d, gzip.open, pythia,
+              delphes read it). every member has an extra field in its
+              header with its compressed size, so the members can be found
+              without inflating anything, and be inflated in parallel, in a
+              pool of threads (zlib releases the gil). ordinary gzip files
+              are inflated sequentially, as a stream.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, struct, zlib, collections, itertools
+import concurrent.futures
+from typing import Dict, Iterator, Tuple, List, Union
+
+blockSize = 1 << 24 ## uncompressed bytes per member, 16 MB
+readSize = 1 << 20 ## read so many compressed bytes at once, for ordinary gzip
+## the extra field: subfield id "EM", 4 bytes with the size of the member
+extraId = b"EM"
+headerSize = 20 ## 10 bytes fixed header, 2 bytes xlen, 8 bytes extra field
+trailerSize = 8 ## crc32 and isize
+
+def nThreads ( nthreads : int = 0 ) -> int:
+    """ 0 means one thread per cpu """
+    if nthreads < 1:
+        nthreads = os.cpu_count() or 1
+    return nthreads
+
+def compressBlock ( data : bytes, level : int = 6 ) -> bytes:
+    """ one gzip member, with our extra field """
+    c = zlib.compressobj ( level, zlib.DEFLATED, -15 )
+    deflated = c.compress ( data ) + c.flush()
+    size = headerSize + len(deflated) + trailerSize
+    ## magic, deflate, FEXTRA, mtime 0, xfl 0, os unknown
+    header = b"\x1f\x8b\x08\x04" + struct.pack ( "<IBB", 0, 0, 255 )
+    header += struct.pack ( "<H2sHI", 8, extraId, 4, size )
+    trailer = struct.pack ( "<II", zlib.crc32 ( data ), len(data) & 0xffffffff )
+    return header + deflated + trailer
+
+def inflate ( member : bytes ) -> bytes:
+    """ inflate one of our members, check crc and size """
+    data = zlib.decompress ( member[headerSize:-trailerSize], -15 )
+    crc, isize = struct.unpack ( "<II", member[-trailerSize:] )
+    if zlib.crc32 ( data ) != crc or len(data) & 0xffffffff != isize:
+        raise zlib.error ( "incorrect data check" )
+    return data
+
+def readMembers ( filename : str ) -> Union[List[Tuple[int,int,int]],None]:
+    """ find the members of a block gzip file, from the headers and trailers.
+    :returns: list of ( offset, compressed size, uncompressed size ), or
+              None if it is not a block gzip file, e.g. an ordinary gzip file
+    """
+    ret = []
+    with open ( filename, "rb" ) as f:
+        fsize = os.fstat ( f.fileno() ).st_size
+        offset = 0
+        while offset < fsize:
+            header = os.pread ( f.fileno(), headerSize, offset )
+            if len(header) < headerSize or header[:4] != b"\x1f\x8b\x08\x04":
+                return None
+            xlen, sid, slen, size = struct.unpack ( "<H2sHI", header[10:] )
+            if xlen != 8 or sid != extraId or slen != 4 or offset + size > fsize:
+                return None
+            isize = struct.unpack ( "<I", os.pread ( f.fileno(), 4, offset+size-4 ) )[0]
+            ret.append ( ( offset, size, isize ) )
+            offset += size
+    if len(ret)==0:
+        return None
+    return ret
+
+def isBlockGzip ( filename : str ) -> bool:
+    return filename.endswith ( ".gz" ) and readMembers ( filename ) is not None
+
+def stream ( filename : str, members : Union[List,None] = None ) -> Iterator[Tuple[int,bytes]]:
+    """ inflate an ordinary (possibly multi-member) gzip file sequentially,
+        in chunks of at most blockSize bytes.
+    :param members: if a list, append ( compressed offset, uncompressed
+                    offset ) of every gzip member of the file to it
+    :returns: tuples of ( uncompressed offset, data )
+    """
+    with open ( filename, "rb" ) as f:
+        d = zlib.decompressobj ( wbits = 31 )
+        if members is not None:
+            members.append ( ( 0, 0 ) )
+        buf = b""
+        cpos, upos = 0, 0 ## compressed offset of buf, uncompressed offset
+        while True:
+            if len(buf)==0:
+                buf = f.read ( readSize )
+                if len(buf)==0:
+                    break
+            data = d.decompress ( buf, blockSize )
+            rest = d.unused_data if d.eof else d.unconsumed_tail
+            cpos += len(buf) - len(rest)
+            buf = rest
+            if len(data)>0:
+                yield upos, data
+                upos += len(data)
+            if d.eof:
+                ## a new gzip member, if there is more
+                if len(buf)==0:
+                    buf = f.read ( readSize )
+                if len(buf)==0:
+                    return
+                d = zlib.decompressobj ( wbits = 31 )
+                if members is not None:
+                    members.append ( ( cpos, upos ) )
+        if not d.eof:
+            raise EOFError ( f"{filename} is truncated" )
+
+def iterate ( filename : str, nthreads : int = 0,
+              members : Union[List,None] = None ) -> Iterator[Tuple[int,bytes]]:
+    """ inflate a gzip file, in order. the members of a block gzip file are
+        inflated in parallel, ordinary gzip files are streamed.
+    :param nthreads: number of threads, 0 means one per cpu
+    :param members: see stream
+    :returns: tuples of ( uncompressed offset, data )
+    """
+    blocks = readMembers ( filename )
+    if blocks is None:
+        yield from stream ( filename, members )
+        return
+    if members is not None:
+        upos = 0
+        for offset, size, isize in blocks:
+            members.append ( ( offset, upos ) )
+            upos += isize
+    nthreads = nThreads ( nthreads )
+    with open ( filename, "rb" ) as f, \
+         concurrent.futures.ThreadPoolExecutor ( nthreads ) as executor:
+        fd = f.fileno()
+        def task ( offset, size ):
+            return inflate ( os.pread ( fd, size, offset ) )
+        ## keep only a few members in flight, to bound the memory
+        todo = iter ( blocks )
+        pending = collections.deque ( [ executor.submit ( task, offset, size ) \
+                for offset, size, isize in itertools.islice ( todo, 2 * nthreads ) ] )
+        upos = 0
+        while len(pending)>0:
+            data = pending.popleft().result()
+            nxt = next ( todo, None )
+            if nxt is not None:
+                pending.append ( executor.submit ( task, nxt[0], nxt[1] ) )
+            yield upos, data
+            upos += len(data)
+
+def decompress ( infile : str, outfile : str, nthreads : int = 0 ) -> int:
+    """ inflate infile to outfile, atomically
+    :returns: the number of uncompressed bytes
+    """
+    tmpfile = f"{outfile}.{os.getpid()}.tmp"
+    n = 0
+    with open ( tmpfile, "wb" ) as out:
+        for offset, data in iterate ( infile, nthreads ):
+            out.write ( data )
+            n += len(data)
+        out.close()
+    os.replace ( tmpfile, outfile )
+    return n
+
+def read ( filename : str ) -> Iterator[bytes]:
+    """ the uncompressed content of a plain or gzipped file, in chunks """
+    if filename.endswith ( ".gz" ):
+        for offset, data in iterate ( filename ):
+            yield data
+        return
+    with open ( filename, "rb" ) as f:
+        while True:
+            data = f.read ( blockSize )
+            if len(data)==0:
+                break
+            yield data
+
+def compress ( infile : str, outfile : Union[str,None] = None,
+               level : int = 6, nthreads : int = 0 ) -> Dict:
+    """ write infile (plain or gzipped) as block gzip file, atomically.
+    :param outfile: if None, re-encode infile in place
+    :param nthreads: number of threads, 0 means one per cpu
+    :returns: dictionary with insize, outsize, nmembers
+    """
+    if outfile is None:
+        outfile = infile
+    nthreads = nThreads ( nthreads )
+    tmpfile = f"{outfile}.{os.getpid()}.tmp"
+    nmembers, outsize = 0, 0
+    try:
+        with open ( tmpfile, "wb" ) as out, \
+             concurrent.futures.ThreadPoolExecutor ( nthreads ) as executor:
+            pending = collections.deque()
+            def flush ( n ):
+                nonlocal nmembers, outsize
+                while len(pending) > n:
+                    member = pending.popleft().result()
+                    out.write ( member )
+                    nmembers += 1
+                    outsize += len(member)
+            buf = b""
+            for data in read ( infile ):
+                buf += data
+                while len(buf) >= blockSize:
+                    pending.append ( executor.submit ( compressBlock, buf[:blockSize], level ) )
+                    buf = buf[blockSize:]
+                    flush ( 2 * nthreads )
+            if len(buf)>0:
+                pending.append ( executor.submit ( compressBlock, buf, level ) )
+            flush ( 0 )
+            out.close()
+    except BaseException as e:
+        ## a corrupt input, or ctrl-c: leave nothing behind
+        if os.path.exists ( tmpfile ):
+            os.unlink ( tmpfile )
+        raise
+    insize = os.stat ( infile ).st_size
+    os.replace ( tmpfile, outfile )
+    return { "insize": insize, "outsize": outsize, "nmembers": nmembers }
+
+if __name__ == "__main__":
+    import argparse, glob
+    argparser = argparse.ArgumentParser(description='block gzip for the event files.')
+    argparser.add_argument ( 'files', help='the files, or directories, e.g. mg5results. compress re-encodes all *.gz files in a directory that are not block gzip yet',
+                             type=str, nargs="+" )
+    argparser.add_argument ( '-d', '--decompress', help='inflate to the file name without .gz',
+                             action='store_true' )
+    argparser.add_argument ( '-t', '--threads', help='number of threads, 0 means one per cpu [0]',
+                             type=int, default=0 )
+    argparser.add_argument ( '-l', '--level', help='compression level [6]',
+                             type=int, default=6 )
+    args = argparser.parse_args()
+    files = []
+    for f in args.files:
+        if os.path.isdir ( f ):
+            files += sorted ( glob.glob ( f"{f}/*.gz" ) )
+        else:
+            files.append ( f )
+    for f in files:
+        t0 = time.time()
+        if args.decompress:
+            outfile = f[:-3] if f.endswith ( ".gz" ) else f"{f}.out"
+            n = decompress ( f, outfile, args.threads )
+            print ( f"[blockGzip] {f} -> {outfile}: {n/1e6:.1f} MB in {time.time()-t0:.1f}s" )
+            continue
+        if isBlockGzip ( f ):
+            continue
+        outfile = f if f.endswith ( ".gz" ) else f"{f}.gz"
+        try:
+            stats = compress ( f, outfile, args.level, args.threads )
+        except (EOFError,zlib.error) as e:
+            print ( f"[blockGzip] cannot compress {f}: {e}" )
+            continue
+        print ( f"[blockGzip] {f} -> {outfile}: {stats['insize']/1e6:.1f} -> {stats['outsize']/1e6:.1f} MB, {stats['nmembers']} members, in {time.time()-t0:.1f}s" )
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: checkpoint
+   :synopsis: bookkeeping of the completed stages of a mass point, so that
+              a crashed or pre-empted point can be resumed from the last
+              completed stage, instead of regenerating it from scratch.
+              the stages are: output (mg5 process directory),
+              lhe (parton level events), hepmc (showered events),
+              recast.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, time, socket, json, gzip, zlib
+from typing import Union, Dict
+
+stages = [ "output", "lhe", "hepmc", "recast" ]
+
+class Checkpoint:
+    def __init__ ( self, topo : str, masses, sqrts : int,
+                   dirname : Union[str,None] = None ):
+        """
+        :param topo: e.g. T2
+        :param masses: the mass tuple, e.g. (500,100)
+        :param dirname: where to keep the checkpoint files,
+                        default is checkpoints/ in the base directory
+        """
+        self.topo = topo
+        self.masses = masses
+        self.sqrts = sqrts
+        if dirname is None:
+            import bakeryHelpers
+            dirname = os.path.join ( bakeryHelpers.baseDir(), "checkpoints" )
+        self.dirname = dirname
+        smasses = "_".join ( map ( str, masses ) )
+        self.filename = os.path.join ( self.dirname,
+                f"{topo}_{smasses}.{sqrts}.json" )
+
+    def msg ( self, *msg ):
+        print ( "[checkpoint] %s" % " ".join ( msg ) )
+
+    def read ( self ) -> Dict:
+        """ read all stages that have been recorded """
+        if not os.path.exists ( self.filename ):
+            return {}
+        try:
+            with open ( self.filename, "rt" ) as f:
+                ret = json.load ( f )
+                f.close()
+            return ret
+        except (json.JSONDecodeError,OSError) as e:
+            self.msg ( f"cannot read {self.filename}: {e}. ignore it." )
+            return {}
+
+    def write ( self, D : Dict ):
+        """ write atomically, we might get killed any time """
+        os.makedirs ( self.dirname, exist_ok=True )
+        tmp = f"{self.filename}.{os.getpid()}"
+        with open ( tmp, "wt" ) as f:
+            json.dump ( D, f )
+            f.close()
+        os.replace ( tmp, self.filename )
+
+    def done ( self, stage : str, **info ):
+        """ mark stage as completed
+        :param info: anything we wish to remember, e.g. the path of
+                     the artefact
+        """
+        if not stage in stages:
+            raise Exception ( f"unknown stage {stage}" )
+        D = self.read()
+        info["t"] = time.time()
+        info["host"] = socket.gethostname()
+        D[stage] = info
+        self.write ( D )
+
+    def has ( self, stage : str ) -> bool:
+        return stage in self.read()
+
+    def get ( self, stage : str ) -> Union[Dict,None]:
+        D = self.read()
+        if stage in D:
+            return D[stage]
+        return None
+
+    def last ( self ) -> Union[str,None]:
+        """ the last completed stage, None if none """
+        D = self.read()
+        ret = None
+        for stage in stages:
+            if stage in D:
+                ret = stage
+        return ret
+
+    def reset ( self, stage : Union[str,None] = None ):
+        """ forget about stage and all later stages.
+        :param stage: if None, forget everything
+        """
+        if stage is None:
+            if os.path.exists ( self.filename ):
+                os.unlink ( self.filename )
+            return
+        D = self.read()
+        idx = stages.index ( stage )
+        for s in stages[idx:]:
+            if s in D:
+                D.pop ( s )
+        if len(D)==0:
+            self.reset()
+            return
+        self.write ( D )
+
+def isCompleteLHE ( lhefile : str ) -> bool:
+    """ check if the (gzipped) lhe file is complete, i.e. it decompresses
+        without error and ends with the closing tag """
+    if not os.path.exists ( lhefile ) or os.stat ( lhefile ).st_size < 100:
+        return False
+    tail = b""
+    try:
+        opener = open
+        if lhefile.endswith ( ".gz" ):
+            opener = gzip.open
+        with opener ( lhefile, "rb" ) as f:
+            while True:
+                block = f.read ( 1 << 22 )
+                if block == b"":
+                    break
+                tail = ( tail + block )[-100:]
+            f.close()
+    except (OSError,EOFError,zlib.error) as e:
+        return False
+    return b"</LesHouchesEvents>" in tail
@@ -9,8 +9,8 @@
 
 import os, sys, colorama, subprocess, shutil, tempfile, time, io, glob
 import multiprocessing
-import bakeryHelpers
-import locker
+import bakeryHelpers, ingest
+import locker, tracer, resourceUsage, runner, hepmcTools
 from os import PathLike
 
 class CM2Wrapper:
@@ -34,11 +34,11 @@ class CM2Wrapper:
         self.keep = keep
         self.keephepmc = keephepmc
         self.basedir = bakeryHelpers.baseDir()
-        os.chdir ( self.basedir )
         self.locker = locker.Locker ( sqrts, topo, False )
         self.cm2tempdir = f"{self.basedir}/cm2tempdir/"
         self.cm2results = f"{self.basedir}/cm2results/"
         bakeryHelpers.mkdir ( self.cm2tempdir )
+        bakeryHelpers.mkdir ( f"{self.basedir}/temp" ) ## config files, gunzipped hepmcs
         self.cm2install = f"{self.basedir}/cm2/" 
         self.executable = f"{self.cm2install}/checkmate2/bin/CheckMATE"
         self.tempFiles = []
@@ -149,18 +149,18 @@ class CM2Wrapper:
     def gunzipHepmcFile ( self, hepmcfile : PathLike ) -> PathLike:
         """ given a zipped hepmc file, gunzip it, return path
         to gunzipped file """
-        import gzip
-        import shutil
-        outfile = hepmcfile.replace(".gz","").replace("mg5results","temp")
+        import blockGzip
+        outfile = os.path.join ( self.basedir, "temp",
+                os.path.basename ( hepmcfile ).replace(".gz","") )
         if not self.keephepmc:
             self.tempFiles.append ( hepmcfile )
         self.tempFiles.append ( outfile )
         if os.path.exists ( outfile ):
             self.info ( f"skipping gunzip: {outfile} exists" )
             return outfile
-        with gzip.open( hepmcfile, 'rb') as f_in:
-            with open( outfile, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        with tracer.span ( "decompress" ):
+            ## block gzip files are inflated in parallel
+            blockGzip.decompress ( hepmcfile, outfile )
         self.info ( f"gunzip tarred hepmc file to {outfile}" )
         return outfile
         
@@ -197,17 +197,23 @@ class CM2Wrapper:
         self.instanceName = f"{self.analyses}_{self.topo}_{mass_stripped}"
         print ( f"[cm2Wrapper] initialse checkmate {self.ver} for {self.analyses}" )
         self.checkInstallation()
+        tracer.updateContext ( topo = self.topo, masses = masses,
+                               analysis = self.analyses, sqrts = self.sqrts )
         if not os.path.exists ( self.outputfile() ):
             self.createConfigFile ( masses, hepmcfile )
-            self.executeCheckMate()
-        effs = self.extractEfficiencies()
+            with tracer.span ( "checkmate" ):
+                self.executeCheckMate()
+        with tracer.span ( "extract_efficiencies" ):
+            effs = self.extractEfficiencies()
         if len(effs)>0:
+            effs.update ( resourceUsage.totals ( self.topo, masses, self.sqrts ) )
             ananame = bakeryHelpers.cm2AnaNameToSModelSName ( self.analyses )
-            effi_file = bakeryHelpers.getEmbakedName ( ananame, self.topo, "cm2" )
+            effi_file = os.path.join ( self.basedir,
+                    bakeryHelpers.getEmbakedName ( ananame, self.topo, "cm2" ) )
             bakeryHelpers.writeEmbaked ( effs, effi_file, masses, "cm2" )
             self.tempFiles.append ( self.outputfile( final=True ) )
-            self.tempFiles.append ( self.cm2tempdir )
-            self.tempFiles.append ( self.cm2results )
+            ## only our own subdirectories, other processes use the parent dirs
+            self.tempFiles.append ( f"{self.cm2results}/{self.instanceName}" )
             self.tempFiles.append ( f"{self.cm2tempdir}/{self.instanceName}" )
         self.clean()
         # self.unlock()
@@ -221,28 +227,10 @@ class CM2Wrapper:
             else:
                 self.error ( f"{self.outputfile( final=True )} not found, cannot extract any efficiencies" )
             return {}
-        inSignalRegions = False
-        effs = {}
-        nevents = -1
-        SumOfWeights = -1
-        with open ( self.outputfile() ) as f:
-            lines = f.readlines()
-            for line in lines:
-                if line.startswith("MCEvents:"):
-                    line = line.replace("MCEvents:","").strip()
-                    nevents = int ( line )
-                if line.startswith(" SumOfWeights:"):
-                    line = line.replace(" SumOfWeights:","").strip()
-                    SumOfWeights = float ( line )
-                if inSignalRegions:
-                    tokens = line.split()
-                    effs[tokens[0]] = float(tokens[3])
-                if inSignalRegions == False and not line.startswith("SR"):
-                    continue
-                inSignalRegions = True
-
-            f.close()
-        effs["__SumOfWeights__"]= SumOfWeights
+        effs, nevents = {}, -1
+        for r in ingest.parseCM2 ( self.outputfile(), self.analyses, self.topo, () ):
+            effs[r.sr] = r.eff
+            nevents = r.nevents
         effs["__nevents__"]= nevents
         return effs
 
@@ -257,14 +245,9 @@ class CM2Wrapper:
 
     def executeCheckMate ( self ):
         """ run checkmate! """
-        run = subprocess.Popen( f'{self.executable} {self.configfile}',
-                shell=True, stdout=subprocess.PIPE,stderr=subprocess.PIPE)# ,cwd=checkmateBin)
-        output,errorMsg= run.communicate()
-        errorMsg = errorMsg.decode("UTF-8")
-        if len(errorMsg)>0:
-            self.info( f'CheckMATE error: {errorMsg}' )
-            output = output.decode("UTF-8")
-            self.info( f'CheckMATE output:\n {output}\n' )
+        r = runner.run ( f'{self.executable} {self.configfile}', cwd = self.basedir )
+        if r["returncode"] != 0:
+            self.info( f'CheckMATE error {r["returncode"]}, see {r["logfile"]}:\n {r["tail"]}\n' )
         # at this point we move the result from cm2tempdir to cm2results 
         bakeryHelpers.mkdir ( self.cm2results )
         if os.path.exists ( self.outputfile() ):
@@ -273,18 +256,17 @@ class CM2Wrapper:
         self.tempFiles.append ( self.outputfile() )
 
 
-    def exe ( self, cmd, maxLength=100 ):
+    def exe ( self, cmd, maxLength=100, cwd=None ):
         """ execute cmd in shell
-        :param maxLength: maximum length of output to be printed
+        :param maxLength: maximum length of output to be printed,
+                          all output goes to the log file of the point,
+                          see runner.run
+        :param cwd: the working directory of cmd, default is basedir
         """
-        self.msg ( f"exec: [{os.getcwd()}] {cmd}" )
-        pipe = subprocess.Popen ( cmd, shell=True, stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE )
-        ret=""
-        for line in io.TextIOWrapper(pipe.stdout, encoding="latin1"):
-            ret+=line
-        for line in io.TextIOWrapper(pipe.stderr, encoding="latin1"):
-            ret+=line
+        if cwd is None:
+            cwd = self.basedir
+        self.msg ( f"exec: [{cwd}] {cmd}" )
+        ret = runner.run ( cmd, cwd = cwd, tailBytes = maxLength if maxLength is not None else 1<<20 )["tail"]
         ret = ret.strip()
         if len(ret)==0:
             return
@@ -306,7 +288,8 @@ class CM2Wrapper:
                 if os.path.isdir ( t ):
                     shutil.rmtree ( t )
                 else:
-                    os.unlink ( t )
+                    ## the hepmc files come with an index
+                    hepmcTools.remove ( t )
         return
 
     def _delete_dir(self, f):
@@ -345,7 +328,15 @@ if __name__ == "__main__":
                              type=int, default=1 )
     argparser.add_argument ( '-r', '--rerun', help='force rerun, even if there is a summary file already',
                              action="store_true" )
+    argparser.add_argument ( '--profile', help='profile the python code with cProfile, per process, write the results to profiles/',
+                             action="store_true" )
+    argparser.add_argument ( '--profile_sample', help='when profiling, also sample the stacks every so many seconds. 0 means no sampling [0.]',
+                             type=float, default=0. )
+    argparser.add_argument ( '--threads', help='run the nprocesses chunks in threads of one process, instead of separate processes',
+                             action="store_true" )
     args = argparser.parse_args()
+    import profiler
+    t0 = time.time()
     if args.list_analyses:
         cm2 = CM2Wrapper( args.topo, args.njets, args.rerun, args.analyses )
         cm2.list_analyses()
@@ -372,6 +363,7 @@ if __name__ == "__main__":
     djobs = int(len(masses)/nprocesses)
 
     def runChunk ( chunk, pid ):
+        cm2 = cm2s[pid]
         for c in chunk:
             hashepmc = cm2.locker.hasHEPMC ( c )
             hepmcfile = cm2.locker.hepmcFileName ( c )
@@ -384,11 +376,33 @@ if __name__ == "__main__":
                     cm2.info ( f"skipping {hepmcfile}: is locked." )
                     
 
-    jobs=[]
+    chunks = []
     for i in range(nprocesses):
         chunk = masses[djobs*i:djobs*(i+1)]
         if i == nprocesses-1:
             chunk = masses[djobs*i:]
-        p = multiprocessing.Process(target=runChunk, args=(chunk,i))
+        chunks.append ( chunk )
+    if args.threads:
+        ## one wrapper per thread, they keep the state of their current point
+        cm2s = [ cm2 ] + [ CM2Wrapper( args.topo, args.njets, args.rerun, args.analyses,
+                   args.keep, args.sqrts ) for i in range(1,nprocesses) ]
+        from concurrent.futures import ThreadPoolExecutor
+        ## cProfile sees only its own thread, so we profile in every task
+        task = profiler.wrap ( runChunk, "cm2Wrapper", args.profile, args.profile_sample )
+        with ThreadPoolExecutor ( max_workers = nprocesses ) as executor:
+            for f in [ executor.submit ( task, chunk, i ) for i, chunk in enumerate ( chunks ) ]:
+                f.result()
+        if args.profile:
+            print ( profiler.merge ( "cm2Wrapper", since = t0 ) )
+        sys.exit()
+    cm2s = [ cm2 ] * nprocesses
+    jobs=[]
+    for i, chunk in enumerate ( chunks ):
+        p = multiprocessing.Process(target=profiler.wrap ( runChunk,
+                "cm2Wrapper", args.profile, args.profile_sample ), args=(chunk,i))
         jobs.append ( p )
         p.start()
+    if args.profile:
+        for j in jobs:
+            j.join()
+        print ( profiler.merge ( "cm2Wrapper", since = t0 ) )
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: compileCache
+        :synopsis: a small ccache-like object cache for the Fortran and C/C++
+                   compilations that MG5 triggers for every process directory.
+                   The compilers are replaced by little wrapper scripts (see
+                   setup), which hash the compiler, its arguments and the
+                   (preprocessed) source, and serve the object file from
+                   the cache whenever they can.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, shutil, subprocess, hashlib, re, json, tempfile, fcntl
+from typing import List, Dict, Union
+
+__sourceExtensions__ = { ".f": "fortran", ".F": "fortran", ".for": "fortran",
+        ".f90": "fortran", ".F90": "fortran", ".c": "c", ".cc": "c",
+        ".cpp": "c", ".cxx": "c", ".C": "c" }
+## bump if the hashing scheme changes
+__version__ = "1"
+
+def defaultCacheDir() -> str:
+    """ the default location of the cache, below the base dir """
+    import bakeryHelpers
+    return os.path.join ( bakeryHelpers.baseDir(), "compilecache" )
+
+class CompileCache:
+    def __init__ ( self, cachedir : Union[str,None] = None,
+                   maxsize : float = 5. ):
+        """
+        :param cachedir: where the objects and the stats live. if None,
+                         use compilecache/ in the base dir
+        :param maxsize: maximum size of the cache, in GB
+        """
+        if cachedir is None:
+            cachedir = defaultCacheDir()
+        self.cachedir = os.path.abspath ( cachedir )
+        self.objdir = os.path.join ( self.cachedir, "o" )
+        self.bindir = os.path.join ( self.cachedir, "bin" )
+        self.statsfile = os.path.join ( self.cachedir, "stats.json" )
+        self.maxsize = int ( maxsize * 1024**3 )
+        os.makedirs ( self.objdir, exist_ok=True )
+
+    def msg ( self, *msg ):
+        print ( "[compileCache] %s" % " ".join ( msg ) )
+
+    def setup ( self, compilers : Dict = None ) -> Dict:
+        """ write the wrapper scripts to <cachedir>/bin
+        :param compilers: dictionary of e.g. { "fortran": "gfortran", "cpp": "g++" }.
+        :returns: dictionary with the paths of the wrappers, same keys
+        """
+        if compilers is None:
+            compilers = { "fortran": os.environ.get ( "FC", "gfortran" ),
+                          "cpp": os.environ.get ( "CXX", "g++" ) }
+        os.makedirs ( self.bindir, exist_ok=True )
+        ret = {}
+        me = os.path.abspath ( __file__ )
+        for lang, compiler in compilers.items():
+            real = shutil.which ( compiler )
+            if real is None:
+                self.msg ( f"cannot find {lang} compiler {compiler}, not caching it" )
+                continue
+            real = os.path.realpath ( real )
+            wrapper = os.path.join ( self.bindir, os.path.basename ( compiler ) )
+            txt = "#!/bin/sh\n"
+            txt += "# generated by compileCache.py, do not edit\n"
+            txt += f'exec {sys.executable} {me} --cachedir {self.cachedir} --maxsize {self.maxsize/1024**3} --compiler {real} -- "$@"\n'
+            ## write atomically, many workers may set up at once
+            tmp = wrapper + f".{os.getpid()}"
+            with open ( tmp, "wt" ) as f:
+                f.write ( txt )
+                f.close()
+            os.chmod ( tmp, 0o755 )
+            os.replace ( tmp, wrapper )
+            ret[lang] = wrapper
+        return ret
+
+    def _findSource ( self, args : List[str] ):
+        """ analyse the compiler arguments. we only cache the simple
+            'compile one source file into one object file' case.
+        :returns: tuple of ( source, object ), or None if we shouldnt cache
+        """
+        if not "-c" in args:
+            return None
+        sources, obj = [], None
+        skipNext = False
+        for i,a in enumerate ( args ):
+            if skipNext:
+                skipNext = False
+                continue
+            if a == "-o":
+                if i+1 >= len(args):
+                    return None
+                obj = args[i+1]
+                skipNext = True
+                continue
+            if a.startswith ( "-" ):
+                ## -J, -M write module files, -MD etc write dependency files
+                if a in [ "-J", "-M", "-MM", "-MD", "-MMD", "-MF", "-save-temps" ] or \
+                        a.startswith ( "-J" ) or a.startswith ( "-fprofile" ):
+                    return None
+                if a in [ "-I", "-D", "-U", "-include", "-isystem" ]:
+                    skipNext = True
+                continue
+            ext = os.path.splitext ( a )[1]
+            if ext in __sourceExtensions__:
+                sources.append ( a )
+        if len(sources) != 1:
+            return None
+        source = sources[0]
+        if obj is None:
+            obj = os.path.splitext ( os.path.basename ( source ) )[0] + ".o"
+        return source, obj
+
+    def _compilerId ( self, compiler : str ) -> str:
+        """ identify the compiler by path, size, and mtime """
+        st = os.stat ( compiler )
+        return f"{compiler}:{st.st_size}:{int(st.st_mtime)}"
+
+    def _includeDirs ( self, args : List[str], srcdir : str ) -> List[str]:
+        ret = [ srcdir, os.getcwd() ]
+        for i,a in enumerate ( args ):
+            if a == "-I" and i+1 < len(args):
+                ret.append ( args[i+1] )
+            elif a.startswith ( "-I" ) and len(a)>2:
+                ret.append ( a[2:] )
+        return ret
+
+    def _fortranContent ( self, source : str, args : List[str],
+                          h, seen : set ) -> bool:
+        """ hash the content of a fortran file and, recursively, of all
+            the files it includes. MG5 generates e.g. nexternal.inc
+            per process, so the includes matter.
+        :returns: False, if we cannot cache this file (e.g. it defines
+                  a fortran module, which would write a .mod file)
+        """
+        rinclude = re.compile ( r"^\s*(?:#\s*include|include)\s*['\"<]([^'\">]+)['\">]",
+                                re.IGNORECASE )
+        rmodule = re.compile ( r"^\s*module\s+(?!procedure)\w+", re.IGNORECASE )
+        with open ( source, "rb" ) as f:
+            content = f.read()
+            f.close()
+        h.update ( content )
+        srcdir = os.path.dirname ( os.path.abspath ( source ) )
+        dirs = self._includeDirs ( args, srcdir )
+        for line in content.decode ( "latin1" ).splitlines():
+            if rmodule.match ( line ):
+                return False
+            m = rinclude.match ( line )
+            if m is None:
+                continue
+            name = m.group(1)
+            found = None
+            for d in dirs:
+                candidate = os.path.join ( d, name )
+                if os.path.exists ( candidate ):
+                    found = os.path.abspath ( candidate )
+                    break
+            if found is None:
+                ## probably a system include, the compiler will complain
+                h.update ( f"missing:{name}".encode() )
+                continue
+            if found in seen:
+                continue
+            seen.add ( found )
+            h.update ( f"include:{name}".encode() )
+            if not self._fortranContent ( found, args, h, seen ):
+                return False
+        return True
+
+    def _key ( self, compiler : str, args : List[str], source : str,
+               obj : str ) -> Union[str,None]:
+        """ compute the cache key of this compilation, None if we cant """
+        h = hashlib.sha256()
+        h.update ( f"compileCache{__version__}".encode() )
+        h.update ( self._compilerId ( compiler ).encode() )
+        cwd = os.getcwd()
+        ## the arguments, without the output file and the source name, so
+        ## that identical sources in different process directories hit
+        skip = False
+        for i,a in enumerate ( args ):
+            if skip:
+                skip = False
+                continue
+            if a == "-o":
+                skip = True
+                continue
+            if a == source:
+                continue
+            h.update ( a.replace ( cwd, "." ).encode() + b"\0" )
+        lang = __sourceExtensions__[ os.path.splitext ( source )[1] ]
+        if lang == "fortran":
+            if not self._fortranContent ( source, args, h, set() ):
+                return None
+        else:
+            ## C/C++: let the preprocessor resolve all includes for us
+            pargs = [ compiler ]
+            skip = False
+            for i,a in enumerate ( args ):
+                if skip:
+                    skip = False
+                    continue
+                if a in [ "-c" ]:
+                    continue
+                if a == "-o":
+                    skip = True
+                    continue
+                pargs.append ( a )
+            pargs.append ( "-E" )
+            proc = subprocess.run ( pargs, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL )
+            if proc.returncode != 0:
+                return None
+            ## line markers carry the absolute path of the process dir
+            h.update ( proc.stdout.replace ( cwd.encode(), b"." ) )
+        return h.hexdigest()
+
+    def objectPath ( self, key : str ) -> str:
+        return os.path.join ( self.objdir, key[:2], key[2:] + ".o" )
+
+    def updateStats ( self, hits : int = 0, misses : int = 0,
+                      uncacheable : int = 0, added : int = 0,
+                      evicted : int = 0, size : Union[int,None] = None ) -> Dict:
+        """ update the statistics, under an flock, since many
+            compilers run in parallel """
+        os.makedirs ( self.cachedir, exist_ok=True )
+        with open ( self.statsfile, "a+" ) as f:
+            fcntl.flock ( f, fcntl.LOCK_EX )
+            f.seek ( 0 )
+            txt = f.read()
+            stats = { "hits": 0, "misses": 0, "uncacheable": 0, "size": 0,
+                      "evicted": 0 }
+            try:
+                stats.update ( json.loads ( txt ) )
+            except json.JSONDecodeError:
+                pass
+            stats["hits"] += hits
+            stats["misses"] += misses
+            stats["uncacheable"] += uncacheable
+            stats["evicted"] += evicted
+            stats["size"] += added
+            if size is not None:
+                stats["size"] = size
+            f.seek ( 0 )
+            f.truncate ()
+            f.write ( json.dumps ( stats ) )
+            f.flush()
+            fcntl.flock ( f, fcntl.LOCK_UN )
+            f.close()
+        return stats
+
+    def stats ( self ) -> Dict:
+        """ the current statistics """
+        return self.updateStats()
+
+    def evict ( self ):
+        """ remove the least recently used objects, until we are well
+            below maxsize """
+        objects = []
+        for root, dirs, files in os.walk ( self.objdir ):
+            for fname in files:
+                path = os.path.join ( root, fname )
+                try:
+                    st = os.stat ( path )
+                except FileNotFoundError:
+                    continue
+                objects.append ( ( st.st_mtime, st.st_size, path ) )
+        objects.sort()
+        total = sum ( x[1] for x in objects )
+        target = .8 * self.maxsize
+        nevicted = 0
+        for mtime, size, path in objects:
+            if total <= target:
+                break
+            try:
+                os.unlink ( path )
+                total -= size
+                nevicted += 1
+            except FileNotFoundError:
+                pass
+        self.updateStats ( evicted = nevicted, size = total )
+
+    def clear ( self ):
+        """ remove all objects, reset stats """
+        shutil.rmtree ( self.objdir, ignore_errors = True )
+        os.makedirs ( self.objdir, exist_ok=True )
+        if os.path.exists ( self.statsfile ):
+            os.unlink ( self.statsfile )
+
+    def compile ( self, compiler : str, args : List[str] ) -> int:
+        """ the wrapped compiler call.
+        :returns: the return code of the compiler
+        """
+        analysed = self._findSource ( args )
+        key = None
+        if analysed is not None:
+            source, obj = analysed
+            try:
+                key = self._key ( compiler, args, source, obj )
+            except (OSError,UnicodeError) as e:
+                key = None
+        if key is None:
+            self.updateStats ( uncacheable = 1 )
+            return subprocess.call ( [ compiler ] + args )
+        cached = self.objectPath ( key )
+        if os.path.exists ( cached ):
+            try:
+                tmp = obj + f".ccache{os.getpid()}"
+                shutil.copyfile ( cached, tmp )
+                os.replace ( tmp, obj )
+                os.utime ( cached ) ## for the LRU eviction
+                self.updateStats ( hits = 1 )
+                return 0
+            except OSError as e:
+                pass
+        ret = subprocess.call ( [ compiler ] + args )
+        if ret != 0 or not os.path.exists ( obj ):
+            return ret
+        os.makedirs ( os.path.dirname ( cached ), exist_ok=True )
+        fd, tmp = tempfile.mkstemp ( dir=os.path.dirname ( cached ) )
+        os.close ( fd )
+        shutil.copyfile ( obj, tmp )
+        os.replace ( tmp, cached )
+        stats = self.updateStats ( misses = 1, added = os.stat ( cached ).st_size )
+        if stats["size"] > self.maxsize:
+            self.evict()
+        return ret
+
+    def mg5Commands ( self, wrappers : Dict ) -> str:
+        """ the mg5 commands that wire the wrappers in, to be
+            written into the mg5 process card before 'output' """
+        ret = ""
+        if "fortran" in wrappers:
+            ret += f"set fortran_compiler {wrappers['fortran']}\n"
+        if "cpp" in wrappers:
+            ret += f"set cpp_compiler {wrappers['cpp']}\n"
+        return ret
+
+    def printStats ( self ):
+        stats = self.stats()
+        n = stats["hits"] + stats["misses"]
+        rate = 0.
+        if n > 0:
+            rate = 100. * stats["hits"] / n
+        print ( f"[compileCache] {self.cachedir}" )
+        print ( f"    hits {stats['hits']}, misses {stats['misses']} ({rate:.1f}% hit rate), uncacheable {stats['uncacheable']}" )
+        print ( f"    size {stats['size']/1024**2:.1f} MB of {self.maxsize/1024**3:.1f} GB, evicted {stats['evicted']}" )
+
+def main():
+    import argparse
+    if "--" in sys.argv:
+        ## we are called as a compiler wrapper
+        p = sys.argv.index ( "--" )
+        ownargs, compilerargs = sys.argv[1:p], sys.argv[p+1:]
+    else:
+        ownargs, compilerargs = sys.argv[1:], None
+    argparser = argparse.ArgumentParser(description='a compiler cache for the MG5 builds.')
+    argparser.add_argument ( '-d', '--cachedir', help='the cache directory [<basedir>/compilecache]',
+                             type=str, default=None )
+    argparser.add_argument ( '-M', '--maxsize', help='maximum size of the cache, in GB [5.]',
+                             type=float, default=5. )
+    argparser.add_argument ( '--compiler', help='the real compiler, when called as a wrapper',
+                             type=str, default=None )
+    argparser.add_argument ( '-s', '--stats', help='show cache statistics',
+                             action="store_true" )
+    argparser.add_argument ( '-C', '--clear', help='clear the cache',
+                             action="store_true" )
+    argparser.add_argument ( '--setup', help='(re)write the compiler wrappers',
+                             action="store_true" )
+    args = argparser.parse_args( ownargs )
+    cache = CompileCache ( args.cachedir, args.maxsize )
+    if compilerargs is not None:
+        if args.compiler is None:
+            print ( "[compileCache] called as a wrapper, but no --compiler given" )
+            sys.exit(-1)
+        sys.exit ( cache.compile ( args.compiler, compilerargs ) )
+    if args.clear:
+        cache.clear()
+    if args.setup:
+        wrappers = cache.setup()
+        for k,v in wrappers.items():
+            print ( f"[compileCache] {k}: {v}" )
+    if args.stats or not ( args.clear or args.setup ):
+        cache.printStats()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: coordinator
+   :synopsis: a lightweight coordinator that owns the list of mass points
+              to be produced, and workers on any node that lease points
+              from it, over TCP or a unix socket. the protocol is one
+              json line per request, one reply per request:
+
+              * hello: get the configuration (the mg5Wrapper arguments)
+              * lease: get a point to work on, a token, and the lease time
+              * progress: report the stage a point is in, renews the lease
+              * complete: report the result, a point is completed only once
+              * fail: report a failure, point gets retried with back-off
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, json, socket, socketserver, threading, random, uuid
+import colorama
+from typing import List, Dict, Union, Callable
+
+def parseAddress ( address : str ):
+    """ "unix:/path/to/socket" or "/path/to/socket" is a unix socket,
+        "host:port" is tcp.
+    :returns: tuple of family, and address as needed by socket
+    """
+    if address.startswith ( "unix:" ):
+        return socket.AF_UNIX, address[5:]
+    if "/" in address or not ":" in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit ( ":", 1 )
+    return socket.AF_INET, ( host, int(port) )
+
+class Coordinator:
+    def __init__ ( self, items : List[Dict], config : Dict,
+                   leaseTime : float = 600., maxRetries : int = 3,
+                   backoff : float = 60., statefile : Union[str,None] = None ):
+        """
+        :param items: the work list, every item is a dictionary with
+                      topo, masses, analyses, recaster
+        :param config: the configuration that is handed out to the workers
+        :param leaseTime: a point whose lease is not renewed for that many
+                          seconds goes back into the queue
+        :param maxRetries: give up on a point after so many failures
+        :param backoff: wait that many seconds before retrying a failed
+                        point, doubled with every failure
+        :param statefile: if given, keep track of the state there, so a
+                          restarted coordinator does not redo finished points
+        """
+        self.config = config
+        self.leaseTime = leaseTime
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.statefile = statefile
+        self.mutex = threading.Lock()
+        self.items = {}
+        for item in items:
+            smasses = "_".join ( map ( str, item["masses"] ) )
+            iid = f"{item['topo']}_{smasses}"
+            self.items[iid] = { "id": iid, "item": item, "state": "pending",
+                "attempts": 0, "token": None, "expiry": 0., "notBefore": 0.,
+                "worker": None, "stage": None, "result": None, "errors": [] }
+        self.load()
+        self.t0 = time.time()
+
+    def info ( self, *msg ):
+        print ( "%s[coordinator] %s%s" % ( colorama.Fore.YELLOW, " ".join ( msg ), \
+                   colorama.Fore.RESET ) )
+
+    def msg ( self, *msg):
+        print ( "[coordinator] %s" % " ".join ( msg ) )
+
+    def error ( self, *msg ):
+        print ( "%s[coordinator] %s%s" % ( colorama.Fore.RED, " ".join ( msg ), \
+                   colorama.Fore.RESET ) )
+
+    def load ( self ):
+        """ pick up the finished points of a previous coordinator """
+        if self.statefile is None or not os.path.exists ( self.statefile ):
+            return
+        with open ( self.statefile, "rt" ) as f:
+            D = json.load ( f )
+            f.close()
+        ndone = 0
+        for iid, entry in D.items():
+            if not iid in self.items or not entry["state"] in [ "done", "failed" ]:
+                continue
+            self.items[iid].update ( entry )
+            ndone += 1
+        self.info ( f"{ndone} points already finished according to {self.statefile}" )
+
+    def save ( self ):
+        """ write the state atomically. call with the mutex held. """
+        if self.statefile is None:
+            return
+        tmp = f"{self.statefile}.{os.getpid()}"
+        D = {}
+        for iid, entry in self.items.items():
+            D[iid] = { k:v for k,v in entry.items() if k in [ "state", \
+                       "attempts", "result", "errors", "worker" ] }
+        with open ( tmp, "wt" ) as f:
+            json.dump ( D, f )
+            f.close()
+        os.replace ( tmp, self.statefile )
+
+    def requeueExpired ( self ):
+        """ put points with expired leases back into the queue.
+            call with the mutex held. """
+        t = time.time()
+        for entry in self.items.values():
+            if entry["state"] == "leased" and t > entry["expiry"]:
+                self.info ( f"lease of {entry['id']} by {entry['worker']} expired, requeue" )
+                entry["state"] = "pending"
+                entry["token"] = None
+
+    def count ( self ) -> Dict:
+        """ number of points per state """
+        ret = { "pending": 0, "leased": 0, "done": 0, "failed": 0 }
+        for entry in self.items.values():
+            ret[entry["state"]] += 1
+        return ret
+
+    def isFinished ( self ) -> bool:
+        with self.mutex:
+            c = self.count()
+        return c["pending"] + c["leased"] == 0
+
+    def lease ( self, worker : str ) -> Dict:
+        """ hand out the next point
+        :returns: the item with its token, or the time to wait until asking
+                  again, or finished if there is nothing left to do
+        """
+        with self.mutex:
+            self.requeueExpired()
+            t = time.time()
+            wait = None
+            for entry in self.items.values():
+                if entry["state"] != "pending":
+                    continue
+                if entry["notBefore"] > t:
+                    dt = entry["notBefore"] - t
+                    wait = dt if wait is None else min ( wait, dt )
+                    continue
+                entry["state"] = "leased"
+                entry["token"] = uuid.uuid4().hex
+                entry["expiry"] = t + self.leaseTime
+                entry["worker"] = worker
+                entry["stage"] = None
+                entry["attempts"] += 1
+                self.msg ( f"lease {entry['id']} to {worker} (attempt #{entry['attempts']})" )
+                return { "id": entry["id"], "token": entry["token"],
+                         "item": entry["item"], "leaseTime": self.leaseTime }
+            c = self.count()
+            if c["pending"] + c["leased"] == 0:
+                return { "finished": True }
+            if wait is None: ## all remaining points are leased
+                wait = self.leaseTime / 4.
+            return { "wait": min ( wait, 30. ) }
+
+    def progress ( self, iid : str, token : str, stage : Union[str,None] ) -> Dict:
+        """ the worker is still alive, and at stage. renews the lease. """
+        with self.mutex:
+            if not iid in self.items:
+                return { "ok": False, "error": f"unknown point {iid}" }
+            entry = self.items[iid]
+            if entry["state"] != "leased" or entry["token"] != token:
+                return { "ok": False, "error": "lease lost" }
+            entry["expiry"] = time.time() + self.leaseTime
+            if stage != entry["stage"]:
+                self.msg ( f"{iid} at stage {stage} on {entry['worker']}" )
+            entry["stage"] = stage
+            return { "ok": True }
+
+    def complete ( self, iid : str, token : str, result : Dict ) -> Dict:
+        """ a point is done. we accept the result also from a worker
+            whose lease expired, as long as nobody completed it before.
+            completing a completed point again is acknowledged, but ignored. """
+        with self.mutex:
+            if not iid in self.items:
+                return { "ok": False, "error": f"unknown point {iid}" }
+            entry = self.items[iid]
+            if entry["state"] == "done":
+                return { "ok": True, "duplicate": True }
+            if entry["token"] != token:
+                self.info ( f"{iid} completed with an expired lease, accept it" )
+            entry["state"] = "done"
+            entry["token"] = None
+            entry["result"] = result
+            self.save()
+            c = self.count()
+            self.msg ( f"{iid} done. {c['done']} done, {c['pending']} pending, {c['leased']} leased, {c['failed']} failed" )
+            return { "ok": True, "duplicate": False }
+
+    def fail ( self, iid : str, token : str, err : str ) -> Dict:
+        """ a point failed, retry later, or give up on it """
+        with self.mutex:
+            if not iid in self.items:
+                return { "ok": False, "error": f"unknown point {iid}" }
+            entry = self.items[iid]
+            if entry["state"] != "leased" or entry["token"] != token:
+                return { "ok": False, "error": "lease lost" }
+            entry["errors"].append ( err )
+            entry["token"] = None
+            if entry["attempts"] >= self.maxRetries:
+                self.error ( f"{iid} failed {entry['attempts']} times, give up: {err}" )
+                entry["state"] = "failed"
+                self.save()
+                return { "ok": True }
+            dt = self.backoff * 2**(entry["attempts"]-1)
+            self.info ( f"{iid} failed: {err}. retry in {dt:.0f}s" )
+            entry["state"] = "pending"
+            entry["notBefore"] = time.time() + dt
+            return { "ok": True }
+
+    def handle ( self, request : Dict ) -> Dict:
+        """ dispatch a request """
+        cmd = request.get ( "cmd", None )
+        if cmd == "hello":
+            return { "config": self.config, "leaseTime": self.leaseTime }
+        if cmd == "lease":
+            return self.lease ( request.get ( "worker", "?" ) )
+        if cmd == "progress":
+            return self.progress ( request["id"], request["token"],
+                                   request.get ( "stage", None ) )
+        if cmd == "complete":
+            return self.complete ( request["id"], request["token"],
+                                   request.get ( "result", {} ) )
+        if cmd == "fail":
+            return self.fail ( request["id"], request["token"],
+                               request.get ( "error", "" ) )
+        return { "error": f"unknown command {cmd}" }
+
+    def server ( self, address : str ):
+        """ create the socket server for address """
+        family, addr = parseAddress ( address )
+        coordinator = self
+        class Handler ( socketserver.StreamRequestHandler ):
+            def handle ( self ):
+                line = self.rfile.readline()
+                try:
+                    reply = coordinator.handle ( json.loads ( line ) )
+                except ( ValueError, KeyError ) as e:
+                    reply = { "error": f"cannot handle {line}: {e}" }
+                self.wfile.write ( ( json.dumps ( reply ) + "\n" ).encode() )
+        if family == socket.AF_UNIX:
+            if os.path.exists ( addr ):
+                os.unlink ( addr )
+            server = socketserver.ThreadingUnixStreamServer ( addr, Handler )
+        else:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            server = socketserver.ThreadingTCPServer ( addr, Handler )
+        server.daemon_threads = True
+        return server
+
+    def serve ( self, address : str, linger : float = 5. ):
+        """ serve until all points are done or failed
+        :param linger: keep on serving for that many seconds after we are
+                       finished, so the workers learn that we are done
+        """
+        server = self.server ( address )
+        thread = threading.Thread ( target = server.serve_forever, daemon = True )
+        thread.start()
+        self.info ( f"serving {len(self.items)} points at {address}" )
+        try:
+            while not self.isFinished():
+                time.sleep ( 1. )
+            time.sleep ( linger )
+        finally:
+            server.shutdown()
+            server.server_close()
+            family, addr = parseAddress ( address )
+            if family == socket.AF_UNIX and os.path.exists ( addr ):
+                os.unlink ( addr )
+        with self.mutex:
+            c = self.count()
+        self.info ( f"finished after {time.time()-self.t0:.1f}s: {c['done']} done, {c['failed']} failed" )
+        return c
+
+class Worker:
+    def __init__ ( self, address : str, name : Union[str,None] = None,
+                   backoff : float = 2., maxBackoff : float = 300.,
+                   patience : float = 3600. ):
+        """
+        :param address: the address of the coordinator
+        :param backoff: initial wait time if the coordinator is unreachable
+        :param maxBackoff: maximum wait time between attempts
+        :param patience: give up if we cannot reach the coordinator for
+                         that many seconds
+        """
+        self.address = address
+        if name is None:
+            name = f"{socket.gethostname()}:{os.getpid()}"
+        self.name = name
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.patience = patience
+        self.leaseTime = 600.
+
+    def msg ( self, *msg):
+        print ( "[worker:%s] %s" % ( self.name, " ".join ( msg ) ) )
+
+    def send ( self, request : Dict ) -> Dict:
+        """ send one request, return the reply """
+        family, addr = parseAddress ( self.address )
+        with socket.socket ( family, socket.SOCK_STREAM ) as s:
+            s.settimeout ( 60. )
+            s.connect ( addr )
+            s.sendall ( ( json.dumps ( request ) + "\n" ).encode() )
+            with s.makefile ( "rb" ) as f:
+                line = f.readline()
+        if line == b"":
+            raise ConnectionError ( "empty reply" )
+        return json.loads ( line )
+
+    def request ( self, **request ) -> Union[Dict,None]:
+        """ send request, retry with exponential back-off and jitter
+        :returns: the reply, None if we ran out of patience
+        """
+        t0 = time.time()
+        dt = self.backoff
+        while True:
+            try:
+                return self.send ( request )
+            except ( OSError, ValueError ) as e:
+                if time.time() - t0 > self.patience:
+                    self.msg ( f"cannot reach coordinator at {self.address}: {e}. give up." )
+                    return None
+                wait = random.uniform ( .5 * dt, dt )
+                self.msg ( f"cannot reach coordinator at {self.address}: {e}. retry in {wait:.1f}s" )
+                time.sleep ( wait )
+                dt = min ( 2 * dt, self.maxBackoff )
+
+    def hello ( self ) -> Union[Dict,None]:
+        """ get the configuration from the coordinator """
+        reply = self.request ( cmd = "hello" )
+        if reply is None:
+            return None
+        self.leaseTime = reply["leaseTime"]
+        return reply["config"]
+
+    def heartbeat ( self, lease : Dict, stage : Callable, stop : threading.Event ):
+        """ renew the lease until stop is set, report the stage """
+        while not stop.wait ( self.leaseTime / 4. ):
+            reply = self.request ( cmd = "progress", id = lease["id"],
+                       token = lease["token"], stage = stage() )
+            if reply is not None and not reply.get ( "ok", False ):
+                self.msg ( f"progress of {lease['id']}: {reply.get('error','')}" )
+
+    def loop ( self, task : Callable, stage : Union[Callable,None] = None ):
+        """ lease points and work on them until the coordinator is done
+        :param task: task(item) performs the work, returns a dictionary with
+                     the result, raises an exception if it fails
+        :param stage: stage(item) returns the current stage of item
+        :returns: number of points we completed
+        """
+        ncompleted = 0
+        while True:
+            lease = self.request ( cmd = "lease", worker = self.name )
+            if lease is None or lease.get ( "finished", False ):
+                return ncompleted
+            if "wait" in lease:
+                time.sleep ( lease["wait"] )
+                continue
+            if "error" in lease:
+                self.msg ( f"coordinator error: {lease['error']}" )
+                return ncompleted
+            self.leaseTime = lease["leaseTime"]
+            item = lease["item"]
+            getStage = lambda: stage ( item ) if stage is not None else None
+            stop = threading.Event()
+            hb = threading.Thread ( target = self.heartbeat,
+                    args = ( lease, getStage, stop ), daemon = True )
+            hb.start()
+            try:
+                result = task ( item )
+                reply = self.request ( cmd = "complete", id = lease["id"],
+                                       token = lease["token"], result = result )
+                if reply is not None and not reply.get ( "duplicate", True ):
+                    ncompleted += 1
+            except Exception as e:
+                self.msg ( f"{lease['id']} failed: {e}" )
+                self.request ( cmd = "fail", id = lease["id"],
+                               token = lease["token"], error = str(e) )
+            finally:
+                stop.set()
+                hb.join()
+
+class MG5Task:
+    """ run a point with the mg5Wrapper, configured by the coordinator """
+    def __init__ ( self, config : Dict ):
+        self.config = config
+        self.wrappers = {}
+
+    def wrapper ( self, item : Dict ):
+        """ one MG5Wrapper per topology and recaster """
+        key = ( item["topo"], tuple(item["recaster"]) )
+        if not key in self.wrappers:
+            from mg5Wrapper import MG5Wrapper
+            args = dict ( self.config )
+            args["topo"] = item["topo"]
+            args["analyses"] = item["analyses"]
+            self.wrappers[key] = MG5Wrapper ( args, list(item["recaster"]) )
+        return self.wrappers[key]
+
+    def stage ( self, item : Dict ) -> Union[str,None]:
+        import checkpoint
+        return checkpoint.Checkpoint ( item["topo"], tuple(item["masses"]),
+                                       self.config["sqrts"] ).last()
+
+    def __call__ ( self, item : Dict ) -> Dict:
+        import checkpoint
+        mg5 = self.wrapper ( item )
+        masses = tuple ( item["masses"] )
+        t0 = time.time()
+        mg5.run ( masses, item["analyses"], os.getpid() )
+        ckpt = checkpoint.Checkpoint ( item["topo"], masses, self.config["sqrts"] )
+        stage = ckpt.last()
+        if mg5.recast and len ( item["recaster"] ) > 0:
+            ## the hepmc file alone does not mean that the recasting worked
+            done = ckpt.has ( "recast" )
+            what = "not recast"
+        else:
+            done = mg5.locker.hasHEPMC ( masses, mg5.nevents )
+            what = "no hepmc file"
+        if "MA5" in item["recaster"] and mg5.locker.hasMA5Files ( masses ):
+            done = True
+        if not done:
+            raise Exception ( f"{what} for {masses} [last stage {stage}]" )
+        return { "stage": stage, "dt": time.time() - t0,
+                 "host": socket.gethostname() }
+
+def runWorkers ( address : str, nworkers : int = 1 ):
+    """ run nworkers mg5 worker processes that get their work from the
+        coordinator at address """
+    import multiprocessing
+    def work ( i ):
+        worker = Worker ( address )
+        config = worker.hello()
+        if config is None:
+            return
+        task = MG5Task ( config )
+        n = worker.loop ( task, task.stage )
+        worker.msg ( f"completed {n} points" )
+    jobs = []
+    for i in range(nworkers):
+        p = multiprocessing.Process ( target = work, args = ( i, ) )
+        jobs.append ( p )
+        p.start()
+    for j in jobs:
+        j.join()
+
+def selftest ( nworkers : int = 4, npoints : int = 20, failrate : float = .2 ):
+    """ local stand-in: a coordinator and nworkers worker processes on a
+        unix socket, with a task that sleeps and fails randomly.
+        checks that every point is completed exactly once. """
+    import multiprocessing, tempfile
+    address = "unix:" + tempfile.mktemp ( prefix = "coordinator", suffix = ".sock" )
+    items = [ { "topo": "T2", "masses": [ m, 100 ], "analyses": "none",
+                "recaster": [] } for m in range(200,200+10*npoints,10) ]
+    coordinator = Coordinator ( items, {}, leaseTime = 2., maxRetries = 5,
+                                backoff = .2 )
+    def sleeper ( item ):
+        time.sleep ( random.uniform ( 0., .3 ) )
+        if random.uniform ( 0., 1. ) < failrate:
+            raise Exception ( "random failure" )
+        if random.uniform ( 0., 1. ) < failrate / 2.:
+            ## stall, so the lease expires and the point gets leased again
+            time.sleep ( 3. )
+        return { "masses": item["masses"] }
+    def work ( i, queue ):
+        random.seed ( i )
+        worker = Worker ( address, name = f"worker{i}", patience = 10. )
+        worker.hello()
+        worker.leaseTime = 100. ## no heartbeats, so we can simulate stalls
+        queue.put ( worker.loop ( sleeper ) )
+    queue = multiprocessing.Queue()
+    jobs = []
+    for i in range(nworkers):
+        p = multiprocessing.Process ( target = work, args = ( i, queue ) )
+        jobs.append ( p )
+        p.start()
+    c = coordinator.serve ( address, linger = 1. )
+    ncompleted = sum ( [ queue.get() for j in jobs ] )
+    for j in jobs:
+        j.join()
+    ok = ncompleted == c["done"] and c["done"] + c["failed"] == npoints
+    print ( f"[coordinator] selftest: {ncompleted} completions reported by workers, {c['done']} done, {c['failed']} failed: {'ok' if ok else 'FAILED'}" )
+    return ok
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='coordinator for distributing mass points over workers. for the actual production use mg5Wrapper.py --serve / --worker.')
+    argparser.add_argument ( '-w', '--worker', help='run mg5 workers for the coordinator at this address, e.g. unix:/tmp/bake.sock or login1:5555',
+                             type=str, default=None )
+    argparser.add_argument ( '-p', '--nprocesses', help='number of workers [1]',
+                             type=int, default=1 )
+    argparser.add_argument ( '--selftest', help='run a local coordinator with sleeping workers, check that all points are completed exactly once',
+                             action="store_true" )
+    args = argparser.parse_args()
+    if args.selftest:
+        ok = selftest ( max ( args.nprocesses, 2 ) )
+        sys.exit ( 0 if ok else 1 )
+    if args.worker is not None:
+        runWorkers ( args.worker, args.nprocesses )
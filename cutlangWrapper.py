@@ -42,10 +42,11 @@ import colorama                # For output colors (in msg, error, ...)
 import subprocess              # For Popen in exe method
 import shutil                  # For move(), rmtree(), FIXME remove?
 import re                      # For delphes card picker
+import ast                     # For literal_eval of the mass and summary files
 import multiprocessing         # Used when run as __main__
-import gzip                    # For decompression of hepmc file
 import time                    # Used for waiting after blocking io error
 import glob                    # for finding adl files
+import zlib                    # For the errors of corrupt gzip files
 import random                  # Used to randomize waiting time after blocking io error
 from datetime import datetime  # For timestamp of embaked files
 from typing import List, Union, Text # For type hinting
@@ -57,16 +58,31 @@ from colorama import Fore
 # local imports
 import bakeryHelpers       # For dirnames
 from bakeryHelpers import execute
+import tracer              # For the spans around the stages
+import resourceUsage       # For __cpu__ and __rss__
+import hepmcTools          # For the generator level event condition
+import blockGzip           # For decompression of hepmc file
 
 
 class CutLangWrapper:
 
-    GZIP_BLOCK = 1 << 24  # Block to decompress gzipped file, ~ 16 MB
+    # Delphes branches of the usual objects, always written in slim mode
+    SLIM_BRANCHES = { "Jet", "Electron", "Muon", "Photon", "MissingET", "ScalarHT" }
+    # Words in ADL files (lower case) that need further Delphes branches
+    SLIM_ALIASES = { "gen": "Particle", "truth": "Particle", "particle": "Particle",
+                     "genpart": "Particle", "parton": "Parton",
+                     "trk": "Track", "track": "Track", "tower": "Tower",
+                     "eflowtrack": "EFlowTrack", "eflowphoton": "EFlowPhoton",
+                     "eflowneutralhadron": "EFlowNeutralHadron",
+                     "genjet": "GenJet", "genmet": "GenMissingET",
+                     "genmissinget": "GenMissingET",
+                     "fjet": "FatJet", "fatjet": "FatJet" }
 
     def __init__(self, topo: str, njets: int, rerun: bool, analysis: str,
                  auto_confirm: bool = True, filterString: str = "",
                  keep: bool = False, adl_file : Union[Text,None] = None,
-                 event_condition : Union[Text,None] = None ) -> None:
+                 event_condition : Union[Text,None] = None,
+                 slim : bool = False ) -> None:
         """
         If not already present, clones and builds Delphes, CutLang and ADLLHC Analyses.
         Prepares output directories.
@@ -79,10 +95,12 @@ class CutLangWrapper:
                         (see https://smodels.github.io/docs/ListOfAnalyses )
         :param auto_confirm: Proceed with downloads without prompting
         :param keep: keep temporary files for debugging?
+        :param slim: write only the delphes branches the adl file needs
         """
         # General vars
         self.njets = njets
         self.adl_file = adl_file
+        self.slim = slim
         self.getEventCondition ( event_condition )
         self.keep = keep ## keep temporary files?
         self.topo = topo
@@ -99,7 +117,8 @@ class CutLangWrapper:
             self.filterRegions, self.filterBins = set(), {}
 
         # make auxiliary directories
-        self.base_dir = Directory(f"cutlang_results/{self.analysis}", make=True)
+        self.base_dir = Directory(os.path.join(bakeryHelpers.baseDir(), "cutlang_results",
+                                               self.analysis), make=True)
         dirname = f"{self.topo}_{self.njets}jet"
         self.ana_dir = Directory(os.path.join(self.base_dir.get(), f"ANA_{dirname}"), make=True)
         self.out_dir = Directory(os.path.join(self.ana_dir.get(), "output"), make=True)
@@ -110,17 +129,18 @@ class CutLangWrapper:
         self._delete_dir(self.initlog)
 
         # Cutlang vars
-        self.cutlanginstall = "./CutLang/"
-        self.cutlang_executable = "./CutLang/CLA/CLA.exe"
-        self.cutlang_run_dir = "./runs"  # Directory where the CutLang will run
-        self.cutlang_script = "./CLA.sh"
-        self.summaryfile = os.path.join("./", f"clsum_{topo}_{self.analysis}.dat")
+        self.basedir = bakeryHelpers.baseDir()
+        self.cutlanginstall = os.path.join(self.basedir, "CutLang/")
+        self.cutlang_executable = os.path.join(self.cutlanginstall, "CLA/CLA.exe")
+        self.cutlang_run_dir = "./runs"  # Directory where the CutLang will run, in the copy
+        self.cutlang_script = "./CLA.sh"  # relative to cutlang_run_dir
+        self.summaryfile = os.path.join(self.basedir, f"clsum_{topo}_{self.analysis}.dat")
 
         # ADLLHCAnalysis vars
-        self.adllhcanalyses = "./CutLang/ADLLHCanalyses"
+        self.adllhcanalyses = os.path.join(self.cutlanginstall, "ADLLHCanalyses")
 
         # Delphes vars
-        self.delphesinstall = "./delphes/"
+        self.delphesinstall = os.path.join(self.basedir, "delphes/")
 
         # ====================
         #      Delphes Init
@@ -140,7 +160,7 @@ class CutLangWrapper:
                 #v = 'v2.9.10'
                 #args = ['git', 'clone', '-b', v, 'https://github.com/unelg/CutLang']
                 # args = ['git', 'clone', 'https://github.com/unelg/CutLang']
-                execute(args, exit_on_fail=True, logfile=self.initlog)
+                execute(args, cwd=self.basedir, exit_on_fail=True, logfile=self.initlog)
             else:
                 self._error("No CutLang dir. Exiting.")
                 sys.exit()
@@ -209,14 +229,10 @@ class CutLangWrapper:
         self._info("ADLLHC Analyses initialisation finished.")
 
     def getEventCondition ( self, event_condition ):
-        pids = { "gamma": 22, "Z": 23, "higgs": 25 }
         self.event_condition = event_condition
         if event_condition == None:
             return
-        self.event_condition = {}
-        for k,v in pids.items():
-            event_condition = event_condition.replace(k,str(v))
-        self.event_condition = eval ( event_condition )
+        self.event_condition = hepmcTools.parseEventCondition ( event_condition )
 
     def list_analyses ( self ):
         """ list all analyses that are to be found in CutLang/ADLLHCanalyses/ """
@@ -239,30 +255,34 @@ class CutLangWrapper:
         ret = "(" + ret + ")"
         return ret
         
-    def filterDelphesUproot ( self, delph_out : str ):
-        """ lets now go through the delphes file, and keep only events
-            that contains Z bosons AND gammas FIXME doesnt work yet """
-        import uproot
-        f = uproot.open ( delph_out )
-        delphes = f["Delphes"]
-        allpids = delphes["Particle/Particle.PID"].array()
-        print ( "pids of entry 0", list(allpids[0][:10]) )
-        print ( "pids of entry 1", list(allpids[1][:10]) )
-        askfor = ( 22, 25 ) # 22: gamma, 23: Z, 25: higgs
-        bitmask = []
-        for i,pids in enumerate ( allpids ):
-            addMe = True
-            for ask in askfor:
-                if not ask in pids and not -ask in pids:
-                    addMe = False
-            bitmask.append ( addMe )
-        self._msg ( f"@@@@ bitmask is {bitmask}" )
-        """
-        g = uproot.recreate ( "new.root", compression=uproot.ZLIB(4) )
-        g["ProcessID0"]=f["ProcessID0"]
-        g["Delphes"]=delphes
-        g.close()
+    def passesEventCondition ( self, counts : dict ) -> bool:
+        """ counts are the multiplicities of the pids in event_condition """
+        for k,v in self.event_condition.items():
+            if k in counts and v == counts[k]:
+                continue
+            return False
+        return True
+
+    def eventMask ( self, delph_out : str, stepSize : str = "100 MB" ):
+        """ which events of the delphes file pass event_condition,
+            vectorised with uproot and awkward, chunk by chunk.
+            the multiplicity of every pid (signed, as given) is compared
+            with the requested one.
+        :returns: numpy array of booleans, one per event
         """
+        import uproot, numpy
+        import awkward as ak
+        masks = []
+        for chunk in uproot.iterate ( f"{delph_out}:Delphes", filter_name = [ "Particle.PID" ],
+                                      step_size = stepSize, library = "ak" ):
+            pids = chunk["Particle.PID"]
+            passes = numpy.ones ( len(pids), dtype=bool )
+            for k,v in self.event_condition.items():
+                passes &= ak.to_numpy ( ak.sum ( pids == k, axis=1 ) == v )
+            masks.append ( passes )
+        if len(masks)==0:
+            return numpy.zeros ( 0, dtype=bool )
+        return numpy.concatenate ( masks )
 
     def readRootArray ( self, arr ):
         """ arr is ROOT.TLeafElement, read all entries """
@@ -274,43 +294,106 @@ class CutLangWrapper:
             ret.append ( tmp )
         return ret
 
-    def filterDelphes ( self, delph_out : str ):
-        """ lets now go through the delphes file, and keep only events
-            that contains Z bosons AND gammas """
-        if self.event_condition is None:
-            return
-        bitmask = []
-        self._msg ( f"filtering {delph_out}" )
-        import ROOT
+    def eventMaskROOT ( self, delph_out : str ):
+        """ like eventMask, but with an event loop in PyROOT.
+            slow, only for when there is no uproot """
+        import ROOT, numpy
         f = ROOT.TFile ( delph_out, "read" )
-        g = ROOT.TFile ( "new.root", "recreate" )
         d = f.Delphes
-        # d = f.Get("Delphes") does the same as above
-        # branch = d.GetBranch("Particle")
         leaf = d.GetLeaf("Particle.PID")
         n = d.GetEntries()
-        cloned = d.CopyTree("0")
-        # 22: gamma, 23: Z, 25: higgs
-        # print ( "event condition is", self.event_condition )
+        mask = numpy.zeros ( n, dtype=bool )
         for event in range(n):
-            d.GetEntry(event) # start with event #0
+            d.GetEntry(event)
             pids = self.readRootArray(leaf)
             counts = {}
             for k in self.event_condition.keys():
                 counts[k] = pids.count(k)
-            passes = True
-            for k,v in self.event_condition.items():
-                if k in counts and v == counts[k]:
-                    continue
-                passes = False
-            # print ( "counts for event", event, "are", counts, "passes", passes )
-            if passes:
-                cloned.Fill()
-        g.Write()
+            mask[event] = self.passesEventCondition ( counts )
+        f.Close()
+        return mask
+
+    def filterDelphes ( self, delph_out : str, hepmcfile : str,
+                        delphes_card : str, logfile : str ) -> bool:
+        """ keep only the events of the delphes file that pass
+            event_condition, e.g. that contain Z bosons AND gammas.
+            the mask is computed with uproot, if available. CutLang needs
+            the delphes classes, so the filtered tree is written by ROOT,
+            from an entry list, without an event loop in python. without
+            ROOT, we select the events of the mask from the hepmc file, and
+            run delphes again on those.
+            the mask is also kept as <delph_out>.mask.npy.
+        :param hepmcfile: the (uncompressed) input of delphes
+        :returns: False, if we could not filter
+        """
+        if self.event_condition is None:
+            return True
+        import numpy
+        self._msg ( f"filtering {delph_out}" )
+        try:
+            mask = self.eventMask ( delph_out )
+        except ImportError as e:
+            self._info ( f"no uproot/awkward ({e}), filtering with the PyROOT event loop" )
+            try:
+                mask = self.eventMaskROOT ( delph_out )
+            except ImportError as e:
+                self._error ( f"need either uproot and awkward, or ROOT, to filter: {e}" )
+                return False
+        maskfile = delph_out.replace(".root","") + ".mask.npy"
+        numpy.save ( maskfile, mask )
+        self.tempFiles.append ( maskfile )
+        self._msg ( f"{int(mask.sum())}/{len(mask)} events pass {self.event_condition}" )
+        span = tracer.currentSpan()
+        if span is not None:
+            span["nevents"], span["npass"] = len(mask), int(mask.sum())
+        try:
+            import ROOT
+        except ImportError as e:
+            return self.rerunDelphes ( mask, delph_out, hepmcfile, delphes_card, logfile )
+        f = ROOT.TFile ( delph_out, "read" )
+        d = f.Delphes
+        entries = ROOT.TEntryList ( d )
+        for i in numpy.flatnonzero ( mask ):
+            entries.Enter ( int(i) )
+        d.SetEntryList ( entries )
+        tmpfile = delph_out + ".filtered"
+        g = ROOT.TFile ( tmpfile, "recreate" )
+        cloned = d.CopyTree ( "" )
+        cloned.Write()
         g.Close()
         f.Close()
-        cmd = f"mv new.root {delph_out}"
-        subprocess.getoutput ( cmd )
+        os.replace ( tmpfile, delph_out )
+        return True
+
+    def rerunDelphes ( self, mask, delph_out : str, hepmcfile : str,
+                       delphes_card : str, logfile : str ) -> bool:
+        """ the filter without ROOT: write the events of hepmcfile that are
+            in mask, and run delphes on those. delphes writes its events in
+            the order of the hepmc file, so the mask applies to both.
+        :returns: False, if the hepmc file does not match the mask
+        """
+        selected = os.path.join(self.tmp_dir.get(), "selected_" + os.path.basename(hepmcfile))
+        self._info ( f"no ROOT, selecting the events that pass from {hepmcfile}" )
+        stats = hepmcTools.selectEvents ( hepmcfile, selected, mask )
+        self.tempFiles.append ( selected )
+        if stats["nevents"] != len(mask):
+            self._error ( f"{hepmcfile} has {stats['nevents']} events, but {delph_out} has {len(mask)}. cannot filter." )
+            return False
+        self.runDelphes ( delphes_card, delph_out, selected, logfile )
+        return True
+
+    def runDelphes ( self, delphes_card : str, delph_out : str, hepmcfile : str,
+                     logfile : str ):
+        """ run delphes on hepmcfile, write to delph_out """
+        if os.path.exists(delph_out):
+            self._info(f"Removing {delph_out}.")
+            args = ["rm", delph_out]
+            execute(args, logfile=logfile)
+        self._debug("Running delphes.")
+        args = [self.delphes_exe, delphes_card, delph_out, hepmcfile]
+        with tracer.span ( "delphes" ):
+            execute(args, logfile=logfile)
+        self._debug("Delphes finished.")
 
     def run(self, mass: str, hepmcfile: str, pid: int = None) -> int:
         """ Gives efficiency values for the given hepmc file.
@@ -322,6 +405,7 @@ class CutLangWrapper:
                 -2:   The analysis has already been done and rerun flag is False
                 -3:   Could not copy CutLang to temporary directory
                 -4    There were no efficiencies found
+                -5    Could not filter the delphes output for event_condition
         :param mass: string that describes the mass vector, e.g. "(1000,100)".
                      If "Masses not specified", then try to extract masses from
                      hepmcfile name. FIXME what now, mass range or tuple of masses?
@@ -348,13 +432,29 @@ class CutLangWrapper:
 
         if self._check_summary_file(mass):
             return -2
+        tmass = mass ## as a tuple
+        if type(mass) == str:
+            tmass = ast.literal_eval(mass)
+        tracer.updateContext ( topo = self.topo, masses = tmass,
+                               analysis = self.analysis )
 
         # Decompress hepmcfile if necessary
         if not os.path.isfile(hepmcfile):
             self._error(f"cannot find hepmc file {hepmcfile}.")
             return -1
-        if ".gz" in hepmcfile:
-            hepmcfile = self._decompress(hepmcfile, self.tmp_dir.get())
+        prefilter = None
+        if self.event_condition is not None:
+            ## apply the event condition to the generator level particles,
+            ## so delphes sees only the events that pass
+            try:
+                with tracer.span ( "decompress" ) as span:
+                    hepmcfile, prefilter = self._prefilter(hepmcfile, self.tmp_dir.get())
+                    span["nevents"], span["npass"] = prefilter["nevents"], prefilter["npass"]
+            except (OSError, EOFError, ValueError, IndexError, zlib.error) as e:
+                self._error(f"could not prefilter {hepmcfile}: {e}. Will filter the delphes output instead.")
+        if prefilter is None and ".gz" in hepmcfile:
+            with tracer.span ( "decompress" ):
+                hepmcfile = self._decompress(hepmcfile, self.tmp_dir.get())
 
 
         # ======================
@@ -363,24 +463,24 @@ class CutLangWrapper:
         # set input/output paths
         self._msg("Found hepmcfile at", hepmcfile)
         delphes_card = self._pick_delphes_card()
+        if self.slim:
+            delphes_card = self.slimDelphesCard(delphes_card)
         delph_out = os.path.join(self.out_dir.get(), f"delphes_out_{mass_stripped}.root")
 
-        # Remove output file if already exists
-        if os.path.exists(delph_out):
-            self._info(f"Removing {delph_out}.")
-            args = ["rm", delph_out]
-            execute(args, logfile=logfile)
-
-
-        # run delphes
-        self._debug("Running delphes.")
-        args = [self.delphes_exe, delphes_card, delph_out, hepmcfile]
-        execute(args, logfile=logfile)
-        self._debug("Delphes finished.")
-
-        ## possibly we need to filter the delphes output
-        # self.filterDelphesUproot ( delph_out )
-        self.filterDelphes ( delph_out )
+        # run delphes, removes the output file if it already exists
+        self.runDelphes(delphes_card, delph_out, hepmcfile, logfile)
+
+        ## if the prefilter failed, we filter the delphes output. delphes
+        ## keeps all generator level particles, so after the prefilter all
+        ## events pass anyways
+        filtered = True
+        if prefilter is None:
+            with tracer.span ( "delphes_filter" ):
+                filtered = self.filterDelphes ( delph_out, hepmcfile, delphes_card, logfile )
+        if not filtered:
+            self.tempFiles.append ( delph_out )
+            self.removeTempFiles()
+            return -5
 
         # ======================
         #        CutLang
@@ -403,7 +503,8 @@ class CutLangWrapper:
         # run CutLang
         cmd = [self.cutlang_script, cla_input, "DELPHES", "-i", cutlangfile]
         self._debug("Running CLA")
-        execute(cmd, cwd=cla_run_dir, logfile=logfile)
+        with tracer.span ( "cutlang" ):
+            execute(cmd, cwd=cla_run_dir, logfile=logfile)
         self._debug("CLA finished.")
 
         ## now that we ran cutlang, mark the delphes root file as to-be-deleted
@@ -415,7 +516,7 @@ class CutLangWrapper:
         self._info(f"Writing partial efficiencies into file: {os.getcwd()}/{local_embaked_file}")
         # to store intermediate results
         nevents = []
-        entries = ""
+        entries = {}
         filecount = 0
         # go over all the .root files made by CLA
         for filename in os.listdir(cla_run_dir):
@@ -424,10 +525,11 @@ class CutLangWrapper:
                 filename = os.path.join(cla_run_dir, filename)
                 # get partial efficiencies from each file
                 self._info(f"processing #{filecount}: {filename}" )
-                tmp_entries, tmp_nevents = self.extract_efficiencies(filename,
+                with tracer.span ( "extract_efficiencies" ):
+                    tmp_entries, tmp_nevents = self.extract_efficiencies(filename,
                                                                      cutlangfile)
                 nevents += tmp_nevents
-                entries += tmp_entries
+                entries.update(tmp_entries)
                 destdir = os.path.join(self.tmp_dir.get(), os.path.basename(filename))
                 self._info(f"found {len(nevents)}/{len(entries)}, move to {destdir}" )
                 shutil.move(filename, destdir)
@@ -441,27 +543,29 @@ class CutLangWrapper:
             # write efficiencies to .embaked file
             self._add_output_summary ( mass )
             self._msg(f"Writing efficiency values for masses {mass} to file:\n {local_embaked_file}")
+            effs = dict(entries)
+            effs["__t__"] = datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
+            nev = float(nevents[0])
+            if nev == int(nev):
+                nev = int(nev)
+            effs["__nevents__"] = nev
+            if prefilter is not None:
+                ## the efficiencies are relative to the events that passed
+                ## the event condition, multiply by this to get the
+                ## efficiencies relative to all events
+                effs["__prefilter__"] = float(f"{prefilter['fraction']:.6g}")
+            effs.update(resourceUsage.totals(self.topo, tmass))
             with open(local_embaked_file, "wt") as f:
-                f.write(str(mass) + ": {")
-                f.write(entries)
-                f.write(f"'__t__':'{datetime.now().strftime('%Y-%m-%d_%H:%M:%S')}', ")
-                nev = nevents[0]
-                if nev == int(nev):
-                    nev = str(int(nev))
-                f.write(f"'__nevents__':{nev}")
-                f.write("}")
-                f.close()
-            with open(local_embaked_file,"rt") as f:
-                effs = eval("{"+f.read()+"}")
+                f.write(f"{tmass}: {effs}")
                 f.close()
             self._msg(f"done writing into {local_embaked_file}")
-            self.addToEmbakedFile ( list(effs.keys())[0], list(effs.values())[0] )
+            self.addToEmbakedFile(tmass, effs)
             ## now that we have an embaked file, mark also the CLA dir as removable
             self.tempFiles.append ( f"{cla_temp_name}" )
             self.removeTempFiles()
             return 0
         else:
-            self.error(f"Did not find any events: {nevents}. Filecount {filecount}. Entries: '{entries}'. CLAdir {cla_run_dir}")
+            self.error(f"Did not find any events: {nevents}. Filecount {filecount}. Entries: {entries}. CLAdir {cla_run_dir}")
             # self.error(f"directory reads {os.listdir(cla_run_dir)}" )
             self.removeTempFiles()
             return -4
@@ -490,8 +594,9 @@ class CutLangWrapper:
         """ Extracts the efficiencies from CutLang output, via uproot or ROOT
             returns:
                 entries, nevents tuple:
-                        entries -- String containing efficiencies extracted from the cla_out file
-                        nevents -- Tuple of numbers of events for each entry.
+                        entries -- Dictionary of the efficiencies extracted from the cla_out file,
+                                   signal region name to efficiency
+                        nevents -- List of numbers of events for each entry.
             :param cla_out:  .root file output of CLA
             :param cla_file:  .adl file specifying CutLang regions
         """
@@ -522,8 +627,9 @@ class CutLangWrapper:
         """ Extracts the efficiencies from CutLang output.
             returns:
                 entries, nevents tuple:
-                        entries -- String containing efficiencies extracted from the cla_out file
-                        nevents -- Tuple of numbers of events for each entry.
+                        entries -- Dictionary of the efficiencies extracted from the cla_out file,
+                                   signal region name to efficiency
+                        nevents -- List of numbers of events for each entry.
             :param cla_out:  .root file output of CLA
             :param cla_file:  .adl file specifying CutLang regions
         """
@@ -538,7 +644,7 @@ class CutLangWrapper:
         # temporary TH1D structure to write results in
         rootTmp = ROOT.TH1D()
         nevents = []  # list of starting numbers of events
-        entries = ""  # efficiency entries for output
+        entries = {}  # efficiency entries for output
         contains_eff = False  # Whether this root file yielded an efficiencies
         ignorelist = {'baseline', 'presel'} & self.filterRegions
 
@@ -564,17 +670,16 @@ class CutLangWrapper:
 
                 # copy cutflow object into temp root object and process it
                 rootTmp = x.cutflow
-                entry = "".join(["'", regionName, "': "])
                 s = rootTmp.GetNbinsX()
                 if rootTmp[2] == 0:
-                    entries += "NaN"
+                    # no events, no efficiency
+                    self._info(f"ROOT no events in {regionName}, skip it")
                     nevents.append(0)
                     continue
                 # rootTmp[2] == number of all events
-                entry += str(rootTmp[(s-1)]/rootTmp[2]) + ', '
-                self._debug("ROOT "+entry)
+                entries[regionName] = rootTmp[(s-1)]/rootTmp[2]
+                self._debug(f"ROOT '{regionName}': {entries[regionName]}")
                 nevents.append(rootTmp[2])
-                entries += entry
                 contains_eff = True
                 # if the region contains bins, process them
                 if "bincounts" in keys:
@@ -594,10 +699,8 @@ class CutLangWrapper:
                         bin_name = rootTmp.GetXaxis().GetBinLabel(i)
                         bin_name = "_".join([regionName, bin_name.replace(" ", "_")])
                         bin_name = self._shorten_bin_name(bin_name)
-                        entry = "".join(["'", bin_name, "': "])
                         self._debug(f"ROOT bin {bin_name} nevents: {nevents[-1]}.")
-                        entry += str(rootTmp[i]/nevents[-1]) + ', '
-                        entries += entry
+                        entries[bin_name] = rootTmp[i]/nevents[-1]
             else:
                 self._debug(f"ROOT {x.GetName()} is not a Directory File.")
                 self._debug(f"ROOT {x.GetName()} is of type {type(x)}")
@@ -611,8 +714,9 @@ class CutLangWrapper:
         """ Extracts the efficiencies from CutLang output, via uproot
             returns:
                 entries, nevents tuple:
-                        entries -- String containing efficiencies extracted from the cla_out file
-                        nevents -- Tuple of numbers of events for each entry.
+                        entries -- Dictionary of the efficiencies extracted from the cla_out file,
+                                   signal region name to efficiency
+                        nevents -- List of numbers of events for each entry.
             :param cla_out:  .root file output of CLA
             :param cla_file:  .adl file specifying CutLang regions
         """
@@ -637,7 +741,7 @@ class CutLangWrapper:
         # rootTmp = ROOT.TH1D()
         rootTmp = []
         nevents = []  # list of starting numbers of events
-        entries = ""  # efficiency entries for output
+        entries = {}  # efficiency entries for output
         contains_eff = False  # Whether this root file yielded an efficiencies
         ignorelist = {'baseline', 'presel'} & self.filterRegions
 
@@ -651,6 +755,9 @@ class CutLangWrapper:
         for name,obj in rootFile.items():
                 if name.endswith ( "/bincounts;1" ):
                     self._info(f"Found bins in {name} section.")
+                    if len(nevents) == 0 or nevents[-1] == 0:
+                        # no events in the region, no efficiencies of its bins
+                        continue
                     objname = objname.replace("/bincounts;1","")
                     labels = obj.axes[0].labels()
                     if objname in self.filterBins:
@@ -658,17 +765,15 @@ class CutLangWrapper:
                     else:
                         filterBinNums = []
                     v = obj.values()
-                    entries += f"'{objname}_': {v[-1]}, "
+                    entries[f"{objname}_"] = float(v[-1])
                     for i,v in enumerate ( v ):
                         if i in filterBinNums:
                             continue
                         bin_name = labels[i]
                         bin_name = "_".join([objname, bin_name.replace(" ", "_")])
                         bin_name = self._shorten_bin_name(bin_name)
-                        entry = "".join(["'", bin_name, "': "])
                         self._debug(f"uproot bin no {v} nevents: {nevents[-1]}.")
-                        entry += str(v/nevents[-1]) + ', '
-                        entries += entry
+                        entries[bin_name] = float(v/nevents[-1])
                     continue
                 if not "/cutflow;1" in name:
                     continue
@@ -676,13 +781,16 @@ class CutLangWrapper:
                 if objname in ignorelist:
                     continue
                 # copy cutflow object into temp root object and process it
-                entry = "".join(["'", objname , "': "])
                 v = obj.values()
                 s = len ( v )
-                entry += str(v[(s-2)]/v[1]) + ', '
-                self._debug( f"uproot {entry}" )
+                if v[1] == 0:
+                    # no events, no efficiency
+                    self._info(f"uproot no events in {objname}, skip it")
+                    nevents.append(0)
+                    continue
+                entries[objname] = float(v[(s-2)]/v[1])
+                self._debug( f"uproot '{objname}': {entries[objname]}" )
                 nevents.append(v[1])
-                entries += entry
                 contains_eff = True
         return entries, nevents
 
@@ -733,8 +841,8 @@ class CutLangWrapper:
         if self._confirmation("This will delete all directories created by running CutLangWrapper.\n"
                               "Proceed?"):
             self.clean()
-            self._delete_dir("./CutLang")
-            self._delete_dir("./delphes")
+            self._delete_dir(self.cutlanginstall)
+            self._delete_dir(self.delphesinstall)
 
     # =========================================================================
     # Private methods
@@ -770,22 +878,20 @@ class CutLangWrapper:
         f = open(self.summaryfile, "r+")
         txt = f.read()
         f.close()
-        mymasses=eval( txt )
+        mymasses=ast.literal_eval( txt )
         return mymasses
 
     def _add_output_summary ( self, mass ):
         """ append to the output summary """
         emass = mass
-        try:
-            emass = eval(mass)
-        except TypeError as e:
-            pass
+        if type(mass) == str:
+            emass = ast.literal_eval(mass)
         mymasses = set()
         if os.path.exists(self.summaryfile) and os.stat(self.summaryfile).st_size > 0:
             f = open(self.summaryfile, "r+")
             txt = f.read()
             f.close()
-            mymasses = eval ( txt )
+            mymasses = ast.literal_eval ( txt )
         if mass in mymasses:
             return mymasses ## nothing needs to be done
         mymasses.add ( emass )
@@ -823,10 +929,8 @@ class CutLangWrapper:
             self._msg( f"was asked to rerun, not checking CL_output_summary.dat" )
             return False
         emass = mass
-        try:
-            emass = eval(mass)
-        except TypeError as e:
-            pass
+        if type(mass) == str:
+            emass = ast.literal_eval(mass)
         # Check if the analysis has been done already
         result = False
         if os.path.exists(self.summaryfile) and os.stat(self.summaryfile).st_size > 0:
@@ -856,18 +960,26 @@ class CutLangWrapper:
         basename = ".".join(os.path.basename(name).split(".")[:-1])
         out_name = os.path.join(out_dir, basename)
         self._info(f"Decompressing {name} to {out_name} .")
-        with open(out_name, 'wb') as f_out:
-            in_f = gzip.open(name, 'rb')
-            while True:
-                s = in_f.read(self.GZIP_BLOCK)
-                if s == b'':
-                    break
-                f_out.write(s)
-            in_f.close()
+        # block gzip files are inflated in parallel
+        blockGzip.decompress(name, out_name)
         ## the _decompressed files should be removed immediately after
         self.tempFiles.append ( out_name )
         return out_name
 
+    def _prefilter(self, name, out_dir):
+        """ write the events of the hepmc file name that pass the
+            event_condition to out_dir, decompressing if needed
+        :returns: the name of the filtered file, and the statistics of
+                  hepmcTools.filterEvents
+        """
+        basename = os.path.basename(name).replace(".gz","")
+        out_name = os.path.join(out_dir, f"filtered_{basename}")
+        self._info(f"Filtering {name} for {self.event_condition} to {out_name} .")
+        stats = hepmcTools.filterEvents ( name, out_name, self.event_condition )
+        self._info(f"{stats['npass']}/{stats['nevents']} events pass {self.event_condition}.")
+        self.tempFiles.append ( out_name )
+        return out_name, stats
+
     def removeTempFiles ( self ):
         """ remove all temp files that we know of """
         if self.keep:
@@ -878,7 +990,8 @@ class CutLangWrapper:
             if os.path.isdir ( t ):
                 shutil.rmtree ( t )
             else:
-                os.unlink ( t )
+                ## the hepmc files come with an index
+                hepmcTools.remove ( t )
         self.tempFiles = []
 
     def _delete_dir(self, f):
@@ -892,15 +1005,67 @@ class CutLangWrapper:
 
     def _pick_delphes_card(self):
         if not re.search("ATLAS", self.analysis) is None:
-            return os.path.abspath("./templates/delphes_card_ATLAS.tcl")
+            return os.path.join(self.basedir, "templates/delphes_card_ATLAS.tcl")
             # return os.path.abspath("./delphes/cards/delphes_card_ATLAS.tcl")
         elif not re.search("CMS", self.analysis) is None:
-            return os.path.abspath("./templates/delphes_card_CMS.tcl")
+            return os.path.join(self.basedir, "templates/delphes_card_CMS.tcl")
             # return os.path.abspath("./delphes/cards/delphes_card_CMS.tcl")
         else:
             self._error(f"Could not find a suitable Delphes card for analysis {self.analysis}. Exiting.")
             sys.exit()
 
+    def adlCollections(self, adlfile: str) -> set:
+        """ the delphes branches, beyond SLIM_BRANCHES, that the adl file
+            refers to, e.g. Particle for GEN or Truth objects """
+        with open(adlfile, "rt") as f:
+            text = f.read()
+            f.close()
+        text = re.sub("#[^\n]*", "", text)
+        words = set(w.lower() for w in re.findall("[A-Za-z_]+", text))
+        return set(branch for word, branch in self.SLIM_ALIASES.items() if word in words)
+
+    def slimDelphesCard(self, card: str) -> str:
+        """ derive a card from card, whose TreeWriter writes only the
+            branches that the adl file of the analysis needs. the derived
+            card is cached in cutlang_results/<analysis>/cards/, and
+            remade if card or adl file change.
+        :returns: path to the derived card, or card if we cannot derive it
+        """
+        try:
+            adlfile = self.pickCutLangFile(self.analysis)
+        except Exception as e:
+            self._info(f"cannot find the adl file, use the full delphes card: {e}")
+            return card
+        carddir = os.path.join(self.base_dir.get(), "cards")
+        os.makedirs(carddir, exist_ok=True)
+        slimcard = os.path.join(carddir, os.path.basename(card).replace(".tcl", "_slim.tcl"))
+        if os.path.exists(slimcard) and os.stat(slimcard).st_mtime >= \
+                max(os.stat(card).st_mtime, os.stat(adlfile).st_mtime):
+            return slimcard
+        keep = self.SLIM_BRANCHES | self.adlCollections(adlfile)
+        with open(card, "rt") as f:
+            lines = f.readlines()
+            f.close()
+        intree, dropped = False, []
+        for i, line in enumerate(lines):
+            if line.startswith("module TreeWriter"):
+                intree = True
+            elif intree and line.startswith("}"):
+                intree = False
+            tokens = line.split()
+            if intree and tokens[:2] == ["add", "Branch"] and len(tokens) > 3 \
+                    and not tokens[3] in keep:
+                lines[i] = f"# slim: {line}"
+                dropped.append(tokens[3])
+        tmpfile = f"{slimcard}.{os.getpid()}.tmp"
+        with open(tmpfile, "wt") as f:
+            f.write(f"# derived from {card} for {os.path.basename(adlfile)}\n")
+            f.write("".join(lines))
+            f.close()
+        os.replace(tmpfile, slimcard)
+        self._info(f"slim delphes card {slimcard} drops {', '.join(dropped)}")
+        return slimcard
+
     def _standardise_analysis(self, analysis):
         """Takes analysis name and returns it in format like: CMS-SUS-13-024"""
         analysis = analysis.replace("_", "-")
@@ -968,8 +1133,6 @@ class Directory:
         self.dirname = dirname
         if not os.path.exists(self.dirname):
             if make is True:
-                if not os.path.exists ( "cutlang_results" ):
-                    os.makedirs ( "cutlang_results", exist_ok=True )
                 os.makedirs(self.dirname,exist_ok=True)
             else:
                 self._error(f"Directory {self.dirname} does not exits. Aborting.")
@@ -1008,6 +1171,12 @@ if __name__ == "__main__":
                            type=str, default="")
     argparser.add_argument ( '-l', '--list_analyses', help='list all analyses that are found in this ADL installation',
                              action="store_true" )
+    argparser.add_argument('--slim', help='write only the delphes branches that the adl file needs',
+                           action='store_true')
+    argparser.add_argument('--profile', help='profile the python code with cProfile, write the results to profiles/',
+                           action="store_true")
+    argparser.add_argument('--profile_sample', help='when profiling, also sample the stacks every so many seconds. 0 means no sampling [0.]',
+                           type=float, default=0.)
     args = argparser.parse_args()
     if args.list_analyses:
         cutlang = CutLangWrapper(args.topo, args.njets, args.rerun, args.analyses)
@@ -1022,5 +1191,11 @@ if __name__ == "__main__":
         cutlang.clean_all()
         sys.exit()
 
-    cutlang = CutLangWrapper(args.topo, args.njets, args.rerun, args.analyses)
-    cutlang.run(args.mass, args.hepmcfile)
+    import profiler
+    t0 = time.time()
+    with profiler.profiled("cutlangWrapper", args.profile, args.profile_sample):
+        cutlang = CutLangWrapper(args.topo, args.njets, args.rerun, args.analyses,
+                                 slim=args.slim)
+        cutlang.run(args.mass, args.hepmcfile)
+    if args.profile:
+        print(profiler.merge("cutlangWrapper", since=t0))
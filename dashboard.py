@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: dashboard
+   :synopsis: a live terminal dashboard of the running scans: points done,
+              running and failed per topology and analysis, points per hour
+              in sliding windows, occupancy of the stages, ages of the locks,
+              and the ETA. reads the traces incrementally (only what was
+              appended since the last refresh), and the lock files, so it
+              stays cheap on a slow shared file system.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, glob, json, colorama
+import tracer, locker, bakeryHelpers
+
+windows = [ 900., 3600., 6*3600. ] ## sliding windows, in seconds
+
+class Dashboard:
+    def __init__ ( self, tracedir = None, total = None, topo = None,
+                   analysis = None ):
+        """
+        :param total: number of points in the grid, for the ETA
+        :param topo: show only this topology
+        :param analysis: show only this analysis
+        """
+        self.tracedir = tracedir if tracedir is not None else tracer.traceDir()
+        self.total = total
+        self.topo = topo
+        self.analysis = analysis
+        self.offsets = {} ## how far we have read each trace file
+        self.counts = {} ## ( topo, analysis ) -> { "done": n, "failed": n }
+        self.completions = {} ## ( topo, analysis ) -> timestamps in the largest window
+        self.spans = [] ## ( stage, t0, t1 ) of the spans in the largest window
+
+    def accept ( self, record ) -> bool:
+        if self.topo is not None and record.get ( "topo", None ) != self.topo:
+            return False
+        if self.analysis is not None and record.get ( "analysis", None ) != self.analysis:
+            return False
+        return True
+
+    def readNew ( self ):
+        """ read what has been appended to the trace files since last time """
+        for filename in glob.glob ( f"{self.tracedir}/*.jsonl" ):
+            offset = self.offsets.get ( filename, 0 )
+            try:
+                if os.stat ( filename ).st_size <= offset:
+                    continue
+                with open ( filename, "rb" ) as f:
+                    f.seek ( offset )
+                    data = f.read()
+                    f.close()
+            except OSError as e:
+                continue
+            end = data.rfind ( b"\n" ) + 1 ## dont consume partial lines
+            self.offsets[filename] = offset + end
+            for line in data[:end].splitlines():
+                try:
+                    self.add ( json.loads ( line ) )
+                except ValueError as e:
+                    continue
+
+    def add ( self, record ):
+        if not self.accept ( record ):
+            return
+        t1 = record["t0"] + record["dt"]
+        key = ( record.get ( "topo", "?" ), record.get ( "analysis", "?" ) )
+        stage = record["stage"]
+        if stage in [ "recast", "generation" ]:
+            if not key in self.counts:
+                self.counts[key] = { "done": 0, "failed": 0 }
+            if record.get ( "ok", True ) and stage == "recast":
+                self.counts[key]["done"] += 1
+                self.completions.setdefault ( key, [] ).append ( t1 )
+            elif not record.get ( "ok", True ):
+                self.counts[key]["failed"] += 1
+        if stage != "recast" and record["dt"] > 0.:
+            self.spans.append ( ( stage, record["t0"], t1 ) )
+
+    def prune ( self ):
+        """ forget what is older than the largest window """
+        tmin = time.time() - max ( windows )
+        self.spans = [ s for s in self.spans if s[2] > tmin ]
+        for k,v in self.completions.items():
+            self.completions[k] = [ t for t in v if t > tmin ]
+
+    def rates ( self, key = None ):
+        """ points per hour, per window """
+        t = time.time()
+        ret = []
+        for w in windows:
+            n = 0
+            for k,v in self.completions.items():
+                if key is None or k == key:
+                    n += len ( [ x for x in v if x > t - w ] )
+            ret.append ( n / w * 3600. )
+        return ret
+
+    def occupancy ( self, window ):
+        """ average number of workers busy in each stage, within window """
+        t = time.time()
+        tmin = t - window
+        busy = {}
+        for stage, t0, t1 in self.spans:
+            overlap = min ( t1, t ) - max ( t0, tmin )
+            if overlap > 0.:
+                busy[stage] = busy.get ( stage, 0. ) + overlap
+        return { k: v / window for k,v in busy.items() }
+
+    def locks ( self ):
+        """ the running points, from the lock files: ( topo, masses, age, stale ) """
+        ret = []
+        t = time.time()
+        basedir = bakeryHelpers.baseDir()
+        for l in glob.glob ( f"{basedir}/.lock*" ):
+            if ".stale." in l or ".adopt." in l:
+                continue
+            lease = locker.readLease ( l )
+            if lease is None:
+                continue
+            ## .lock<sqrts>_<masses>_<topo>
+            tokens = os.path.basename ( l )[5:].split("_")
+            topo = tokens[-1]
+            if self.topo is not None and topo != self.topo:
+                continue
+            try:
+                age = t - os.stat ( l ).st_ctime
+            except OSError as e:
+                continue
+            ret.append ( ( topo, "_".join ( tokens[1:-1] ), age, locker.isStale ( lease ) ) )
+        ret.sort ( key = lambda x: -x[2] )
+        return ret
+
+    def render ( self ) -> str:
+        lines = []
+        lines.append ( f"{colorama.Fore.GREEN}em-creator dashboard, {time.asctime()}{colorama.Fore.RESET}" )
+        locks = self.locks()
+        running = {}
+        for l in locks:
+            running[l[0]] = running.get ( l[0], 0 ) + 1
+        swindows = " ".join ( [ "%7s" % f"{int(w/60)}m/h" for w in windows ] )
+        lines.append ( "" )
+        lines.append ( "%-10s %-22s %6s %7s %6s  %s" % ( "topo", "analysis", "done", "running", "failed", swindows ) )
+        keys = sorted ( self.counts.keys() )
+        for key in keys:
+            c = self.counts[key]
+            r = " ".join ( [ "%7.1f" % x for x in self.rates ( key ) ] )
+            beg, end = "", ""
+            if c["failed"]>0:
+                beg, end = colorama.Fore.RED, colorama.Fore.RESET
+            lines.append ( "%s%-10s %-22s %6d %7d %6d  %s%s" % ( beg, key[0], key[1][:22], c["done"],
+                running.get ( key[0], 0 ), c["failed"], r, end ) )
+        rates = self.rates()
+        ndone = sum ( [ c["done"] for c in self.counts.values() ] )
+        lines.append ( "%-33s %6d %7d %6d  %s" % ( "total", ndone, len(locks),
+            sum ( [ c["failed"] for c in self.counts.values() ] ),
+            " ".join ( [ "%7.1f" % x for x in rates ] ) ) )
+        if self.total is not None:
+            eta = "unknown"
+            rate = rates[1] if rates[1] > 0. else rates[-1]
+            if rate > 0.:
+                eta = "%.1f h" % ( max ( self.total - ndone, 0 ) / rate )
+            lines.append ( f"grid: {ndone}/{self.total} done, ETA {eta}" )
+        lines.append ( "" )
+        lines.append ( "stage occupancy (busy workers):" )
+        occs = [ self.occupancy ( w ) for w in windows ]
+        stages = sorted ( set().union ( *[ o.keys() for o in occs ] ) )
+        for stage in stages:
+            lines.append ( "  %-22s %s" % ( stage, " ".join ( [ "%7.2f" % o.get ( stage, 0. ) for o in occs ] ) ) )
+        lines.append ( "" )
+        lines.append ( f"locks ({len(locks)}), oldest first:" )
+        for topo, masses, age, stale in locks[:10]:
+            s = f" {colorama.Fore.RED}stale{colorama.Fore.RESET}" if stale else ""
+            lines.append ( "  %-10s %-20s %6.1f h%s" % ( topo, masses, age / 3600., s ) )
+        return "\n".join ( lines )
+
+    def loop ( self, interval = 10., once = False ):
+        while True:
+            self.readNew()
+            self.prune()
+            screen = self.render()
+            if once:
+                print ( screen )
+                return
+            sys.stdout.write ( "\033[H\033[2J" + screen + "\n" )
+            sys.stdout.flush()
+            try:
+                time.sleep ( interval )
+            except KeyboardInterrupt as e:
+                return
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='live dashboard of the running scans.')
+    argparser.add_argument ( '-T', '--topo', help='show only this topology [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-a', '--analysis', help='show only this analysis [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-m', '--masses', help='the mass ranges of the grid, as in mg5Wrapper.py, for the ETA [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-n', '--total', help='number of points of the grid, for the ETA, if no masses are given [None]',
+                             type=int, default=None )
+    argparser.add_argument ( '-d', '--dirname', help='directory with the trace files [traces/]',
+                             type=str, default=None )
+    argparser.add_argument ( '-i', '--interval', help='refresh every so many seconds [10.]',
+                             type=float, default=10. )
+    argparser.add_argument ( '-o', '--once', help='print once, then quit',
+                             action="store_true" )
+    args = argparser.parse_args()
+    total = args.total
+    if args.masses is not None:
+        total = len ( bakeryHelpers.parseMasses ( args.masses ) )
+    dashboard = Dashboard ( args.dirname, total, args.topo, args.analysis )
+    dashboard.loop ( args.interval, args.once )
@@ -8,11 +8,13 @@
 .. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
 """
 
-import os, sys, colorama, subprocess, shutil, time, glob
+import os, sys, colorama, subprocess, shutil, time, glob, ast
 from datetime import datetime
-import bakeryHelpers
+import bakeryHelpers, resourceUsage, ingest
 from colorama import Fore
-from typing import List, Tuple
+from typing import List, Tuple, Union, Dict
+
+embakeddir = None ## where the embaked files go, default is embaked/ in the basedir
 
 hasWarned = { "cutlangstats": False }
 
@@ -51,7 +53,7 @@ class emCreator:
         :param SRs: list of signal regions
         FIXME not yet implemented
         """
-        filepath = f"cutlang_results/{ana}/ANA_{self.topo}_1jet/temp/histoOut*root"
+        filepath = f"{self.basedir}/cutlang_results/{ana}/ANA_{self.topo}_1jet/temp/histoOut*root"
         files = glob.glob ( filepath )
         if len(files)==0:
             self.error ( f"could not find any files at {filepath}" )
@@ -104,10 +106,10 @@ class emCreator:
 
     def getMA5Statistics ( self, ana : str, SR : dict = {} ):
         import xml.etree.ElementTree as ET
-        Dir = "ma5/tools/PAD/Build/SampleAnalyzer/User/Analyzer/"
+        Dir = f"{self.basedir}/ma5/tools/PAD/Build/SampleAnalyzer/User/Analyzer/"
         filename = "%s/%s.info" % ( Dir, ana )
         if not os.path.exists ( filename ):
-            Dir = "ma5/tools/PADForMA5tune/Build/SampleAnalyzer/User/Analyzer/"
+            Dir = f"{self.basedir}/ma5/tools/PADForMA5tune/Build/SampleAnalyzer/User/Analyzer/"
             filename = "%s/%s.info" % ( Dir, ana )
         if not os.path.exists ( filename ):
             self.error ( f"could not find statistics file for {ana}" )
@@ -128,53 +130,83 @@ class emCreator:
 
     def getNEvents ( self, masses : List ) -> int:
         fname = bakeryHelpers.safFile ( self.resultsdir, self.topo, masses, self.sqrts )
-        if not os.path.exists ( fname ):
+        nevents = ingest.ma5NEvents ( fname )
+        if nevents == -2:
             print ( "[emCreator.py] %s does not exist, cannot report correct number of events" % fname )
-            return -2
-        with open ( fname, "rt" ) as f:
-            lines=f.readlines()
-            f.close()
+        if nevents == -3:
+            print ( "[emCreator.py] I get confused with %s, cannot report correct number of events" % fname )
+        # ma5/ANA_T6WW_1jet.400_375_350/Output/
+        return nevents
+
+    def artefact ( self, masses, recaster : str ) -> Union[Tuple,None]:
+        """ the result file of the recaster for masses, as an artefact
+            for ingest, None if there is none """
+        if recaster == "adl":
+            smass = "_".join(map(str,masses))
+            fdir = f"{self.basedir}/cutlang_results/{self.analyses}/ANA_{self.topo}_{self.njets}jet/output/"
+            if not os.path.exists ( fdir ):
+                return None
+            toglob = f"{fdir}/*_{smass}.embaked"
+            emglob = glob.glob ( toglob )
+            if len(emglob)==0:
+                print ( "[emCreator] trying to extract cutlang for", masses, end=", " )
+                print ( f"could not find {toglob}" )
+            if len(emglob)>1:
+                print ( "[emCreator] trying to extract cutlang for", masses, end=", " )
+                print( f"found several files for {toglob}" )
+            if len(emglob)!=1:
+                return None
+            return ( "adl", { "filename": emglob[0], "analysis": self.analyses,
+                              "topo": self.topo, "masses": masses } )
+        summaryfile = bakeryHelpers.datFile ( self.resultsdir, self.topo, masses, \
+                                              self.sqrts )
+        saffile = bakeryHelpers.safFile ( self.resultsdir, self.topo, masses, \
+                                          self.sqrts )
+        if not os.path.exists ( summaryfile):
+            # self.info(f"could not find ma5 summary file {summaryfile}. Skipping.")
+            return None
+        self.toDelete.append ( summaryfile )
+        self.toDelete.append ( saffile )
+        return ( "MA5", { "summaryfile": summaryfile, "topo": self.topo,
+                          "masses": masses, "saffile": saffile } )
+
+    def artefacts ( self, masses : List ) -> List:
+        """ the result files of our recaster, for all masses """
+        recaster = "adl" if "adl" in self.recaster else "MA5"
+        ret = []
+        for m in masses:
+            a = self.artefact ( m, recaster )
+            if a is not None:
+                ret.append ( a )
+        return ret
 
-        for ctr,line in enumerate(lines):
-            if "nevents" in line:
-                tokens = lines[ctr+1].split()
-                if len(tokens)<3:
-                    print ( "[emCreator.py] I get confused with %s, cannot report correct number of events" % fname )
-                    return -3
-                return int(tokens[2])
+    def extractAll ( self, masses : List, nprocesses : int = 0 ) -> Tuple:
+        """ extract the efficiencies of all masses from the recaster,
+            parsing the result files in parallel
+        :param nprocesses: number of processes, 0 means one per cpu
+        :returns: effs[analysis][masses][sr], timestamps[analysis][masses]
+        """
+        records = ingest.ingest ( self.artefacts ( masses ), nprocesses )
+        return ingest.toEffs ( records )
 
-        # ma5/ANA_T6WW_1jet.400_375_350/Output/
-        return -1
+    def extractPoint ( self, masses, recaster : str ) -> Tuple:
+        """ extract the efficiencies of a single point
+        :returns: effs[analysis][sr], timestamp
+        """
+        a = self.artefact ( masses, recaster )
+        if a is None:
+            return {}, 0.
+        effs, tstamps = ingest.toEffs ( ingest.parse ( a ) )
+        timestamp = 0.
+        ret = {}
+        for ana, points in effs.items():
+            ret[ana] = points[masses]
+            timestamp = tstamps[ana][masses]
+        return ret, timestamp
 
     def extractCutlang ( self, masses ) -> Tuple:
         """ extract the efficiencies from cutlang """
-        topo = self.topo
-        #summaryfile = f"clsum_{self.topo}_{self.analyses}.dat"
-        #if not os.path.exists ( summaryfile ):
-        #    return {}, 0.
-        effs = {}
-        smass = "_".join(map(str,masses))
-        fdir = f"cutlang_results/{self.analyses}/ANA_{self.topo}_{self.njets}jet/output/"
-        if not os.path.exists ( fdir ):
-            return {},""
-        timestamp = os.stat ( fdir ).st_mtime
-        toglob = f"{fdir}/*_{smass}.embaked"
-        emglob = glob.glob ( toglob )
-        if len(emglob)==1:
-            timestamp = os.stat ( emglob[0] ).st_mtime
-            with open ( emglob[0], "rt" ) as f:
-                txt=f.read()
-                p = txt.find(": ")
-                D = eval( txt[p+2:] )
-                f.close()
-                effs[self.analyses]=D
-        if len(emglob)==0:
-            print ( "[emCreator] trying to extract cutlang for", masses, end=", " )
-            print ( f"could not find {toglob}" )
-        if len(emglob)>1:
-            print ( "[emCreator] trying to extract cutlang for", masses, end=", " )
-            print( f"found several files for {toglob}" )
-        return effs,timestamp
+        return self.extractPoint ( masses, "adl" )
 
     def extract ( self, masses ):
         """ extract the efficiencies from recaster """
@@ -185,61 +217,7 @@ class emCreator:
 
     def extractMA5 ( self, masses ):
         """ extract the efficiencies from MA5 """
-        topo = self.topo
-        njets = self.njets
-        process = "%s_%djet" % ( topo, njets )
-        dirname = bakeryHelpers.dirName ( process, masses )
-        summaryfile = bakeryHelpers.datFile ( self.resultsdir, topo, masses, \
-                                              self.sqrts )
-        saffile = bakeryHelpers.safFile ( self.resultsdir, topo, masses, \
-                                          self.sqrts )
-        if not os.path.exists ( summaryfile):
-            # self.info(f"could not find ma5 summary file {summaryfile}. Skipping.")
-            ret = {}
-            return ret,0.
-        timestamp = os.stat ( summaryfile ).st_mtime
-        f=open(summaryfile,"r")
-        lines=f.readlines()
-        f.close()
-        effs={}
-        for line in lines:
-            p=line.find("#")
-            if p>=0:
-                line=line[:p]
-            line=line.strip()
-            if len(line)==0:
-                continue
-            if "control region" in line:
-                continue
-            line = line.replace("signal region","signal_region")
-            line = line.replace("control region ","control_region_")
-            line = line.replace("signal region ","signal_region_" )
-            line = line.replace("control region","control_region" )
-            line = line.replace("150-1","150 -1")
-            tokens=line.split()
-            if len(tokens) not in [ 7, 8, 10 ]:
-                print ( "[emCreator] In file %s: cannot parse ``%s'': got %d tokens, expected 8 or 10. skip it" % ( summaryfile, line[:50], len(tokens) ) )
-                print ( "   - %s "  % str(tokens) )
-                continue
-            if len(tokens)==10:
-                dsname,ananame,sr,sig95exp,sig95obs,pp,eff,statunc,systunc,totunc=tokens
-            if len(tokens)==8:
-            # datasetname analysisname signalregion sig95(exp) sig95(obs) efficiency stat
-                dsname,ananame,sr,sig95exp,sig95obs,pp,eff,statunc=tokens
-            if len(tokens)==7:
-            # datasetname analysisname signalregion sig95(exp) sig95(obs) efficiency stat
-                dsname,ananame,sr,sig95exp,pp,eff,statunc=tokens
-
-            eff=float(eff)
-            #if eff == 0.:
-                # print ( "zero efficiency for", ananame,sr )
-            #    continue
-            if not ananame in effs:
-                effs[ananame]={}
-            effs[ananame][sr]=eff
-        self.toDelete.append ( summaryfile )
-        self.toDelete.append ( saffile )
-        return effs,timestamp
+        return self.extractPoint ( masses, "MA5" )
 
     def exe ( self, cmd : str ):
         self.msg ( f"now execute: {cmd}" )
@@ -255,32 +233,32 @@ class emCreator:
 
     def countMG5 ( self ):
         """ count the number of mg5 directories """
-        files = glob.glob ( "mg5results/%s_*.hepmc.gz" % ( self.topo ) )
+        files = glob.glob ( "%s/mg5results/%s_*.hepmc.gz" % ( self.basedir, self.topo ) )
         return len(files)
 
     def countRunningMG5 ( self ):
         """ count the number of ma5 directories """
-        files = glob.glob ( f"{self.topo}_*jet.*" )
+        files = glob.glob ( f"{self.basedir}/{self.topo}_*jet.*" )
         return len(files)
 
     def countRunningCm2 ( self ):
-        files = glob.glob ( "cm2results/*" )
+        files = glob.glob ( f"{self.basedir}/cm2results/*" )
         c = 0
         for f in files:
-            if self.topo in f:
+            if self.topo in os.path.basename ( f ):
                 c+=1
         return c
         return len(files)
 
     def countRunningCutlang ( self ):
         """ count the number of cutlang directories """
-        basedir = "cutlang_results"
+        basedir = f"{self.basedir}/cutlang_results"
         files = glob.glob ( f"{basedir}/*/ANA_{self.topo}_*jet/temp/{self.topo}_*.hepmc" )
         return len(files)
 
     def countRunningMA5 ( self ):
         """ count the number of ma5 directories """
-        files = glob.glob ( "ma5_%s_%djet.*" % ( self.topo, self.njets ) )
+        files = glob.glob ( "%s/ma5_%s_%djet.*" % ( self.basedir, self.topo, self.njets ) )
         return len(files)
 
 
@@ -297,6 +275,12 @@ class emCreator:
         f.close()
         print ( f"[emCreator] wrote stats to {statsfile}" )
 
+def embakedDir() -> str:
+    """ the directory of the embaked files """
+    if embakeddir is not None:
+        return embakeddir
+    return os.path.join ( bakeryHelpers.baseDir(), "embaked" )
+
 def embakedFileName ( analysis : str, topo : str, recast : str ):
     """ get the file name of the .embaked file
     :param analysis: e.g. CMS-SUS-16-039
@@ -304,7 +288,7 @@ def embakedFileName ( analysis : str, topo : str, recast : str ):
     :param recaster: which recast to consider
     """
     ana_smodels = analysis.upper().replace("_","-")
-    fname = f"embaked/{ana_smodels}.{topo}.{recast}.embaked"
+    fname = os.path.join ( embakedDir(), f"{ana_smodels}.{topo}.{recast}.embaked" )
     return fname
 
 def massesInEmbakedFile ( masses, analysis, topo, recaster : list ):
@@ -321,17 +305,26 @@ def massesInEmbakedFile ( masses, analysis, topo, recaster : list ):
     with open ( fname, "rt" ) as f:
         lines = f.read()
         f.close()
-        D = eval(lines)
+        D = ast.literal_eval(lines)
         if masses in D.keys() and D[masses] not in [ {}, None ]:
             return True
     return False
 
+def withoutMeta ( D : Dict ) -> Dict:
+    """ a copy of the efficiencies D, without the metadata like __t__ """
+    ret = {}
+    for k,v in D.items():
+        if type(v) == dict:
+            v = { sr: eff for sr,eff in v.items() if not ingest.isMeta ( sr ) }
+        ret[k] = v
+    return ret
+
 def createEmbakedFile( effs, topo, recast : str, tstamps, creator, copy,
                        create_stats ):
     """ not sure, it creates embaked file but also statsEM.py file,
     also copies to database etc """
     ntot = 0
-    bakeryHelpers.mkdir ( "embaked/" )
+    bakeryHelpers.mkdir ( embakedDir() )
     for ana,values in effs.items():
         if len(values.keys()) == 0:
             continue
@@ -340,7 +333,7 @@ def createEmbakedFile( effs, topo, recast : str, tstamps, creator, copy,
         ## read in the old stuff
         if os.path.exists ( fname ):
             f = open ( fname, "rt" )
-            D = eval ( f.read() )
+            D = ast.literal_eval ( f.read() )
             f.close()
             for k,v in D.items():
                 if not k in values:
@@ -359,13 +352,8 @@ def createEmbakedFile( effs, topo, recast : str, tstamps, creator, copy,
             if not x.startswith ( "__" ):
                 nSRs += 1
 
-        for k,v in D.items():
-            if "__nevents__" in D[k]:
-                D[k].pop("__nevents__")
-            if "__t__" in D[k]:
-                D[k].pop("__t__")
-
-        hasChanged = not ( D == values )
+        ## the old points are shared with values, so we must not pop
+        hasChanged = not ( withoutMeta ( D ) == withoutMeta ( values ) )
         if not hasChanged:
             if False:
                 print ( f"[emCreator] {fname}: no changes" )
@@ -387,6 +375,8 @@ def createEmbakedFile( effs, topo, recast : str, tstamps, creator, copy,
                     # v["__t__"]="?"
                 if not recast == "adl" and not "__nevents__" in v:
                     v["__nevents__"]=creator.getNEvents ( k )
+                if not "__cpu__" in v:
+                    v.update ( resourceUsage.totals ( topo, k, creator.sqrts ) )
                 f.write ( "%s: %s, \n" % ( k,v ) )
             f.write ( "}\n" )
             f.close()
@@ -395,16 +385,17 @@ def createEmbakedFile( effs, topo, recast : str, tstamps, creator, copy,
         if "atlas" in ana.lower():
             experiment = "ATLAS"
         sana = bakeryHelpers.ma5AnaNameToSModelSName ( ana )
-        Dirname = "../smodels-database/%dTeV/%s/%s-eff/orig/" % ( sqrts, experiment, sana )
+        database = os.path.join ( bakeryHelpers.baseDir(), "..", "smodels-database" )
+        Dirname = "%s/%dTeV/%s/%s-eff/orig/" % ( database, sqrts, experiment, sana )
         if recast == "MA5":
-            Dirname = "../smodels-database/%dTeV/%s/%s-ma5/orig/" % ( sqrts, experiment, sana )
+            Dirname = "%s/%dTeV/%s/%s-ma5/orig/" % ( database, sqrts, experiment, sana )
         stats = creator.getStatistics ( ana, SRs )
         # print ( "[emCreator] obtained statistics for", ana, "in", fname )
         if copy:
             extensions = [ "ma5", "eff", "adl" ]
             foundExtension = None
             for e in extensions:
-                Dirname = f"../smodels-database/{sqrts}TeV/{experiment}/{sana}-{e}/orig/"
+                Dirname = f"{database}/{sqrts}TeV/{experiment}/{sana}-{e}/orig/"
                 if os.path.exists ( Dirname ):
                     foundExtension = e
                     break
@@ -422,7 +413,7 @@ def createEmbakedFile( effs, topo, recast : str, tstamps, creator, copy,
             if os.path.exists (dest ):
                 f=open(dest,"r")
                 try:
-                    g=eval(f.read())
+                    g=ast.literal_eval(f.read())
                     f.close()
                     prevN=len(g.keys())
                 except:
@@ -458,17 +449,9 @@ def runForTopo ( topo, njets, masses, analyses, verbose, copy, keep, sqrts, reca
     if "adl" in recaster:
         adl_ma5 = "ADL"
     creator = emCreator( analyses, topo, njets, keep, sqrts, recaster )
-    effs,tstamps={},{}
     if verbose:
         print ( "[emCreator] topo %s: %d mass points considered" % ( topo, len(masses) ) )
-    for m in masses:
-        eff,t = creator.extract( m )
-        for k,v in eff.items():
-            if not k in effs:
-                effs[k]={}
-                tstamps[k]={}
-            effs[k][m]=v
-            tstamps[k][m]=t
+    effs,tstamps = creator.extractAll ( masses )
     seffs = ", ".join(list(effs.keys()))
     if seffs == "":
         seffs = "no analysis"
@@ -508,8 +491,8 @@ def runForTopo ( topo, njets, masses, analyses, verbose, copy, keep, sqrts, reca
 
 def getAllCutlangTopos():
     """ get all topos that we find in cutlang """
-    dirname="cutlang_results/"
-    files = glob.glob ( f"{dirname}/*/ANA_*jet" )
+    dirname = os.path.join ( bakeryHelpers.baseDir(), "cutlang_results/" )
+    files = glob.glob ( f"{dirname}*/ANA_*jet" )
     ret = set()
     for f in files:
         t = f.replace ( dirname, "" ).replace("ANA_","")
@@ -532,8 +515,8 @@ def getAllTopos ( recaster ):
     return ret
 
 def getAllMG5Topos():
-    dirname="mg5results/"
-    files = glob.glob ( f"{dirname}/*.hepmc.gz" )
+    dirname = os.path.join ( bakeryHelpers.baseDir(), "mg5results/" )
+    files = glob.glob ( f"{dirname}*.hepmc.gz" )
     topos = set()
     for f in files:
         topo = f.replace(dirname,"")
@@ -542,26 +525,27 @@ def getAllMG5Topos():
     return list(topos)
 
 def getAllRunningMG5Topos():
-    dirs = glob.glob ( "T*_*jet.*" )
+    dirs = glob.glob ( f"{bakeryHelpers.baseDir()}/T*_*jet.*" )
     topos = []
     for d in dirs:
+        d = os.path.basename ( d )
         p1 = d.find("_")
         topos.append ( d[:p1] )
     return topos
 
 def getAllMA5Topos():
-    dirname="ma5results/"
+    dirname = os.path.join ( bakeryHelpers.baseDir(), "ma5results" )
     files = glob.glob ( "%s/T*.dat" % dirname )
     ret = set()
     for f in files:
-        tokens = f.split("_")
-        ret.add( tokens[0].replace(dirname,"") )
+        tokens = os.path.basename ( f ).split("_")
+        ret.add( tokens[0] )
     ret = list(ret)
     ret.sort()
     return ret
 
 def getAllCm2Topos():
-    filenames="cm2results/*/fritz/myprocess.ini"
+    filenames = f"{bakeryHelpers.baseDir()}/cm2results/*/fritz/myprocess.ini"
     files = glob.glob ( filenames )
     ret = set()
     #print ( "files", files )
@@ -580,7 +564,7 @@ def getAllCm2Topos():
 
 def getMG5ListOfAnalyses():
     ret = set()
-    files = glob.glob ( "T*_*jet.*/analysis" )
+    files = glob.glob ( f"{bakeryHelpers.baseDir()}/T*_*jet.*/analysis" )
     for f in files:
         try:
             with open ( f, "rt" ) as h:
@@ -592,7 +576,7 @@ def getMG5ListOfAnalyses():
     return list(ret)
 
 def getCutlangListOfAnalyses():
-    Dir = "cutlang_results/"
+    Dir = os.path.join ( bakeryHelpers.baseDir(), "cutlang_results/" )
     dirs = glob.glob ( f"{Dir}*" )
     tokens = set()
     for d in dirs:
@@ -607,7 +591,7 @@ def getMA5ListOfRunningAnalyses( topo : str, njets : int ) -> List:
     if topo == "all":
         topo="*"
     ret = set()
-    files = glob.glob ( f"ma5_{topo}_{njets}jet.*/recast" )
+    files = glob.glob ( f"{bakeryHelpers.baseDir()}/ma5_{topo}_{njets}jet.*/recast" )
     # print ( "files", files, f"ma5_{topo}_{njets}jet.*/recast" )
     for f in files:
         try:
@@ -629,7 +613,7 @@ def getMA5ListOfRunningAnalyses( topo : str, njets : int ) -> List:
 def getMA5ListOfAnalyses() -> List:
     """ compile list of MA5 analyses """
     ret = "cms_sus_16_048"
-    files = glob.glob("ma5results/T*.dat" )
+    files = glob.glob( f"{bakeryHelpers.baseDir()}/ma5results/T*.dat" )
     tokens = set()
     for f in files:
         with open ( f, "rt" ) as handle:
@@ -649,7 +633,7 @@ def getCm2ListOfAnalyses() -> List:
     """ compile list of checkmate2 analyses """
     ret = "cms_sus_16_048"
     # cm2results/atlas_2010_14293_*/analysis
-    files = glob.glob("cm2results/*/analysis/*.dat" )
+    files = glob.glob( f"{bakeryHelpers.baseDir()}/cm2results/*/analysis/*.dat" )
     tokens = set()
     for f in files:
         with open ( f, "rt" ) as handle:
@@ -663,9 +647,9 @@ def getCm2ListOfAnalyses() -> List:
                         tokens.add ( t )
     addAnasFromEmbaked = True
     if addAnasFromEmbaked:
-        embakedones = glob.glob ( "embaked/*.cm2.embaked" )
+        embakedones = glob.glob ( f"{embakedDir()}/*.cm2.embaked" )
         for embaked in embakedones:
-            embaked = embaked.replace("embaked/","")
+            embaked = os.path.basename ( embaked )
             t = embaked.find(".")
             tokens.add ( embaked[:t] )
     # ret = ",".join ( tokens )
@@ -680,7 +664,7 @@ def embakedFile ( ana : str, topo : str, recaster: list ):
     with open ( fname, "rt" ) as f:
         lines = f.read()
         f.close()
-        D=eval(lines)
+        D=ast.literal_eval(lines)
         return D
     return {}
 
@@ -694,13 +678,13 @@ def run ( args ):
     if args.checkmate:
         recaster = [ "cm2" ]
     ntot, ntotembaked = 0, 0
-    files = glob.glob ( "embaked/*embaked" )
+    files = glob.glob ( f"{embakedDir()}/*embaked" )
     files.sort()
     for fname in files:
         f=open(fname,"rt")
         txt=f.read()
         try:
-            D=eval(txt)
+            D=ast.literal_eval(txt)
         except Exception as e:
             print ( f"[emCreator] error with {fname}: {e} {txt:20}" )
         f.close()
@@ -788,8 +772,17 @@ def main():
     mdefault = "all"
     argparser.add_argument ( '-m', '--masses', help='mass ranges, comma separated list of tuples. One tuple gives the range for one mass parameter, as (m_first,m_last,delta_m). m_last and delta_m may be ommitted. "all" means, try to find out yourself [%s]' % mdefault,
                              type=str, default=mdefault )
+    argparser.add_argument ( '--profile', help='profile the python code with cProfile, write the results to profiles/',
+                             action="store_true" )
+    argparser.add_argument ( '--profile_sample', help='when profiling, also sample the stacks every so many seconds. 0 means no sampling [0.]',
+                             type=float, default=0. )
     args = argparser.parse_args()
-    run ( args )
+    import profiler
+    t0 = time.time()
+    with profiler.profiled ( "emCreator", args.profile, args.profile_sample ):
+        run ( args )
+    if args.profile:
+        print ( profiler.merge ( "emCreator", since = t0 ) )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: eventCache
+   :synopsis: a compact, columnar cache of the events of a hepmc2 file, in
+              <file>.cache/ next to it: numpy arrays of the events, the
+              particles (pid, status, 4-momentum, mass, production and decay
+              vertex) and the vertices (position), as .npy files, which are
+              memory mapped when loaded. convert writes the cache, load reads
+              it, event gives the particles and vertices of one event.
+              momenta and positions are stored as float32.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, re, time, json, shutil
+import numpy
+import hepmcTools
+from typing import Dict, Iterator, Tuple, Union
+
+eventType = numpy.dtype ( [ ( "number", numpy.int64 ), ( "weight", numpy.float64 ),
+        ( "firstParticle", numpy.int64 ), ( "nparticles", numpy.int32 ),
+        ( "firstVertex", numpy.int64 ), ( "nvertices", numpy.int32 ) ] )
+## prodVertex and endVertex are indices into the vertices, -1 if there is none
+particleType = numpy.dtype ( [ ( "barcode", numpy.int32 ), ( "pid", numpy.int32 ),
+        ( "status", numpy.int16 ), ( "px", numpy.float32 ), ( "py", numpy.float32 ),
+        ( "pz", numpy.float32 ), ( "e", numpy.float32 ), ( "m", numpy.float32 ),
+        ( "prodVertex", numpy.int64 ), ( "endVertex", numpy.int64 ) ] )
+vertexType = numpy.dtype ( [ ( "barcode", numpy.int32 ), ( "x", numpy.float32 ),
+        ( "y", numpy.float32 ), ( "z", numpy.float32 ), ( "t", numpy.float32 ) ] )
+
+## the E, V and P lines, the first event of a block gets a newline prepended
+lineStart = re.compile ( rb"\n([EVP]) ([^\n]*)" )
+
+def cacheDir ( filename : str ) -> str:
+    """ the directory of the cache of filename """
+    return f"{filename}.cache"
+
+def isFresh ( filename : str ) -> bool:
+    """ is there a cache of filename, that is younger than filename? """
+    metafile = os.path.join ( cacheDir ( filename ), "source.json" )
+    if not os.path.exists ( metafile ):
+        return False
+    try:
+        with open ( metafile, "rt" ) as f:
+            meta = json.load ( f )
+            f.close()
+    except (json.JSONDecodeError,OSError) as e:
+        return False
+    stat = os.stat ( filename )
+    return meta["size"] == stat.st_size and meta["mtime"] == stat.st_mtime
+
+def parseBlock ( events : bytes ) -> Tuple[numpy.ndarray,numpy.ndarray,numpy.ndarray]:
+    """ parse a block of complete events into the columns. the vertex indices
+        of the particles are local to the block.
+    :returns: events, particles, vertices
+    """
+    lines = lineStart.findall ( b"\n" + events )
+    kinds = numpy.frombuffer ( b"".join ( [ k for k, _ in lines ] ), dtype="S1" )
+    rests = [ r for _, r in lines ]
+    isE, isV, isP = kinds == b"E", kinds == b"V", kinds == b"P"
+    ## the event and the last vertex that every line belongs to
+    ievent = numpy.cumsum ( isE ) - 1
+    ivertex = numpy.cumsum ( isV ) - 1
+
+    infos = [ hepmcTools.eventInfo ( b"E " + rests[j] ) for j in numpy.flatnonzero ( isE ) ]
+    E = numpy.zeros ( len(infos), dtype=eventType )
+    E["number"] = [ info["number"] for info in infos ]
+    E["weight"] = [ info["weights"][0] if len(info["weights"])>0 else 1. for info in infos ]
+
+    ## V barcode id x y z t norphan nout nweights ...
+    vidx = numpy.flatnonzero ( isV )
+    vtokens = numpy.array ( [ rests[j].split ( None, 8 )[:7] for j in vidx ],
+                            dtype=bytes ).reshape(-1,7)
+    V = numpy.zeros ( len(vidx), dtype=vertexType )
+    V["barcode"] = vtokens[:,0].astype ( numpy.int32 )
+    for k, name in zip ( range(2,6), [ "x", "y", "z", "t" ] ):
+        V[name] = vtokens[:,k].astype ( numpy.float64 )
+    norphan = vtokens[:,6].astype ( numpy.int64 )
+
+    ## P barcode pid px py pz e m status theta phi endvertex ...
+    pidx = numpy.flatnonzero ( isP )
+    ptokens = numpy.array ( [ rests[j].split ( None, 11 )[:11] for j in pidx ],
+                            dtype=bytes ).reshape(-1,11)
+    P = numpy.zeros ( len(pidx), dtype=particleType )
+    P["barcode"] = ptokens[:,0].astype ( numpy.int32 )
+    P["pid"] = ptokens[:,1].astype ( numpy.int32 )
+    for k, name in zip ( range(2,7), [ "px", "py", "pz", "e", "m" ] ):
+        P[name] = ptokens[:,k].astype ( numpy.float64 )
+    P["status"] = ptokens[:,7].astype ( numpy.int16 )
+    pevent = ievent[pidx]
+    vevent = ievent[vidx]
+
+    ## the particles after a V line are its orphan incoming particles,
+    ## then its outgoing particles
+    pvertex = ivertex[pidx]
+    orphan = numpy.ones ( len(pidx), dtype=bool )
+    if len(vidx)>0:
+        v = numpy.maximum ( pvertex, 0 )
+        pcount = numpy.cumsum ( isP ) ## number of particles up to every line
+        rank = pcount[pidx] - pcount[vidx[v]] - 1
+        orphan = ( pvertex < 0 ) | ( vevent[v] != pevent ) | ( rank < norphan[v] )
+    P["prodVertex"] = numpy.where ( orphan, -1, pvertex )
+
+    ## events and their ranges of particles and vertices
+    E["nparticles"] = numpy.bincount ( pevent, minlength = len(E) )
+    E["nvertices"] = numpy.bincount ( vevent, minlength = len(E) )
+    E["firstParticle"] = numpy.cumsum ( E["nparticles"] ) - E["nparticles"]
+    E["firstVertex"] = numpy.cumsum ( E["nvertices"] ) - E["nvertices"]
+
+    ## end vertex barcodes to indices: usually the barcodes of an event are
+    ## -1, -2, ..., otherwise search
+    endbc = ptokens[:,10].astype ( numpy.int64 )
+    end = numpy.full ( len(P), -1, dtype=numpy.int64 )
+    hasEnd = endbc != 0
+    guess = E["firstVertex"][pevent] - endbc - 1
+    ok = hasEnd & ( guess >= 0 ) & ( guess < len(V) )
+    ok[ok] &= V["barcode"][guess[ok]] == endbc[ok]
+    ok[ok] &= vevent[guess[ok]] == pevent[ok]
+    end[ok] = guess[ok]
+    for i in numpy.flatnonzero ( hasEnd & ~ok ):
+        first, n = E["firstVertex"][pevent[i]], E["nvertices"][pevent[i]]
+        match = numpy.flatnonzero ( V["barcode"][first:first+n] == endbc[i] )
+        if len(match)>0:
+            end[i] = first + match[0]
+    P["endVertex"] = end
+    return E, P, V
+
+def convert ( filename : str, force : bool = False ) -> str:
+    """ write the cache of the hepmc file filename, unless it is fresh
+    :param force: write it, even if it is fresh
+    :returns: the cache directory
+    """
+    dirname = cacheDir ( filename )
+    if not force and isFresh ( filename ):
+        return dirname
+    stat = os.stat ( filename )
+    Es, Ps, Vs = [], [], []
+    nparticles, nvertices = 0, 0
+    for offset, header, events, footer in hepmcTools.blocks ( filename ):
+        if len(events)==0:
+            continue
+        E, P, V = parseBlock ( events )
+        E["firstParticle"] += nparticles
+        E["firstVertex"] += nvertices
+        for name in [ "prodVertex", "endVertex" ]:
+            P[name] = numpy.where ( P[name] >= 0, P[name] + nvertices, -1 )
+        nparticles += len(P)
+        nvertices += len(V)
+        Es.append ( E )
+        Ps.append ( P )
+        Vs.append ( V )
+    tmpdir = f"{dirname}.{os.getpid()}.tmp"
+    os.makedirs ( tmpdir, exist_ok=True )
+    for name, arrays, dtype in [ ( "events", Es, eventType ),
+            ( "particles", Ps, particleType ), ( "vertices", Vs, vertexType ) ]:
+        array = numpy.concatenate ( arrays ) if len(arrays)>0 else numpy.zeros ( 0, dtype=dtype )
+        numpy.save ( os.path.join ( tmpdir, f"{name}.npy" ), array )
+    with open ( os.path.join ( tmpdir, "source.json" ), "wt" ) as f:
+        json.dump ( { "source": os.path.basename ( filename ),
+                      "size": stat.st_size, "mtime": stat.st_mtime,
+                      "nevents": sum ( [ len(E) for E in Es ] ),
+                      "nparticles": nparticles, "nvertices": nvertices }, f )
+        f.close()
+    if os.path.exists ( dirname ):
+        shutil.rmtree ( dirname )
+    os.replace ( tmpdir, dirname )
+    return dirname
+
+def load ( filename : str, mmap : bool = True ) -> Dict:
+    """ the cache of the hepmc file filename, converted if needed
+    :param mmap: memory map the arrays, instead of reading them
+    :returns: dictionary with the arrays events, particles, vertices
+    """
+    dirname = convert ( filename )
+    mode = "r" if mmap else None
+    return { name: numpy.load ( os.path.join ( dirname, f"{name}.npy" ), mmap_mode = mode ) \
+             for name in [ "events", "particles", "vertices" ] }
+
+def event ( cache : Dict, i : int ) -> Dict:
+    """ the i-th event of the cache, as views
+    :returns: dictionary with the event record, its particles and vertices.
+              the vertex indices of the particles are global.
+    """
+    E = cache["events"][i]
+    p, v = int(E["firstParticle"]), int(E["firstVertex"])
+    return { "event": E,
+             "particles": cache["particles"][p:p+int(E["nparticles"])],
+             "vertices": cache["vertices"][v:v+int(E["nvertices"])] }
+
+def events ( cache : Dict ) -> Iterator[Dict]:
+    """ iterate over the events of the cache, see event """
+    for i in range ( len ( cache["events"] ) ):
+        yield event ( cache, i )
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='write the columnar cache of hepmc files.')
+    argparser.add_argument ( 'files', help='the hepmc files, possibly gzipped',
+                             type=str, nargs="+" )
+    argparser.add_argument ( '-f', '--force', help='rewrite fresh caches',
+                             action='store_true' )
+    args = argparser.parse_args()
+    for filename in args.files:
+        t0 = time.time()
+        dirname = convert ( filename, args.force )
+        cache = load ( filename )
+        print ( f"[eventCache] {dirname}: {len(cache['events'])} events, {len(cache['particles'])} particles, in {time.time()-t0:.1f}s" )
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: hepmcTools
+   :synopsis: fast, streaming tools for hepmc2 (IO_GenEvent) files, that
+              work on whole blocks of events with regular expressions,
+              never particle by particle in python. the files may be gzipped.
+              filterEvents applies an event condition, i.e. required pid
+              multiplicities like {25:1}, at generator level, while
+              decompressing. events iterates over the single events,
+              index builds (and caches in a sidecar <file>.idx.npz) the
+              offsets, numbers and weights of the events, and the offsets
+              of the gzip members, for random access with readEvent.
+              verify checks if a file is complete, verifyAll does so for
+              many files in parallel. recompress re-encodes a file as block
+              gzip, see blockGzip.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, re, gzip, time, mmap, zlib, itertools, ast
+import numpy
+import blockGzip
+from typing import Dict, Iterator, Tuple, List, Union, Callable
+
+blockSize = 1 << 24 ## read so many (decompressed) bytes at once, 16 MB
+readSize = 1 << 20 ## read so many compressed bytes at once
+## in a multiline regex, ^ is much slower than a literal newline
+eventStart = re.compile ( rb"\nE " )
+footerStart = b"HepMC::IO_GenEvent-END_EVENT_LISTING"
+
+def openHepmc ( filename : str ):
+    """ open a hepmc file for reading, binary, gzipped or not """
+    if filename.endswith ( ".gz" ):
+        return gzip.open ( filename, "rb" )
+    return open ( filename, "rb" )
+
+def chunks ( filename : str, members : Union[List,None] = None ) -> Iterator[Tuple[int,bytes]]:
+    """ iterate over the decompressed content of the file, in chunks of at
+        most blockSize bytes. plain files are memory mapped, block gzip
+        files are inflated in parallel.
+    :param members: if a list, append ( compressed offset, uncompressed
+                    offset ) of every gzip member of the file to it
+    :returns: tuples of ( uncompressed offset, data )
+    """
+    if not filename.endswith ( ".gz" ):
+        with open ( filename, "rb" ) as f:
+            size = os.fstat ( f.fileno() ).st_size
+            if size == 0:
+                return
+            with mmap.mmap ( f.fileno(), 0, access = mmap.ACCESS_READ ) as m:
+                for offset in range ( 0, size, blockSize ):
+                    yield offset, m[offset:offset+blockSize]
+        return
+    yield from blockGzip.iterate ( filename, members = members )
+
+def blocks ( filename : str, members : Union[List,None] = None ) \
+        -> Iterator[Tuple[int,bytes,bytes,bytes]]:
+    """ iterate over the file in blocks of complete events
+    :param members: see chunks
+    :returns: tuples of ( offset, header, events, footer ). the header is only
+              in the first block, the footer only in the last, both are
+              b"" otherwise. events is a sequence of complete events,
+              that starts at the (uncompressed) offset in the file.
+    """
+    carry = b""
+    offset = 0 ## offset of carry in the file
+    first = True
+    for _, data in itertools.chain ( chunks ( filename, members ), [ ( None, b"" ) ] ):
+        buf = carry + data
+        header = b""
+        if first:
+            m = eventStart.search ( buf )
+            if m is None and len(data)>0:
+                ## header longer than a block, read more
+                carry = buf
+                continue
+            p = m.start()+1 if m is not None else len(buf)
+            header, buf = buf[:p], buf[p:]
+            offset += p
+            first = False
+        if len(data)==0:
+            p = buf.find ( footerStart )
+            if p < 0:
+                yield offset, header, buf, b""
+            else:
+                yield offset, header, buf[:p], buf[p:]
+            return
+        ## the last event may be incomplete, carry it over
+        p = buf.rfind ( b"\nE " ) + 1
+        if p <= 0:
+            carry = buf
+            if len(header)>0:
+                yield offset, header, b"", b""
+            continue
+        carry = buf[p:]
+        yield offset, header, buf[:p], b""
+        offset += p
+
+def events ( filename : str ) -> Iterator[Tuple[int,bytes]]:
+    """ iterate over the events of the file, one by one
+    :returns: tuples of ( uncompressed offset, event )
+    """
+    for offset, header, evs, footer in blocks ( filename ):
+        starts = eventStarts ( evs )
+        ends = numpy.append ( starts[1:], len(evs) )
+        for a, b in zip ( starts, ends ):
+            yield offset + int(a), evs[a:b]
+
+def eventInfo ( event : bytes ) -> Dict:
+    """ the event number and the weights, from the E line of an event:
+        E <number> <nmpi> <scale> <aQCD> <aQED> <process id> <signal vertex>
+          <nvertices> <beam1> <beam2> <nrandom> <random states...>
+          <nweights> <weights...> """
+    p = event.find ( b"\n" )
+    tokens = event[:p if p >= 0 else len(event)].split()
+    pw = 12 + int ( tokens[11] )
+    nweights = int ( tokens[pw] )
+    weights = [ float(x) for x in tokens[pw+1:pw+1+nweights] ]
+    return { "number": int ( tokens[1] ), "weights": weights }
+
+def indexFileName ( filename : str ) -> str:
+    """ the name of the index sidecar of filename """
+    return f"{filename}.idx.npz"
+
+def remove ( filename : str ):
+    """ remove the hepmc file filename, and its index """
+    for f in [ filename, indexFileName ( filename ) ]:
+        try:
+            os.unlink ( f )
+        except FileNotFoundError as e:
+            pass
+
+def buildIndex ( filename : str ) -> Dict:
+    """ scan the file once, and index its events.
+    :returns: dictionary with the arrays offsets (uncompressed offsets of the
+              events, plus the offset of the end of the last event), numbers
+              (event numbers), weights (first weight of every event), members
+              (compressed and uncompressed offsets of the gzip members, for
+              gzipped files), and nevents, sumw, complete (footer found),
+              error (why the file could not be read to the end, if so),
+              size and mtime of the file
+    """
+    stat = os.stat ( filename )
+    members = []
+    offsets, numbers, weights = [], [], []
+    end, complete, error = 0, False, ""
+    try:
+        for offset, header, evs, footer in blocks ( filename, members ):
+            starts = eventStarts ( evs )
+            infos = [ eventInfo ( evs[s:evs.find ( b"\n", s )] ) for s in starts ]
+            numbers += [ info["number"] for info in infos ]
+            weights += [ info["weights"][0] if len(info["weights"])>0 else 1. for info in infos ]
+            offsets.append ( starts + offset )
+            end = offset + len(evs)
+            complete = complete or footer.startswith ( footerStart )
+    except (EOFError,zlib.error,ValueError,IndexError) as e:
+        ## truncated or corrupt, index what we have
+        error = str(e)
+    offsets.append ( numpy.array ( [ end ], dtype=numpy.int64 ) )
+    weights = numpy.array ( weights, dtype=numpy.float64 )
+    return { "offsets": numpy.concatenate ( offsets ),
+             "numbers": numpy.array ( numbers, dtype=numpy.int64 ),
+             "weights": weights,
+             "members": numpy.array ( members, dtype=numpy.int64 ).reshape(-1,2),
+             "nevents": len(numbers), "sumw": float ( weights.sum() ),
+             "complete": complete, "error": error,
+             "size": stat.st_size, "mtime": stat.st_mtime }
+
+def index ( filename : str, rebuild : bool = False ) -> Dict:
+    """ the index of filename, see buildIndex. it is cached in a sidecar
+        file, that is rebuilt when size or mtime of filename change """
+    idxfile = indexFileName ( filename )
+    stat = os.stat ( filename )
+    if not rebuild and os.path.exists ( idxfile ):
+        try:
+            with numpy.load ( idxfile ) as f:
+                idx = { k: f[k] for k in f.files }
+            for k in [ "nevents", "sumw", "complete", "error", "size", "mtime" ]:
+                idx[k] = idx[k].item()
+            if idx["size"] == stat.st_size and idx["mtime"] == stat.st_mtime:
+                return idx
+        except Exception as e:
+            pass ## broken sidecar, rebuild
+    idx = buildIndex ( filename )
+    writeIndex ( filename, idx )
+    return idx
+
+def writeIndex ( filename : str, idx : Dict ):
+    """ write the index sidecar of filename """
+    idxfile = indexFileName ( filename )
+    tmpfile = f"{idxfile}.{os.getpid()}.tmp"
+    try:
+        with open ( tmpfile, "wb" ) as f:
+            numpy.savez ( f, **idx )
+        os.replace ( tmpfile, idxfile )
+    except OSError as e:
+        ## read-only directory, works without the sidecar
+        if os.path.exists ( tmpfile ):
+            os.unlink ( tmpfile )
+
+def recompress ( filename : str, nthreads : int = 0 ) -> Dict:
+    """ re-encode a gzipped hepmc file as block gzip, in place, and keep
+        its index valid, the event offsets do not change
+    :returns: dictionary with insize, outsize, nmembers, see blockGzip.compress
+    """
+    idx = index ( filename )
+    stats = blockGzip.compress ( filename, nthreads = nthreads )
+    stat = os.stat ( filename )
+    members, upos = [], 0
+    for offset, size, isize in blockGzip.readMembers ( filename ):
+        members.append ( ( offset, upos ) )
+        upos += isize
+    idx["members"] = numpy.array ( members, dtype=numpy.int64 ).reshape(-1,2)
+    idx["size"], idx["mtime"] = stat.st_size, stat.st_mtime
+    writeIndex ( filename, idx )
+    return stats
+
+def readRange ( filename : str, start : int, end : int,
+                members : Union[numpy.ndarray,None] = None ) -> bytes:
+    """ the uncompressed bytes [start,end) of the file. plain files are
+        memory mapped, gzipped files are decompressed from the gzip member
+        that contains start, so block gzipped files are cheap.
+    :param members: the gzip members, from the index
+    """
+    if not filename.endswith ( ".gz" ):
+        with open ( filename, "rb" ) as f:
+            with mmap.mmap ( f.fileno(), 0, access = mmap.ACCESS_READ ) as m:
+                return m[start:end]
+    cpos, upos = 0, 0
+    if members is not None and len(members)>0:
+        i = numpy.searchsorted ( members[:,1], start, side="right" ) - 1
+        cpos, upos = int(members[i][0]), int(members[i][1])
+    ret = []
+    with open ( filename, "rb" ) as f:
+        f.seek ( cpos )
+        d = zlib.decompressobj ( wbits = 31 )
+        while upos < end:
+            buf = d.unconsumed_tail
+            if len(buf)==0:
+                if d.eof:
+                    buf = d.unused_data
+                    d = zlib.decompressobj ( wbits = 31 )
+                if len(buf)==0:
+                    buf = f.read ( readSize )
+                if len(buf)==0:
+                    break
+            data = d.decompress ( buf, blockSize )
+            if upos + len(data) > start:
+                ret.append ( data[max(0,start-upos):end-upos] )
+            upos += len(data)
+    return b"".join ( ret )
+
+def readEvent ( filename : str, i : int, idx : Union[Dict,None] = None ) -> bytes:
+    """ the i-th event of the file (counting from zero), via the index """
+    if idx is None:
+        idx = index ( filename )
+    offsets = idx["offsets"]
+    return readRange ( filename, int(offsets[i]), int(offsets[i+1]), idx["members"] )
+
+def count ( filename : str ) -> Dict:
+    """ number of events and sum of weights, via the index """
+    idx = index ( filename )
+    return { "nevents": idx["nevents"], "sumw": idx["sumw"],
+             "complete": idx["complete"] }
+
+def verify ( filename : str, nevents : Union[int,None] = None,
+             minFraction : float = .2 ) -> Dict:
+    """ is filename a complete hepmc file, with enough events? a gzipped
+        file is decompressed once, which checks the crc of every gzip member,
+        plain files must end with the footer. the verdict comes from the
+        index, so it is cached in the sidecar, keyed by size and mtime.
+    :param nevents: the number of events that were requested, if known
+    :param minFraction: we need at least minFraction * nevents events,
+                        jet matching vetoes a good part of the events
+    :returns: dictionary with ok, reason, nevents, sumw
+    """
+    ret = { "ok": False, "reason": "", "nevents": 0, "sumw": 0. }
+    if not os.path.exists ( filename ):
+        ret["reason"] = "does not exist"
+        return ret
+    size = os.stat ( filename ).st_size
+    if size < 100:
+        ret["reason"] = f"too small ({size} bytes)"
+        return ret
+    if not filename.endswith ( ".gz" ) and not os.path.exists ( indexFileName ( filename ) ):
+        ## cheap test first: a killed job leaves no footer
+        with open ( filename, "rb" ) as f:
+            f.seek ( max ( 0, size - 4096 ) )
+            if not footerStart in f.read():
+                ret["reason"] = "no end of event listing"
+                return ret
+    idx = index ( filename )
+    ret["nevents"], ret["sumw"] = idx["nevents"], idx["sumw"]
+    if idx["error"] != "":
+        ret["reason"] = f"corrupt after {idx['nevents']} events: {idx['error']}"
+    elif not idx["complete"]:
+        ret["reason"] = "no end of event listing"
+    elif idx["nevents"] == 0:
+        ret["reason"] = "no events"
+    elif nevents is not None and idx["nevents"] < minFraction * nevents:
+        ret["reason"] = f"only {idx['nevents']}/{nevents} events"
+    else:
+        ret["ok"] = True
+    return ret
+
+def verifyAll ( filenames : List[str], nevents : Union[int,None] = None,
+                nprocesses : int = 0 ) -> Dict:
+    """ verify many files in parallel, e.g. all of mg5results/
+    :param nprocesses: number of processes, 0 means one per cpu
+    :returns: dictionary with the verdict per file name
+    """
+    import concurrent.futures
+    if nprocesses < 1:
+        nprocesses = os.cpu_count()
+    nprocesses = max ( 1, min ( nprocesses, len(filenames) ) )
+    with concurrent.futures.ProcessPoolExecutor ( nprocesses ) as executor:
+        verdicts = executor.map ( verify, filenames, [ nevents ] * len(filenames) )
+        return dict ( zip ( filenames, verdicts ) )
+
+def eventStarts ( events : bytes ) -> numpy.ndarray:
+    """ the offsets of the events in a block of complete events """
+    starts = [ 0 ] + [ m.start()+1 for m in eventStart.finditer ( events ) ]
+    if len(events)==0:
+        starts = []
+    return numpy.array ( starts, dtype=numpy.int64 )
+
+def multiplicities ( events : bytes, starts : numpy.ndarray,
+                     pattern : re.Pattern ) -> numpy.ndarray:
+    """ how often does pattern match in every event of the block """
+    positions = numpy.array ( [ m.start() for m in pattern.finditer ( events ) ],
+                              dtype=numpy.int64 )
+    ievent = numpy.searchsorted ( starts, positions, side="right" ) - 1
+    return numpy.bincount ( ievent, minlength = len(starts) )
+
+def parseEventCondition ( condition : str ) -> Dict:
+    """ '{"higgs":1}' -> { 25: 1 }, the names gamma, Z and higgs are replaced
+        by their pids, the keys are always ints """
+    for k,v in { "gamma": 22, "Z": 23, "higgs": 25 }.items():
+        condition = condition.replace ( k, str(v) )
+    return { int(k): int(v) for k,v in ast.literal_eval ( condition ).items() }
+
+def conditionPatterns ( condition : Dict ) -> Dict:
+    """ one regular expression per pid, that matches its particle lines:
+        P <barcode> <pid> ... """
+    return { pid: re.compile ( rb"\nP \d+ %d " % int(pid) ) for pid in condition.keys() }
+
+def eventMask ( events : bytes, starts : numpy.ndarray, condition : Dict,
+                patterns : Dict ) -> numpy.ndarray:
+    """ which events of the block have exactly the required multiplicities?
+        the pids are signed, as in CutLangWrapper.filterDelphes """
+    mask = numpy.ones ( len(starts), dtype=bool )
+    for pid, n in condition.items():
+        mask &= multiplicities ( events, starts, patterns[pid] ) == n
+    return mask
+
+def writeSelected ( infile : str, outfile : str, select : Callable ) -> Dict:
+    """ write the events of infile that select picks to outfile,
+        uncompressed, e.g. as input for delphes.
+    :param select: select ( events, starts, ievent ) gives the mask of the
+                   events of a block, ievent is the number of its first event
+    :returns: dictionary with nevents, npass and fraction
+    """
+    nevents, npass = 0, 0
+    tmpfile = f"{outfile}.{os.getpid()}.tmp"
+    with open ( tmpfile, "wb" ) as out:
+        for offset, header, events, footer in blocks ( infile ):
+            out.write ( header )
+            starts = eventStarts ( events )
+            mask = select ( events, starts, nevents )
+            ends = numpy.append ( starts[1:], len(events) )
+            nevents += len(starts)
+            npass += int ( mask.sum() )
+            out.write ( b"".join ( [ events[a:b] for a, b in zip ( starts[mask], ends[mask] ) ] ) )
+            out.write ( footer )
+        out.close()
+    os.replace ( tmpfile, outfile )
+    fraction = npass / nevents if nevents > 0 else 0.
+    return { "nevents": nevents, "npass": npass, "fraction": fraction }
+
+def filterEvents ( infile : str, outfile : str, condition : Dict ) -> Dict:
+    """ write the events of infile that pass condition to outfile,
+        uncompressed, e.g. as input for delphes.
+    :param condition: required multiplicities per pid, e.g. { 25: 1 }
+    :returns: dictionary with nevents, npass and fraction
+    """
+    patterns = conditionPatterns ( condition )
+    return writeSelected ( infile, outfile,
+            lambda events, starts, ievent: eventMask ( events, starts, condition, patterns ) )
+
+def selectEvents ( infile : str, outfile : str, mask : numpy.ndarray ) -> Dict:
+    """ write the events of infile whose entry in mask is True to outfile,
+        e.g. with a mask computed from the delphes output. events beyond
+        the end of the mask are dropped.
+    :returns: dictionary with nevents, npass and fraction
+    """
+    def select ( events, starts, ievent ):
+        ret = numpy.zeros ( len(starts), dtype=bool )
+        m = mask[ievent:ievent+len(starts)]
+        ret[:len(m)] = m
+        return ret
+    return writeSelected ( infile, outfile, select )
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='streaming tools for hepmc2 files.')
+    argparser.add_argument ( 'infile', help='the hepmc file, possibly gzipped. with --verify also a directory, e.g. mg5results',
+                             type=str )
+    argparser.add_argument ( '-o', '--outfile', help='write the events that pass the condition to this file [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-e', '--event_condition', help='required pid multiplicities, e.g. {"higgs":1} or {25:1} [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-i', '--index', help='(re)build the index, and print number of events and sum of weights',
+                             action='store_true' )
+    argparser.add_argument ( '-n', '--event', help='print the n-th event (counting from zero) [None]',
+                             type=int, default=None )
+    argparser.add_argument ( '-v', '--verify', help='check if the file(s) are complete',
+                             action='store_true' )
+    argparser.add_argument ( '-N', '--nevents', help='with --verify: the number of events that were requested [None]',
+                             type=int, default=None )
+    argparser.add_argument ( '-p', '--nprocesses', help='with --verify: number of processes, 0 means one per cpu [0]',
+                             type=int, default=0 )
+    argparser.add_argument ( '-r', '--requeue', help='with --verify: rename bad files to <file>.bad, so they get produced again',
+                             action='store_true' )
+    args = argparser.parse_args()
+    t0 = time.time()
+    if args.verify:
+        files = [ args.infile ]
+        if os.path.isdir ( args.infile ):
+            import glob
+            files = glob.glob ( f"{args.infile}/*.hepmc.gz" ) + glob.glob ( f"{args.infile}/*.hepmc" )
+        verdicts = verifyAll ( sorted(files), args.nevents, args.nprocesses )
+        nbad = 0
+        for filename, verdict in verdicts.items():
+            if verdict["ok"]:
+                continue
+            nbad += 1
+            print ( f"[hepmcTools] {filename}: {verdict['reason']}" )
+            if args.requeue and os.path.exists ( filename ):
+                os.replace ( filename, f"{filename}.bad" )
+        print ( f"[hepmcTools] {len(verdicts)-nbad}/{len(verdicts)} files ok, in {time.time()-t0:.1f}s" )
+        sys.exit ( 0 if nbad == 0 else 1 )
+    if args.index:
+        idx = index ( args.infile, rebuild = True )
+        complete = "" if idx["complete"] else ", no footer"
+        print ( f"[hepmcTools] {args.infile}: {idx['nevents']} events, sum of weights {idx['sumw']:g}{complete}, indexed in {time.time()-t0:.1f}s" )
+    if args.event is not None:
+        sys.stdout.write ( readEvent ( args.infile, args.event ).decode() )
+    if args.index or args.event is not None:
+        sys.exit()
+    if args.outfile is None or args.event_condition is None:
+        argparser.error ( "need --outfile and --event_condition" )
+    stats = filterEvents ( args.infile, args.outfile,
+                           parseEventCondition ( args.event_condition ) )
+    print ( f"[hepmcTools] {stats['npass']}/{stats['nevents']} events pass, written to {args.outfile} in {time.time()-t0:.1f}s" )
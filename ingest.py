@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: ingest
+   :synopsis: one place to read the results of the recasters. there is a
+              streaming parser per kind of artefact, that yields uniform
+              records: the MA5 summary (.dat) files, the per-point .embaked
+              files of CutLang, and the CheckMATE result (.dat) files.
+              ingest fans the parsing of many artefacts out over a pool of
+              processes, toEffs turns records into the dictionaries of the
+              .embaked files. signal regions whose names start and end with
+              two underscores are metadata, e.g. __cpu__ or __prefilter__.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, re, ast, time
+import concurrent.futures
+from typing import Dict, List, Tuple, Iterator, NamedTuple, Union
+
+class Record ( NamedTuple ):
+    """ the efficiency of one signal region, for one point """
+    analysis : str
+    topo : str
+    masses : Tuple
+    sr : str
+    eff : float
+    nevents : int ## -1 if unknown
+    timestamp : float ## when the recaster produced it
+    recaster : str
+
+## a number, e.g. 1.0e-02, or inf, nan. MA5 sometimes glues two of them: 150-1
+number = re.compile ( r"^[-+]?((\d+\.?\d*|\.\d+)(e[-+]?\d+)?|inf|nan)$", re.IGNORECASE )
+
+def isMeta ( sr : str ) -> bool:
+    """ is the signal region name metadata, like __nevents__? """
+    return sr.startswith ( "__" ) and sr.endswith ( "__" )
+
+def ma5NEvents ( saffile : str ) -> int:
+    """ the number of events, from the MA5 .saf file.
+    :returns: -2 if there is no file, -3 if we cannot parse it,
+              -1 if there is no number of events in it
+    """
+    if not os.path.exists ( saffile ):
+        return -2
+    with open ( saffile, "rt" ) as f:
+        previous = ""
+        for line in f:
+            if "nevents" in previous:
+                tokens = line.split()
+                if len(tokens)<3:
+                    return -3
+                return int(tokens[2])
+            previous = line
+        f.close()
+    return -1
+
+def parseMA5 ( summaryfile : str, topo : str, masses : Tuple,
+               saffile : Union[str,None] = None ) -> Iterator[Record]:
+    """ the records of a MA5 summary file. a line is
+        <dataset> <analysis> <region name> <numbers...>, where the region name
+        may contain spaces, and there are 7 numbers (sig95exp, sig95obs, xsec,
+        eff, stat, syst, tot), 5 (no syst, tot), or 4 (no sig95obs either).
+    :param saffile: the .saf file with the number of events
+    """
+    nevents = ma5NEvents ( saffile ) if saffile is not None else -1
+    timestamp = os.stat ( summaryfile ).st_mtime
+    with open ( summaryfile, "rt" ) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if len(line)==0 or "control region" in line:
+                continue
+            tokens = line.split()
+            n = 0 ## the number of numbers at the end
+            while n < len(tokens)-2:
+                token = tokens[-1-n]
+                if number.match ( token ):
+                    n += 1
+                    continue
+                p = token.find ( "-", 1 )
+                if p > 0 and number.match ( token[:p] ) and number.match ( token[p:] ):
+                    ## two glued numbers
+                    tokens[-1-n:len(tokens)-n] = [ token[:p], token[p:] ]
+                    continue
+                break
+            ## a region name may end with a number, e.g. signal region 1
+            n = max ( [ k for k in [ 0, 4, 5, 7 ] if k <= n ] )
+            if len(tokens)-n < 3 or n == 0:
+                print ( f"[ingest] In file {summaryfile}: cannot parse ``{line[:50]}'': got {len(tokens)} tokens. skip it" )
+                continue
+            numbers = tokens[len(tokens)-n:]
+            eff = numbers[3] if n == 7 else numbers[-2]
+            sr = "_".join ( tokens[2:len(tokens)-n] )
+            yield Record ( tokens[1], topo, masses, sr, float(eff), nevents,
+                           timestamp, "MA5" )
+        f.close()
+
+def parseEmbaked ( filename : str, analysis : str, topo : str,
+                   recaster : str = "adl",
+                   masses : Union[Tuple,None] = None ) -> Iterator[Record]:
+    """ the records of an .embaked file, e.g. the per-point files of
+        CutLang: { <masses>: { <sr>: <eff>, ... }, ... }. the comment lines
+        and the braces are optional. __nevents__ goes to the nevents of the
+        records, __t__ is dropped, the timestamp is the mtime of the file
+    :param masses: if given, use these masses for all points in the file,
+                   instead of the keys of the file
+    """
+    timestamp = os.stat ( filename ).st_mtime
+    with open ( filename, "rt" ) as f:
+        txt = "".join ( [ l for l in f if not l.startswith ( "#" ) ] ).strip()
+        f.close()
+    if not txt.startswith ( "{" ):
+        txt = "{" + txt + "}"
+    for key, effs in ast.literal_eval ( txt ).items():
+        point = key if masses is None else masses
+        nevents = int ( effs.get ( "__nevents__", -1 ) )
+        for sr, eff in effs.items():
+            if sr in [ "__nevents__", "__t__" ]:
+                continue
+            yield Record ( analysis, topo, point, sr, float(eff), nevents,
+                           timestamp, recaster )
+
+def parseCM2 ( datfile : str, analysis : str, topo : str,
+               masses : Tuple ) -> Iterator[Record]:
+    """ the records of a CheckMATE result file: MCEvents and SumOfWeights
+        in the header, then one line per signal region, starting with the
+        line that starts with SR, the efficiency is the fourth column.
+        SumOfWeights becomes the __SumOfWeights__ record. """
+    timestamp = os.stat ( datfile ).st_mtime
+    nevents, sumw = -1, -1.
+    effs = []
+    inSignalRegions = False
+    with open ( datfile, "rt" ) as f:
+        for line in f:
+            if line.startswith ( "MCEvents:" ):
+                nevents = int ( line.replace ( "MCEvents:", "" ) )
+            if line.startswith ( " SumOfWeights:" ):
+                sumw = float ( line.replace ( " SumOfWeights:", "" ) )
+            if inSignalRegions:
+                tokens = line.split()
+                effs.append ( ( tokens[0], float(tokens[3]) ) )
+            if inSignalRegions == False and not line.startswith("SR"):
+                continue
+            inSignalRegions = True
+        f.close()
+    effs.append ( ( "__SumOfWeights__", sumw ) )
+    for sr, eff in effs:
+        yield Record ( analysis, topo, masses, sr, eff, nevents, timestamp, "cm2" )
+
+parsers = { "MA5": parseMA5, "adl": parseEmbaked, "cm2": parseCM2 }
+
+def parse ( artefact : Tuple[str,Dict] ) -> List[Record]:
+    """ parse one artefact, ( kind, keyword arguments of the parser ),
+        e.g. ( "MA5", { "summaryfile": ..., "topo": "T2", "masses": (500,100) } ) """
+    kind, kwargs = artefact
+    return list ( parsers[kind] ( **kwargs ) )
+
+def ingest ( artefacts : List[Tuple[str,Dict]], nprocesses : int = 0 ) -> List[Record]:
+    """ parse many artefacts, in a pool of processes
+    :param artefacts: list of ( kind, keyword arguments ), see parse
+    :param nprocesses: number of processes, 0 means one per cpu
+    :returns: the records of all artefacts, in order
+    """
+    if nprocesses < 1:
+        nprocesses = os.cpu_count() or 1
+    nprocesses = min ( nprocesses, len(artefacts) )
+    if nprocesses < 2:
+        return [ r for a in artefacts for r in parse ( a ) ]
+    with concurrent.futures.ProcessPoolExecutor ( nprocesses ) as executor:
+        chunksize = max ( 1, len(artefacts) // ( 4 * nprocesses ) )
+        return [ r for rs in executor.map ( parse, artefacts, chunksize = chunksize ) for r in rs ]
+
+def toEffs ( records : List[Record] ) -> Tuple[Dict,Dict]:
+    """ the records as dictionaries, like in the .embaked files.
+        __nevents__ is added if it is known.
+    :returns: effs[analysis][masses][sr], timestamps[analysis][masses]
+    """
+    effs, tstamps = {}, {}
+    for r in records:
+        if not r.analysis in effs:
+            effs[r.analysis], tstamps[r.analysis] = {}, {}
+        if not r.masses in effs[r.analysis]:
+            effs[r.analysis][r.masses] = {}
+        point = effs[r.analysis][r.masses]
+        point[r.sr] = r.eff
+        if r.nevents >= 0:
+            point["__nevents__"] = r.nevents
+        tstamps[r.analysis][r.masses] = r.timestamp
+    return effs, tstamps
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='print the records of recaster results.')
+    argparser.add_argument ( 'kind', help='MA5, adl or cm2', type=str )
+    argparser.add_argument ( 'files', help='the result files', type=str, nargs="+" )
+    argparser.add_argument ( '-a', '--analysis', help='the analysis, for adl and cm2 [?]',
+                             type=str, default="?" )
+    argparser.add_argument ( '-t', '--topo', help='the topology [?]',
+                             type=str, default="?" )
+    argparser.add_argument ( '-m', '--masses', help='the masses, for MA5 and cm2, e.g. "(500,100)" [()]',
+                             type=str, default="()" )
+    argparser.add_argument ( '-p', '--nprocesses', help='number of processes, 0 means one per cpu [0]',
+                             type=int, default=0 )
+    args = argparser.parse_args()
+    masses = ast.literal_eval ( args.masses )
+    artefacts = []
+    for f in args.files:
+        if args.kind == "MA5":
+            kwargs = { "summaryfile": f, "topo": args.topo, "masses": masses }
+        elif args.kind == "adl":
+            kwargs = { "filename": f, "analysis": args.analysis, "topo": args.topo }
+        else:
+            kwargs = { "datfile": f, "analysis": args.analysis, "topo": args.topo,
+                       "masses": masses }
+        artefacts.append ( ( args.kind, kwargs ) )
+    t0 = time.time()
+    records = ingest ( artefacts, args.nprocesses )
+    for r in records:
+        print ( r )
+    print ( f"[ingest] {len(records)} records from {len(artefacts)} files, in {time.time()-t0:.1f}s" )
@@ -9,21 +9,182 @@
 .. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
 """
 
-import os, sys, subprocess, time, socket, random, colorama
-import signal
-import bakeryHelpers
+import os, sys, time, socket, random, colorama
+import signal, threading
+import bakeryHelpers, hepmcTools
+from typing import Union, Dict
 
+## the leases of this process, shared by all threads and Lockers,
+## always access them with __locks_mutex__
 __locks__ = set()
+__locks_mutex__ = threading.Lock()
+__heartbeat__ = { "pid": None, "thread": None }
+__handover__ = set() ## leases that we keep until another process adopts them
+__signals__ = { "pid": None } ## the process that installed the signal handlers
+
+leaseTime = 600. ## a lease expires after that many seconds without renewal
+adoptionTimeout = 6 * 3600. ## give up on handed over leases after that many seconds
 
 def signal_handler(sig, frame):
-    print('You pressed Ctrl+C, remove all locks!')
-    for l in __locks__:
-        cmd = "rm -f %s" % l
-        subprocess.getoutput ( cmd )
-        print ( cmd )
+    if sig == signal.SIGTERM:
+        ## e.g. slurm pre-empting us. the checkpoints allow us to resume
+        print('We got terminated, remove all locks!')
+    else:
+        print('You pressed Ctrl+C, remove all locks!')
+    for l in list(__locks__):
+        if removeLease ( l ):
+            print ( f"removed {l}" )
     sys.exit(0)
 
-signal.signal(signal.SIGINT, signal_handler)
+def installSignalHandlers():
+    """ remove our locks when we get interrupted or terminated. done by the
+        first Locker of a process, not at import, so that processes that only
+        read the leases (e.g. the dashboard) keep their own handling """
+    if __signals__["pid"] == os.getpid():
+        return
+    if threading.current_thread() is not threading.main_thread():
+        return ## signal handlers can only be set from the main thread
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    __signals__["pid"] = os.getpid()
+
+def readLease ( filename : str ) -> Union[Dict,None]:
+    """ read the lease in filename. leases are written as
+        "asctime,host,pid,leasetime", old style locks as "asctime,host".
+        the expiry is the mtime of the file plus the lease time,
+        the owner renews it by touching the file.
+    :returns: dictionary with host, pid, expiry, content, or None if there is
+              no lock file
+    """
+    try:
+        with open ( filename, "rt" ) as f:
+            content = f.read()
+            f.close()
+        mtime = os.stat ( filename ).st_mtime
+    except FileNotFoundError as e:
+        return None
+    tokens = content.strip().split(",")
+    ret = { "host": None, "pid": None, "content": content,
+            "expiry": mtime + leaseTime }
+    if len(tokens)>1:
+        ret["host"] = tokens[1]
+    try:
+        if len(tokens)>3:
+            ret["pid"] = int ( tokens[2] )
+            ret["expiry"] = mtime + float ( tokens[3] )
+    except ValueError as e:
+        pass
+    return ret
+
+def pidIsAlive ( pid : int ) -> bool:
+    """ is process pid running on this host? """
+    try:
+        os.kill ( pid, 0 )
+    except ProcessLookupError as e:
+        return False
+    except PermissionError as e:
+        ## exists, but belongs to someone else
+        return True
+    return True
+
+def isStale ( lease : Union[Dict,None] ) -> bool:
+    """ is the lease expired, or is its owner on this host dead? """
+    if lease is None:
+        return True
+    if time.time() > lease["expiry"]:
+        return True
+    if lease["host"] == socket.gethostname() and lease["pid"] is not None:
+        return not pidIsAlive ( lease["pid"] )
+    return False
+
+def isOwnLease ( lease : Union[Dict,None] ) -> bool:
+    if lease is None:
+        return False
+    return lease["host"] == socket.gethostname() and \
+           lease["pid"] == os.getpid()
+
+def removeLease ( filename : str ) -> bool:
+    """ remove the lock file filename, but only if it is our lease.
+        a lease that we lost may have been reclaimed by someone else.
+    :returns: True if we removed it
+    """
+    if not isOwnLease ( readLease ( filename ) ):
+        return False
+    try:
+        os.unlink ( filename )
+    except FileNotFoundError as e:
+        return False
+    return True
+
+def renewLeases():
+    """ renew all the leases of this process, drop the ones we lost """
+    with __locks_mutex__:
+        filenames = list ( __locks__ )
+    for filename in filenames:
+        lease = readLease ( filename )
+        if not isOwnLease ( lease ):
+            if not filename in __handover__:
+                print ( f"[locker] lost the lease {filename}!" )
+            with __locks_mutex__:
+                __locks__.discard ( filename )
+                __handover__.discard ( filename )
+            continue
+        try:
+            os.utime ( filename )
+        except OSError as e:
+            print ( f"[locker] could not renew {filename}: {e}" )
+
+def takeBackLeases():
+    """ take back the leases that we handed over but no one adopted,
+        and remove them """
+    with __locks_mutex__:
+        filenames = list ( __handover__ )
+        __handover__.clear()
+        for filename in filenames:
+            __locks__.discard ( filename )
+    for filename in filenames:
+        if removeLease ( filename ):
+            print ( f"[locker] took back and removed {filename}" )
+
+def waitForAdoption ( interval : float = 5., timeout : float = adoptionTimeout,
+                      alive = None ) -> bool:
+    """ before we exit, wait until all the leases we handed over are adopted.
+        if that takes longer than timeout, or if no adopter is alive
+        anymore, take them back, see takeBackLeases.
+    :param alive: function that tells if any adopter is still alive
+    :returns: True if all leases were adopted
+    """
+    t0 = time.time()
+    while len ( __handover__ ) > 0:
+        renewLeases()
+        if len ( __handover__ ) == 0:
+            break
+        if alive is not None and not alive():
+            print ( f"[locker] no adopter left for {len(__handover__)} leases" )
+            takeBackLeases()
+            return False
+        if time.time() - t0 > timeout:
+            print ( f"[locker] {len(__handover__)} leases not adopted after {timeout:.0f}s" )
+            takeBackLeases()
+            return False
+        time.sleep ( interval )
+    return True
+
+def heartbeat ( interval : float ):
+    """ the heartbeat thread, renews the leases every interval seconds """
+    while True:
+        time.sleep ( interval )
+        renewLeases()
+
+def startHeartbeat():
+    """ start the heartbeat thread, once per process """
+    if __heartbeat__["pid"] == os.getpid():
+        return
+    thread = threading.Thread ( target = heartbeat, args = ( leaseTime / 4., ),
+                                daemon = True )
+    thread.start()
+    __heartbeat__["pid"] = os.getpid()
+    __heartbeat__["thread"] = thread
 
 class Locker:
     def __init__ ( self, sqrts, topo, ignore_locks, prefix=".lock" ):
@@ -36,11 +197,10 @@ class Locker:
         """
         self.basedir = bakeryHelpers.baseDir()
         self.ignore_locks = ignore_locks
-        #os.chdir ( self.basedir ) subprocessler scripti çalıştırdığım yerde olsun istiyorum
-        os.chdir(os.getcwd())
         self.sqrts = sqrts
         self.topo = topo
         self.prefix = prefix
+        installSignalHandlers()
 
     def info ( self, *msg ):
         print ( "%s[locker] %s%s" % ( colorama.Fore.YELLOW, " ".join ( msg ), \
@@ -61,44 +221,118 @@ class Locker:
 
     def isLocked ( self, masses ):
         """ a simple query if a point is locked, 
-            but does not lock itself. """
+            but does not lock itself. expired leases do not count. """
         filename = self.lockfile( masses )
-        return os.path.exists ( filename )
+        if not os.path.exists ( filename ):
+            return False
+        return not isStale ( readLease ( filename ) )
+
+    def reclaim ( self, filename, lease ):
+        """ remove the stale lease in filename. we move it out of the way
+            atomically, and if it turns out that in the meantime someone
+            else has taken the lease, we put it back.
+        :returns: True if we removed it
+        """
+        tmp = f"{filename}.stale.{socket.gethostname()}.{os.getpid()}"
+        try:
+            os.rename ( filename, tmp )
+        except FileNotFoundError as e:
+            return True ## someone else reclaimed it, try again
+        with open ( tmp, "rt" ) as f:
+            content = f.read()
+            f.close()
+        if content != lease["content"]:
+            ## we stole a fresh lease, give it back
+            try:
+                os.link ( tmp, filename )
+            except FileExistsError as e:
+                ## yet another process locked it in the meantime. we must not
+                ## destroy the lease we took, leave it for its owner to see
+                self.error ( f"cannot give back the lease {filename}, it is in {tmp}" )
+                return False
+            os.unlink ( tmp )
+            return False
+        os.unlink ( tmp )
+        self.info ( f"reclaimed stale lock {filename} of {lease['host']}:{lease['pid']}" )
+        return True
 
     def lock ( self, masses ):
         """ lock for topo and masses, to make sure processes dont
-            overwrite each other
+            overwrite each other. the lock is a lease, which is renewed
+            periodically by a heartbeat thread.
         :returns: True if there is already a lock on it
         """
         if self.ignore_locks:
             return False
         filename = self.lockfile( masses )
-        __locks__.add ( filename )
-        if os.path.exists ( filename ):
-            return True
         for i in range(5):
             try:
-                with open ( filename, "wt" ) as f:
-                    f.write ( time.asctime()+","+socket.gethostname()+"\n" )
+                fd = os.open ( filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY )
+                with os.fdopen ( fd, "wt" ) as f:
+                    f.write ( f"{time.asctime()},{socket.gethostname()},{os.getpid()},{leaseTime}\n" )
                     f.close()
+                with __locks_mutex__:
+                    __locks__.add ( filename )
+                startHeartbeat()
                 return False
+            except FileExistsError as e:
+                lease = readLease ( filename )
+                if not isStale ( lease ):
+                    return True
+                if lease is not None and not self.reclaim ( filename, lease ):
+                    return True
             except FileNotFoundError as e:
                 t0 = random.uniform(2.,4.*i)
                 self.msg ( "FileNotFoundError #%d %s. Sleep for %.1fs" % ( i, e, t0 ) )
                 time.sleep( t0 )
         return True ## pretend there is a lock
 
+    def handOver ( self, masses ):
+        """ we will hand over the lease to another process, which adopts it.
+            we keep on renewing it until then. """
+        if self.ignore_locks:
+            return
+        with __locks_mutex__:
+            __handover__.add ( self.lockfile( masses ) )
+
+    def adopt ( self, masses, owner : Union[int,None] = None ):
+        """ take over the lease that another process handed over to us
+        :param owner: the pid of the process that handed it over,
+                      default is our parent
+        :returns: True if there is a lock by someone else on it
+        """
+        if self.ignore_locks:
+            return False
+        if owner is None:
+            owner = os.getppid()
+        filename = self.lockfile( masses )
+        lease = readLease ( filename )
+        if lease is None:
+            return self.lock ( masses )
+        if lease["host"] != socket.gethostname() or lease["pid"] != owner:
+            self.error ( f"{filename} is not the lease of {owner}, cannot adopt it" )
+            return True
+        tmp = f"{filename}.adopt.{socket.gethostname()}.{os.getpid()}"
+        with open ( tmp, "wt" ) as f:
+            f.write ( f"{time.asctime()},{socket.gethostname()},{os.getpid()},{leaseTime}\n" )
+            f.close()
+        os.replace ( tmp, filename )
+        with __locks_mutex__:
+            __locks__.add ( filename )
+        startHeartbeat()
+        return False
+
     def unlock ( self, masses ):
         """ unlock for topo and masses, to make sure processes dont
             overwrite each other """
         if self.ignore_locks:
             return
         filename = self.lockfile( masses )
-        if filename in __locks__:
-            __locks__.remove ( filename )
-        if os.path.exists ( filename ):
-            cmd = "rm -f %s" % filename
-            subprocess.getoutput ( cmd )
+        with __locks_mutex__:
+            __locks__.discard ( filename )
+            __handover__.discard ( filename )
+        if os.path.exists ( filename ) and not removeLease ( filename ):
+            self.error ( f"{filename} is not our lease anymore, leave it" )
 
     def hepmcFileName ( self, masses ):
         """ return the hepmc file name at final destination.
@@ -110,15 +344,19 @@ class Locker:
                ( resultsdir, self.topo, smasses, self.sqrts )
         return dest
 
-    def hasHEPMC ( self, masses ):
-        """ does it have a valid HEPMC file? if yes, then skip the point """
+    def hasHEPMC ( self, masses, nevents : Union[int,None] = None ):
+        """ does it have a valid HEPMC file? if yes, then skip the point.
+            truncated files, or files with too few events, do not count,
+            so the point gets produced again.
+        :param nevents: the number of events that were requested, if known
+        """
         hepmcfile = self.hepmcFileName( masses )
         if not os.path.exists ( hepmcfile ):
             return False
-        if os.stat ( hepmcfile ).st_size < 100:
-            ## too small to be real
-            return False
-        return True
+        verdict = hepmcTools.verify ( hepmcfile, nevents )
+        if not verdict["ok"]:
+            self.error ( f"{hepmcfile} is not valid: {verdict['reason']}" )
+        return verdict["ok"]
 
     def hasMA5Files ( self, masses ):
         """ check if all MA5 files are there """
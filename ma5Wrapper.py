@@ -11,7 +11,7 @@
 import os, sys, colorama, subprocess, shutil, tempfile, time, io
 import multiprocessing
 import bakeryHelpers
-import locker
+import locker, tracer, resourceUsage, runner, hepmcTools
 
 class MA5Wrapper:
     def __init__ ( self, topo, njets, rerun, analyses, keep=False,
@@ -32,7 +32,6 @@ class MA5Wrapper:
         self.keep = keep
         self.keephepmc = keephepmc
         self.basedir = bakeryHelpers.baseDir()
-        os.chdir ( self.basedir )
         self.locker = locker.Locker ( sqrts, topo, False )
         self.ma5results = "%s/ma5results/" % self.basedir
         bakeryHelpers.mkdir ( self.ma5results )
@@ -132,7 +131,7 @@ class MA5Wrapper:
                 # sys.exit()
             f.write ( "%s         v%s        on    %s.tcl\n" % ( i, versions[i], recastcard[i] ) )
         f.close()
-        self.debug ( "wrote recasting card %s in %s" % ( filename, os.getcwd() ) )
+        self.debug ( "wrote recasting card %s" % filename )
 
     def unlink ( self, f ):
         if os.path.exists ( f ) and not self.keep:
@@ -227,7 +226,6 @@ class MA5Wrapper:
         if pid != None:
             spid = "[%d]" % pid
         self.commandfile = tempfile.mktemp ( prefix="ma5cmd", dir=self.ma5install )
-        self.teefile = tempfile.mktemp ( prefix="ma5", suffix=".run", dir="/tmp" )
         process = "%s_%djet" % ( self.topo, self.njets )
         hasAllInfo = self.checkForSummaryFile ( masses )
         if hasAllInfo:
@@ -255,14 +253,15 @@ class MA5Wrapper:
         a = subprocess.getoutput ( "mv %s %s/ma5cmd" % \
                                    ( self.commandfile, tempdir ) )
 
-        # then run MadAnalysis
-        os.chdir ( tempdir )
-        cmd = "python3 %s -R -s ./ma5cmd 2>&1 | tee %s" % (self.executable, \
-                self.teefile )
-        self.exe ( cmd, maxLength=None )
+        # then run MadAnalysis, in tempdir. we never chdir, so
+        # many wrappers can run in threads of one process
+        cmd = "python3 %s -R -s ./ma5cmd" % self.executable
+        tracer.updateContext ( topo = self.topo, masses = masses,
+                               analysis = self.analyses, sqrts = self.sqrts )
+        with tracer.span ( "ma5" ):
+            self.exe ( cmd, maxLength=None, cwd=tempdir )
         # self.unlink ( self.recastfile )
         # self.unlink ( self.commandfile )
-        self.unlink ( self.teefile )
         smass = "_".join ( map ( str, masses ) )
         origsaffile = "%s/ANA_%s_%djet.%s/Output/SAF/defaultset/defaultset.saf" % \
                        ( tempdir, self.topo, self.njets, smass )
@@ -286,8 +285,8 @@ class MA5Wrapper:
             if self.keephepmc:
                 self.info ( f"not removing {hepmcfile}" )
             else:
-                cmd = f"rm -rf {hepmcfile}"
-                self.exe ( cmd )
+                self.info ( f"removing {hepmcfile}" )
+                hepmcTools.remove ( hepmcfile )
         if errFree and not self.keep and os.path.exists ( tempdir ):
             self.exe ( f"rm -rf {tempdir}" )
         if False and not errFree: # skip this for now
@@ -295,14 +294,18 @@ class MA5Wrapper:
             dirname = f"{self.basedir}/debug/"
             bakeryHelpers.mkdir ( dirname )
             self.exe ( f"mv {tempdir} {dirname}" )
-        os.chdir ( self.basedir )
         return 0
 
-    def exe ( self, cmd, maxLength=100 ):
+    def exe ( self, cmd, maxLength=100, cwd=None ):
         """ execute cmd in shell
-        :param maxLength: maximum length of output to be printed
+        :param maxLength: maximum length of output to be printed,
+                          all output goes to the log file of the point,
+                          see runner.run
+        :param cwd: the working directory of cmd, default is basedir
         """
-        self.msg ( f"exec: [{os.getcwd()}] {cmd}" )
+        if cwd is None:
+            cwd = self.basedir
+        self.msg ( f"exec: [{cwd}] {cmd}" )
         """ for container only!
         myenv = dict(os.environ)
         # home = "/scratch-cbe/users/wolfgan.waltenberger/"
@@ -323,14 +326,7 @@ class MA5Wrapper:
                                   stdout=subprocess.PIPE,
                                   stderr=subprocess.PIPE )
         """
-        pipe = subprocess.Popen ( cmd, shell=True, stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE )
-        ret=""
-        for line in io.TextIOWrapper(pipe.stdout, encoding="latin1"):
-            ret+=line
-        for line in io.TextIOWrapper(pipe.stderr, encoding="latin1"):
-            ret+=line
-        #ret = subprocess.getoutput ( cmd )
+        ret = runner.run ( cmd, cwd = cwd, tailBytes = maxLength if maxLength is not None else 1<<20 )["tail"]
         ret = ret.strip()
         if len(ret)==0:
             return
@@ -376,7 +372,15 @@ if __name__ == "__main__":
                              type=int, default=1 )
     argparser.add_argument ( '-r', '--rerun', help='force rerun, even if there is a summary file already',
                              action="store_true" )
+    argparser.add_argument ( '--profile', help='profile the python code with cProfile, per process, write the results to profiles/',
+                             action="store_true" )
+    argparser.add_argument ( '--profile_sample', help='when profiling, also sample the stacks every so many seconds. 0 means no sampling [0.]',
+                             type=float, default=0. )
+    argparser.add_argument ( '--threads', help='run the nprocesses chunks in threads of one process, instead of separate processes',
+                             action="store_true" )
     args = argparser.parse_args()
+    import profiler
+    t0 = time.time()
     if args.list_analyses:
         ma5 = MA5Wrapper( args.topo, args.njets, args.rerun, args.analyses )
         ma5.list_analyses()
@@ -405,6 +409,7 @@ if __name__ == "__main__":
     djobs = int(len(masses)/nprocesses)
 
     def runChunk ( chunk, pid ):
+        ma5 = ma5s[pid]
         for c in chunk:
             hashepmc = ma5.locker.hasHEPMC ( c )
             hepmcfile = ma5.locker.hepmcFileName ( c )
@@ -417,11 +422,33 @@ if __name__ == "__main__":
                     ma5.info ( f"skipping {hepmcfile}: is locked." )
                     
 
-    jobs=[]
+    chunks = []
     for i in range(nprocesses):
         chunk = masses[djobs*i:djobs*(i+1)]
         if i == nprocesses-1:
             chunk = masses[djobs*i:]
-        p = multiprocessing.Process(target=runChunk, args=(chunk,i))
+        chunks.append ( chunk )
+    if args.threads:
+        ## one wrapper per thread, they keep the state of their current point
+        ma5s = [ ma5 ] + [ MA5Wrapper( args.topo, args.njets, args.rerun, args.analyses,
+                   args.keep, args.sqrts ) for i in range(1,nprocesses) ]
+        from concurrent.futures import ThreadPoolExecutor
+        ## cProfile sees only its own thread, so we profile in every task
+        task = profiler.wrap ( runChunk, "ma5Wrapper", args.profile, args.profile_sample )
+        with ThreadPoolExecutor ( max_workers = nprocesses ) as executor:
+            for f in [ executor.submit ( task, chunk, i ) for i, chunk in enumerate ( chunks ) ]:
+                f.result()
+        if args.profile:
+            print ( profiler.merge ( "ma5Wrapper", since = t0 ) )
+        sys.exit()
+    ma5s = [ ma5 ] * nprocesses
+    jobs=[]
+    for i, chunk in enumerate ( chunks ):
+        p = multiprocessing.Process(target=profiler.wrap ( runChunk,
+                "ma5Wrapper", args.profile, args.profile_sample ), args=(chunk,i))
         jobs.append ( p )
         p.start()
+    if args.profile:
+        for j in jobs:
+            j.join()
+        print ( profiler.merge ( "ma5Wrapper", since = t0 ) )
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: metrics
+   :synopsis: metrics of the baking, exported in the prometheus text
+              exposition format, for the textfile collector of the
+              node-exporter. all processes on a host update one shared
+              state file (under flock); whoever updates it after the
+              export interval has passed rewrites the .prom file.
+              the file is configured with EMCREATOR_METRICS_FILE,
+              EMCREATOR_METRICS=0 switches the metrics off.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, time, json, fcntl, socket, glob
+from typing import Dict, Union, Callable
+
+textfile = os.environ.get ( "EMCREATOR_METRICS_FILE", None )
+enabled = os.environ.get ( "EMCREATOR_METRICS", "1" ) not in [ "0", "" ]
+interval = 30. ## rewrite the textfile at most every so many seconds
+buckets = [ 1., 5., 10., 30., 60., 120., 300., 600., 1200., 1800., 3600.,
+            7200., 14400., 28800. ]
+helps = {
+    "emcreator_points_completed_total": ( "counter", "points that were recast successfully" ),
+    "emcreator_points_failed_total": ( "counter", "points that failed, recaster mg5 means the event generation failed" ),
+    "emcreator_last_completion_timestamp_seconds": ( "gauge", "unix time of the last completed point" ),
+    "emcreator_stage_duration_seconds": ( "histogram", "wall time of the stages of a point" ),
+    "emcreator_active_locks": ( "gauge", "number of points that are locked right now" ),
+    "emcreator_queued_hepmc_files": ( "gauge", "hepmc files in mg5results/ waiting to be recast" ),
+    "emcreator_directory_bytes": ( "gauge", "bytes in the directories of the bakery" ),
+}
+
+def textFile() -> str:
+    if textfile is not None:
+        return textfile
+    import bakeryHelpers
+    host = socket.gethostname()
+    if host.find(".")>0:
+        host = host[:host.find(".")]
+    return os.path.join ( bakeryHelpers.baseDir(), "metrics", f"emcreator_{host}.prom" )
+
+def labelKey ( labels : Dict ) -> str:
+    """ the labels in prometheus syntax, sorted, e.g. {stage="delphes",topo="T2"} """
+    if len(labels)==0:
+        return ""
+    tokens = [ '%s="%s"' % ( k, str(v).replace('"','\\"') ) for k,v in sorted ( labels.items() ) ]
+    return "{" + ",".join ( tokens ) + "}"
+
+def update ( fn : Callable ):
+    """ update the shared state with fn(state), export if it is time """
+    if not enabled:
+        return
+    statefile = textFile() + ".state.json"
+    try:
+        os.makedirs ( os.path.dirname ( statefile ), exist_ok=True )
+        with open ( statefile, "a+" ) as f:
+            fcntl.flock ( f, fcntl.LOCK_EX )
+            f.seek ( 0 )
+            txt = f.read()
+            D = json.loads ( txt ) if len(txt)>0 else {}
+            for k in [ "counters", "gauges", "histograms" ]:
+                if not k in D:
+                    D[k] = {}
+            fn ( D )
+            export_ = time.time() - D.get ( "exported", 0. ) > interval
+            if export_:
+                D["exported"] = time.time()
+            f.seek ( 0 )
+            f.truncate ()
+            json.dump ( D, f )
+            f.flush()
+            fcntl.flock ( f, fcntl.LOCK_UN )
+            f.close()
+        if export_:
+            export ( D )
+    except (OSError,ValueError) as e:
+        print ( f"[metrics] cannot update {statefile}: {e}" )
+
+def inc ( name : str, value : float = 1., **labels ):
+    """ increase a counter """
+    def fn ( D ):
+        C = D["counters"].setdefault ( name, {} )
+        key = labelKey ( labels )
+        C[key] = C.get ( key, 0. ) + value
+    update ( fn )
+
+def setGauge ( name : str, value : float, **labels ):
+    def fn ( D ):
+        D["gauges"].setdefault ( name, {} )[labelKey ( labels )] = value
+    update ( fn )
+
+def observe ( name : str, value : float, **labels ):
+    """ add value to a histogram """
+    def fn ( D ):
+        H = D["histograms"].setdefault ( name, {} )
+        key = labelKey ( labels )
+        if not key in H:
+            H[key] = { "buckets": [ 0 ] * len(buckets), "count": 0, "sum": 0. }
+        h = H[key]
+        for i,b in enumerate ( buckets ):
+            if value <= b:
+                h["buckets"][i] += 1
+        h["count"] += 1
+        h["sum"] += value
+    update ( fn )
+
+def pointCompleted ( topo : str, analysis : str, recaster : str ):
+    def fn ( D ):
+        labels = labelKey ( { "topo": topo, "analysis": analysis, "recaster": recaster } )
+        C = D["counters"].setdefault ( "emcreator_points_completed_total", {} )
+        C[labels] = C.get ( labels, 0. ) + 1
+        G = D["gauges"].setdefault ( "emcreator_last_completion_timestamp_seconds", {} )
+        G[labelKey ( { "topo": topo } )] = time.time()
+    update ( fn )
+
+def pointFailed ( topo : str, analysis : str, recaster : str ):
+    inc ( "emcreator_points_failed_total", topo = topo, analysis = analysis,
+          recaster = recaster )
+
+def directoryBytes ( dirname : str ) -> int:
+    """ bytes in dirname, recursively, with scandir """
+    ret = 0
+    try:
+        with os.scandir ( dirname ) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir ( follow_symlinks = False ):
+                        ret += directoryBytes ( entry.path )
+                    elif entry.is_file ( follow_symlinks = False ):
+                        ret += entry.stat ( follow_symlinks = False ).st_size
+                except OSError as e:
+                    continue
+    except OSError as e:
+        pass
+    return ret
+
+def collectGauges() -> Dict:
+    """ the gauges that we compute at export time """
+    import bakeryHelpers, locker
+    basedir = bakeryHelpers.baseDir()
+    ret = {}
+    nlocks = 0
+    for l in glob.glob ( f"{basedir}/.lock*" ):
+        if ".stale." in l or ".adopt." in l:
+            continue
+        if not locker.isStale ( locker.readLease ( l ) ):
+            nlocks += 1
+    ret["emcreator_active_locks"] = { "": nlocks }
+    nhepmc = 0
+    resultsdir = os.path.join ( basedir, "mg5results" )
+    if os.path.isdir ( resultsdir ):
+        with os.scandir ( resultsdir ) as it:
+            for entry in it:
+                if entry.name.endswith ( ".hepmc.gz" ):
+                    nhepmc += 1
+    ret["emcreator_queued_hepmc_files"] = { "": nhepmc }
+    D = {}
+    for d in [ "mg5results", "cutlang_results", "temp" ]:
+        D[labelKey ( { "dir": d } )] = directoryBytes ( os.path.join ( basedir, d ) )
+    ret["emcreator_directory_bytes"] = D
+    return ret
+
+def export ( D : Dict ):
+    """ write the textfile, atomically """
+    lines = []
+    def header ( name ):
+        if name in helps:
+            lines.append ( f"# HELP {name} {helps[name][1]}" )
+            lines.append ( f"# TYPE {name} {helps[name][0]}" )
+    for name, values in sorted ( D["counters"].items() ):
+        header ( name )
+        for key, v in sorted ( values.items() ):
+            lines.append ( f"{name}{key} {v}" )
+    gauges = dict ( D["gauges"] )
+    gauges.update ( collectGauges() )
+    for name, values in sorted ( gauges.items() ):
+        header ( name )
+        for key, v in sorted ( values.items() ):
+            lines.append ( f"{name}{key} {v}" )
+    for name, values in sorted ( D["histograms"].items() ):
+        header ( name )
+        for key, h in sorted ( values.items() ):
+            inner = key[1:-1] + "," if key != "" else ""
+            for b, n in zip ( buckets, h["buckets"] ):
+                lines.append ( f'{name}_bucket{{{inner}le="{b}"}} {n}' )
+            lines.append ( f'{name}_bucket{{{inner}le="+Inf"}} {h["count"]}' )
+            lines.append ( f"{name}_sum{key} {h['sum']}" )
+            lines.append ( f"{name}_count{key} {h['count']}" )
+    filename = textFile()
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open ( tmp, "wt" ) as f:
+        f.write ( "\n".join ( lines ) + "\n" )
+        f.close()
+    os.replace ( tmp, filename )
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='export the baking metrics in the prometheus text format.')
+    argparser.add_argument ( '-f', '--textfile', help='the .prom file [metrics/emcreator_<host>.prom]',
+                             type=str, default=None )
+    argparser.add_argument ( '-l', '--loop', help='export every so many seconds, forever. 0 means once [0]',
+                             type=float, default=0. )
+    args = argparser.parse_args()
+    if args.textfile is not None:
+        textfile = args.textfile
+    while True:
+        update ( lambda D: D.update ( { "exported": 0. } ) )
+        print ( f"[metrics] exported to {textFile()}" )
+        if args.loop <= 0.:
+            break
+        time.sleep ( args.loop )
@@ -9,8 +9,8 @@
 """
 
 import os, sys, colorama, subprocess, shutil, tempfile, time, socket, random, ast
-import multiprocessing, glob, io
-import bakeryHelpers
+import multiprocessing, multiprocessing.connection, queue, glob, io, hashlib
+import bakeryHelpers, checkpoint, tracer, resourceUsage, metrics, profiler, runner, hepmcTools
 from bakeryHelpers import rmLocksOlderThan
 import locker
 from typing import Dict, List
@@ -28,11 +28,12 @@ class MG5Wrapper:
         print("basedir: ",self.basedir)
         #os.chdir ( self.basedir )
         self.tempdir = bakeryHelpers.tempDir()
-        #self.resultsdir = os.path.join(self.basedir, "mg5results")
-        self.resultsdir = os.path.join(os.getcwd(), "mg5results")
+        self.resultsdir = os.path.join(self.basedir, "mg5results")
         self.recast = args["recast"]
         self.adl_file = args["adl_file"]
         self.event_condition = args["event_condition"]
+        self.slim_delphes = args["slim_delphes"]
+        self.block_gzip = args["block_gzip"]
         self.mkdir ( self.resultsdir )
         self.locker = locker.Locker ( args["sqrts"], args["topo"],
                                       args["ignore_locks"] )
@@ -41,6 +42,16 @@ class MG5Wrapper:
         self.keephepmc = args["keephepmc"]
         self.rerun = args["rerun"]
         self.njets = args["njets"]
+        self.maxReshowers = 3 ## after that many failed showers, regenerate the lhe
+        self.recastQueue = None ## in pipelined mode, the recasters get the points from here
+        self.recasterSentinels = None ## and we watch the recaster processes via these
+        self.compileCache = None
+        self.compilerWrappers = {}
+        if args["compile_cache"]:
+            import compileCache
+            self.compileCache = compileCache.CompileCache ( \
+                    maxsize = args["compile_cache_size"] )
+            self.compilerWrappers = self.compileCache.setup()
         self.mg5install = os.path.join(self.basedir, "mg5")
         self.logfile = None
         self.logfile2 = None
@@ -337,13 +348,17 @@ class MG5Wrapper:
             self.info ( f"If you wish to remove it:\nrm {self.locker.lockfile(masses)}" )
             return
         self.process = "%s_%djet" % ( self.topo, self.njets )
-        if self.locker.hasHEPMC ( masses ):
+        tracer.setContext ( topo = self.topo, masses = masses, analysis = analyses,
+                            sqrts = self.sqrts )
+        if self.rerun:
+            self.checkpoint ( masses ).reset()
+            resourceUsage.reset ( self.topo, masses, self.sqrts )
+        if self.locker.hasHEPMC ( masses, self.nevents ):
             if not self.rerun:
                 which  = self.recaster[0]
                 self.info ( "hepmc file for %s[%s] exists. go directly to %s." % \
                             ( str(masses), self.topo, which ) )
-                self.runRecasting ( masses, analyses, pid )
-                self.locker.unlock ( masses )
+                self.recastOrHandOver ( masses, analyses, pid )
                 return
             else:
                 self.info ( "hepmc file for %s exists, but rerun requested." % str(masses) )
@@ -359,36 +374,96 @@ class MG5Wrapper:
        
         self.announce ( "starting MG5 on %s[%s] at %s in job #%s" % (masses, self.topo, time.asctime(), pid ) )
         slhaTemplate = f"slha/{self.topo}_template.slha"
-        self.pluginMasses( slhaTemplate, masses )
-        # first write pythia card
-        self.writePythiaCard ( process=self.process, masses=masses )
-        # then write command file
-        self.writeCommandFile( process=self.process, masses=masses )
+        with tracer.span ( "cards" ):
+            self.pluginMasses( slhaTemplate, masses )
+            # first write pythia card
+            self.writePythiaCard ( process=self.process, masses=masses )
+            # then write command file
+            self.writeCommandFile( process=self.process, masses=masses )
         # then run madgraph5
         r=self.execute ( self.slhafile, masses )
         self.unlink ( self.slhafile )
         if r:
-            self.runRecasting ( masses, analyses, pid )
+            self.recastOrHandOver ( masses, analyses, pid )
+            return
         self.locker.unlock ( masses )
 
-    def runRecasting ( self, masses, analyses, pid ):
-        """ run the recasting. cutlang or ma5 """
+    def recastOrHandOver ( self, masses, analyses, pid ):
+        """ run the recasting and unlock, or, in pipelined mode, hand over
+            the point to the recasters. blocks while the queue is full,
+            as long as there is a recaster alive. """
+        if self.recastQueue is None or not self.recast:
+            self.runRecasting ( masses, analyses, pid )
+            self.locker.unlock ( masses )
+            return
+        self.locker.handOver ( masses )
+        while True:
+            try:
+                self.recastQueue.put ( ( masses, analyses, os.getpid() ), timeout = 5. )
+                return
+            except queue.Full as e:
+                if not self.recastersAlive():
+                    self.error ( f"no recaster left for {masses}, give it up" )
+                    self.locker.unlock ( masses )
+                    return
+
+    def recastersAlive ( self ) -> bool:
+        """ in pipelined mode, is any recaster process still running? """
+        if self.recasterSentinels is None:
+            return True
+        ended = multiprocessing.connection.wait ( self.recasterSentinels, timeout = 0 )
+        return len(ended) < len(self.recasterSentinels)
+
+    def recastHandedOver ( self, masses, analyses, pid, owner = None ):
+        """ recast a point that a generator handed over to us
+        :param owner: the pid of the generator
+        """
+        if self.locker.adopt ( masses, owner ):
+            self.error ( f"could not adopt {masses}, skip it" )
+            return
+        try:
+            self.runRecasting ( masses, analyses, pid )
+        finally:
+            self.locker.unlock ( masses )
+
+    def runRecasting ( self, masses, analyses, pid ) -> bool:
+        """ run the recasting. cutlang or ma5
+        :returns: true, if all recasters succeeded. only then the point is
+                  checkpointed as recast
+        """
         try:
             if not self.recast:
-                return
-            if "adl" in self.recaster:
-                self.runCutlang ( masses, analyses, pid )
-            if "cm2" in self.recaster:
-                self.runCheckmate ( masses, analyses, pid )
-            if "MA5" in self.recaster:
-                self.runMA5 ( masses, analyses, pid )
+                return True
+            rets = []
+            with tracer.span ( "recast", recaster = ",".join ( self.recaster ) ) as s:
+                if "adl" in self.recaster:
+                    rets += self.runCutlang ( masses, analyses, pid )
+                if "cm2" in self.recaster:
+                    rets += self.runCheckmate ( masses, analyses, pid )
+                if "MA5" in self.recaster:
+                    rets += self.runMA5 ( masses, analyses, pid )
+                s["ok"] = not any ( [ r is not None and r < 0 for r in rets ] )
+            if not s["ok"]:
+                self.error ( f"recasting {masses} failed: {rets}" )
+                for r in self.recaster:
+                    metrics.pointFailed ( self.topo, analyses, r )
+                return False
+            self.checkpoint ( masses ).done ( "recast", analyses = analyses,
+                                              recaster = self.recaster )
+            for r in self.recaster:
+                metrics.pointCompleted ( self.topo, analyses, r )
+            return True
         except Exception as e:
+            for r in self.recaster:
+                metrics.pointFailed ( self.topo, analyses, r )
             if self.keep: # if keep is on, we remove the lock. seems like were debugging
                 self.locker.unlock ( masses )
             raise e
 
-    def runMA5 ( self, masses, analyses, pid ):
-        """ run ma5, if desired """
+    def runMA5 ( self, masses, analyses, pid ) -> List:
+        """ run ma5, if desired
+        :returns: list with the return code of ma5
+        """
         spid=""
         if pid != None:
             spid = " in job #%d" % pid
@@ -405,9 +480,12 @@ class MG5Wrapper:
         if ret < 0:
             msg = "error encountered"
         self.announce ( "%s for %s[%s] at %s%s" % ( msg, str(masses), self.topo, time.asctime(), spid ) )
+        return [ ret ]
 
-    def runCutlang ( self, masses, analyses, pid ):
-        """ run cutlang, if desired """
+    def runCutlang ( self, masses, analyses, pid ) -> List:
+        """ run cutlang, if desired
+        :returns: list with the return codes of cutlang, one per analysis
+        """
         spid=""
         if pid != None:
             spid = " in job #%d" % pid
@@ -416,24 +494,30 @@ class MG5Wrapper:
         rerun = self.rerun
         # rerun = True
         analist = analyses.split(",")
+        rets = []
         for ana in analist:
             ana = ana.strip()
             cl = CutLangWrapper ( self.topo, self.njets, rerun, ana,
                     auto_confirm = True, keep = self.keep, adl_file = self.adl_file,
-                    event_condition = self.event_condition )
+                    event_condition = self.event_condition,
+                    slim = self.slim_delphes )
             #                   self.sqrts )
             self.debug ( f"now call cutlangWrapper for {ana}" )
             hepmcfile = self.locker.hepmcFileName ( masses )
             ret = cl.run ( masses, hepmcfile, pid )
+            rets.append ( ret )
             msg = "finished MG5+Cutlang: "
             if ret > 0:
                 msg += "nothing needed to be done"
             if ret < 0:
                 msg += "error encountered"
             self.announce ( "%s for %s[%s] at %s%s" % ( msg, str(masses), self.topo, time.asctime(), spid ) )
+        return rets
 
-    def runCheckmate ( self, masses, analyses, pid ):
-        """ run checkmate, if desired """
+    def runCheckmate ( self, masses, analyses, pid ) -> List:
+        """ run checkmate, if desired
+        :returns: list with the return codes of checkmate, one per analysis
+        """
         spid=""
         if pid != None:
             spid = " in job #%d" % pid
@@ -442,6 +526,7 @@ class MG5Wrapper:
         rerun = self.rerun
         # rerun = True
         analist = analyses.split(",")
+        rets = []
         for ana in analist:
             ana = ana.strip()
             cl = CM2Wrapper ( self.topo, self.njets, rerun, ana, keep = self.keep )
@@ -449,12 +534,14 @@ class MG5Wrapper:
             self.debug ( f"now call cutlangWrapper for {ana}" )
             hepmcfile = self.locker.hepmcFileName ( masses )
             ret = cl.run ( masses, hepmcfile, pid )
+            rets.append ( ret )
             msg = "finished MG5+Checkmate: "
             if ret > 0:
                 msg += "nothing needed to be done"
             if ret < 0:
                 msg += "error encountered"
             self.announce ( "%s for %s[%s] at %s%s" % ( msg, str(masses), self.topo, time.asctime(), spid ) )
+        return rets
 
 
     def unlink ( self, f ):
@@ -466,27 +553,20 @@ class MG5Wrapper:
         if os.path.exists ( f ):
             subprocess.getoutput ( "rm -rf %s" % f )
 
-    def exe ( self, cmd, masses="" ):
+    def exe ( self, cmd, masses="", logfile="auto" ):
+        """ execute cmd in shell, the output goes to logfile, see runner.run """
         sm = ""
         if masses != "":
             sm="[%s]" % str(masses)
         self.msg ( "exec %s%s:: %s" % (self.topo, sm, cmd[:] ) )
-        pipe = subprocess.Popen ( cmd, shell=True,
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE )
-        ret=""
-        for line in io.TextIOWrapper(pipe.stdout, encoding="latin1"):
-            ret+=line
-        for line in io.TextIOWrapper(pipe.stderr, encoding="latin1"):
-            ret+=line
+        maxLength=200
+        offset = 200
+        ret = runner.run ( cmd, logfile = logfile, tailBytes = maxLength+offset )["tail"]
         if len(ret)==0:
             return
-        maxLength=200
-        # maxLength=100000
         if len(ret)<maxLength:
             self.msg ( " `- %s" % ret )
             return
-        offset = 200
         self.msg ( " `- %s ..." % ( ret[-maxLength-offset:-offset] ) )
 
     def addJet ( self, lines, njets, f ):
@@ -559,6 +639,9 @@ class MG5Wrapper:
                 f.write ( "import model idm\n" )
             else:
                 f.write ( "import model MSSM_SLHA2\n" )
+        if self.compileCache is not None:
+            ## route the fortran and c++ compilations through our cache
+            f.write ( self.compileCache.mg5Commands ( self.compilerWrappers ) )
         if False:
             # for SLHA1
             self.info ( f"do we need to port {self.topo} to slha2?" )
@@ -572,51 +655,169 @@ class MG5Wrapper:
         Dir = bakeryHelpers.dirName ( self.process, masses )
         f.write ( "output %s\n" % Dir )
         f.close()
-        self.info ( "run mg5 for %s[%s]: %s" % ( masses, self.topo, self.tempf ) )
-        self.logfile = tempfile.mktemp ()
-        if os.path.exists ( Dir ):
-            subprocess.getoutput ( f"rm -rf {Dir}" )
-        os.mkdir ( Dir )
+        ckpt = self.checkpoint ( masses )
+        with open ( self.tempf, "rt" ) as f:
+            prochash = hashlib.sha1 ( f.read().encode() ).hexdigest()
+            f.close()
+        runhash = self.runHash ( slhaFile )
+        stage = self.resumableStage ( Dir, ckpt, prochash, runhash )
+        if stage == "lhe":
+            ## the cards of the existing run are the ones we need
+            for tmp in [ self.tempf, slhaFile, self.runcard, self.commandfile ]:
+                self.unlink ( tmp )
+            return self.reshower ( Dir, masses, ckpt, runhash )
+        if stage == "output":
+            self.info ( f"resuming {masses}[{self.topo}]: process directory {Dir} exists already" )
+            self.unlink ( self.tempf )
+        else:
+            ckpt.reset()
+            self.info ( "run mg5 for %s[%s]: %s" % ( masses, self.topo, self.tempf ) )
+            self.logfile = tempfile.mktemp ()
+            if os.path.exists ( Dir ):
+                subprocess.getoutput ( f"rm -rf {Dir}" )
+            os.mkdir ( Dir )
 
-        if self.keep:
-            self.mkdir ( "keep/" )
-            shutil.copy ( self.tempf, "keep/" + Dir + "mg5proc" )
-        shutil.move ( self.tempf, Dir + "/mg5proc" )
-        cmd = "python%d %s %s/mg5proc 2>&1 | tee %s" % \
-              ( self.pyver, self.executable, Dir, self.logfile )
-        self.exe ( cmd, masses )
-        ## copy slha file
-        if not os.path.exists ( Dir+"/Cards" ):
-            cmd = f"rm -rf {Dir}"
-            o = subprocess.getoutput ( cmd )
-            o = subprocess.getoutput ( f"cat {self.logfile}" )
-            self.error ( f"{Dir}/Cards does not exist! Skipping! {o}" )
-            self.exe ( cmd, masses )
-            return False
+            if self.keep:
+                self.mkdir ( "keep/" )
+                shutil.copy ( self.tempf, "keep/" + Dir + "mg5proc" )
+            shutil.move ( self.tempf, Dir + "/mg5proc" )
+            cmd = "python%d %s %s/mg5proc" % ( self.pyver, self.executable, Dir )
+            with tracer.span ( "mg5_output" ):
+                self.exe ( cmd, masses, self.logfile )
+            ## copy slha file
+            if not os.path.exists ( Dir+"/Cards" ):
+                cmd = f"rm -rf {Dir}"
+                o = subprocess.getoutput ( cmd )
+                o = subprocess.getoutput ( f"cat {self.logfile}" )
+                self.error ( f"{Dir}/Cards does not exist! Skipping! {o}" )
+                self.exe ( cmd, masses )
+                return False
+            ckpt.done ( "output", dirname = Dir, prochash = prochash )
         with open ( f"{Dir}/analysis", "wt" ) as f:
             # pen down the analysis name
             ana = self.args["analyses"].upper().replace("_","-")
             f.write ( ana+"\n" )
             f.close()
         if "bias" in self.topo:
-            shutil.copy("templates/pythia8_card_match.dat", Dir+'/Cards/pythia8_card.dat')
+            shutil.copy(self.templateDir+"/pythia8_card_match.dat", Dir+'/Cards/pythia8_card.dat')
         shutil.move(slhaFile, Dir+'/Cards/param_card.dat' )
         shutil.move(self.runcard, Dir+'/Cards/run_card.dat' )
         shutil.move(self.commandfile, Dir+"/mg5cmd" )
         if (os.path.isdir(Dir+'/Events/run_01')):
             shutil.rmtree(Dir+'/Events/run_01')
         self.logfile2 = tempfile.mktemp ()
-        cmd = f"python{self.pyver} {self.executable} {Dir}/mg5cmd 2>&1 | tee {self.logfile2}"
-        self.exe ( cmd, masses )
+        cmd = f"python{self.pyver} {self.executable} {Dir}/mg5cmd"
+        with tracer.span ( "mg5_launch" ):
+            self.exe ( cmd, masses, self.logfile2 )
+        return self.finishPoint ( Dir, masses, ckpt, runhash )
+
+    def runHash ( self, slhaFile ):
+        """ the fingerprint of what goes into the parton level events:
+            the run card, the param card, and the number of events """
+        h = hashlib.sha1 ( str(self.nevents).encode() )
+        for card in [ self.runcard, slhaFile ]:
+            with open ( card, "rb" ) as f:
+                h.update ( f.read() )
+                f.close()
+        return h.hexdigest()
+
+    def checkpoint ( self, masses ):
+        """ the checkpoint bookkeeping for masses """
+        return checkpoint.Checkpoint ( self.topo, masses, self.sqrts )
+
+    def lheFileName ( self, Dir ):
+        """ the parton level events of the (only) run in Dir """
+        return f"{Dir}/Events/run_01/unweighted_events.lhe.gz"
+
+    def resumableStage ( self, Dir, ckpt, prochash, runhash ):
+        """ find out from which stage we can resume the point.
+        :param prochash: fingerprint of the process card
+        :param runhash: fingerprint of the run and param cards, and nevents
+        :returns: "lhe", if we only need to shower, "output", if we can
+                  reuse the process directory, None if we start from scratch
+        """
+        if self.rerun or not os.path.isdir ( Dir ):
+            return None
+        info = ckpt.get ( "output" )
+        if info is None or info.get ( "prochash", None ) != prochash:
+            ## no or a different process definition
+            return None
+        if not os.path.exists ( f"{Dir}/Cards" ) or not os.path.exists ( f"{Dir}/bin/madevent" ):
+            return None
+        lhefile = self.lheFileName ( Dir )
+        info = ckpt.get ( "lhe" )
+        if info is not None and info.get ( "runhash", None ) == runhash and \
+                checkpoint.isCompleteLHE ( lhefile ):
+            return "lhe"
+        ## no, incomplete, or parton level events for different cards
+        ckpt.reset ( "lhe" )
+        return "output"
+
+    def reshower ( self, Dir, masses, ckpt, runhash ):
+        """ we have the parton level events already, only run pythia8 """
+        self.info ( f"resuming {masses}[{self.topo}]: found {self.lheFileName(Dir)}, only need to shower" )
+        showercmd = f"{Dir}/showercmd"
+        with open ( showercmd, "wt" ) as f:
+            f.write ( "set automatic_html_opening False\n" )
+            f.write ( "pythia8 run_01 -f\n" )
+            f.close()
+        self.logfile2 = tempfile.mktemp ()
+        cmd = f"python{self.pyver} {Dir}/bin/madevent {showercmd}"
+        with tracer.span ( "mg5_shower" ):
+            self.exe ( cmd, masses, self.logfile2 )
+        return self.finishPoint ( Dir, masses, ckpt, runhash )
+
+    def compressThreads ( self ) -> int:
+        """ the threads for the block gzip of a hepmc file: our share of
+            the cpus, there are nprocesses of us. at most 4 """
+        nprocesses = self.args["nprocesses"]
+        if nprocesses < 1:
+            return 1
+        return max ( 1, min ( 4, ( os.cpu_count() or 1 ) // nprocesses ) )
+
+    def finishPoint ( self, Dir, masses, ckpt, runhash ):
+        """ move the hepmc file to its final destination, record the
+            checkpoints, remove the process directory only if there
+            is nothing left worth resuming from.
+        :param runhash: fingerprint of the cards of the parton level events
+        :returns: True, if we have a hepmc file
+        """
         hepmcfile = self.orighepmcFileName( masses )
         if self.hasorigHEPMC ( masses ):
             dest = self.locker.hepmcFileName ( masses )
             self.msg ( "moving", hepmcfile, "to", dest )
-            shutil.move ( hepmcfile, dest )
-        else:
-            self.error ( f"could not find orig hepmc file {self.orighepmcFileName( masses )}! maybe there is something wrong with the mg5 installation?" )
+            with tracer.span ( "hepmc_move" ):
+                shutil.move ( hepmcfile, dest )
+                ## the index holds the verdict, take it along
+                idxfile = hepmcTools.indexFileName ( hepmcfile )
+                if os.path.exists ( idxfile ):
+                    shutil.move ( idxfile, hepmcTools.indexFileName ( dest ) )
+            if self.block_gzip:
+                with tracer.span ( "hepmc_compress" ):
+                    ## block gzip, so that the recasters inflate it in parallel
+                    hepmcTools.recompress ( dest, self.compressThreads() )
+            ckpt.done ( "hepmc", path = dest )
+            self.clean( Dir )
+            return True
+        self.error ( f"could not find orig hepmc file {hepmcfile}! maybe there is something wrong with the mg5 installation?" )
+        metrics.pointFailed ( self.topo, self.args["analyses"], "mg5" )
+        tracer.event ( "generation", ok = False )
+        lhefile = self.lheFileName ( Dir )
+        info = ckpt.get ( "lhe" ) or {}
+        failures = info.get ( "failures", 0 ) + 1
+        if failures > self.maxReshowers:
+            ## the parton level events do not seem to be showerable
+            self.error ( f"showering {lhefile} failed {failures} times, will regenerate {masses}" )
+        elif checkpoint.isCompleteLHE ( lhefile ):
+            ## keep the parton level events, next time we only shower
+            ckpt.done ( "lhe", path = lhefile, runhash = runhash,
+                        failures = failures )
+            self.info ( f"keeping {Dir}, can be resumed from {lhefile}" )
+            self.clean()
+            return False
+        ckpt.reset()
         self.clean( Dir )
-        return True
+        return False
 
     def clean ( self, Dir=None ):
         """ clean up temporary files
@@ -637,9 +838,14 @@ class MG5Wrapper:
             self.info ( "clean up %s: %s" % ( cmd, o ) )
 
     def orighepmcFileName ( self, masses ):
-        """ return the hepmc file name *before* moving """
-        hepmcfile = bakeryHelpers.dirName( self.process,masses)+\
-                            "/Events/run_01/tag_1_pythia8_events.hepmc.gz"
+        """ return the hepmc file name *before* moving. if we reshowered,
+            it is the latest tag """
+        Dir = bakeryHelpers.dirName( self.process,masses)
+        hepmcfile = f"{Dir}/Events/run_01/tag_1_pythia8_events.hepmc.gz"
+        tags = glob.glob ( f"{Dir}/Events/run_01/tag_*_pythia8_events.hepmc.gz" )
+        if len(tags)>1:
+            tags.sort ( key = lambda x: os.stat ( x ).st_mtime )
+            hepmcfile = tags[-1]
         return hepmcfile
 
     def hasorigHEPMC ( self, masses ):
@@ -647,10 +853,10 @@ class MG5Wrapper:
         hepmcfile = self.orighepmcFileName( masses )
         if not os.path.exists ( hepmcfile ):
             return False
-        if os.stat ( hepmcfile ).st_size < 100:
-            ## too small to be real
-            return False
-        return True
+        verdict = hepmcTools.verify ( hepmcfile, self.nevents )
+        if not verdict["ok"]:
+            self.error ( f"{hepmcfile} is not valid: {verdict['reason']}" )
+        return verdict["ok"]
 
 
 def main():
@@ -688,6 +894,28 @@ def main():
                              type=str, default=None )
     argparser.add_argument ( '--event_condition', help='specify conditions on the events, filter out the rest, e.g. {"higgs":1}: one and only one higgs [None]',
                              type=str, default=None )
+    argparser.add_argument ( '--slim_delphes', help='with cutlang: write only the delphes branches that the adl file needs',
+                             action='store_true' )
+    argparser.add_argument ( '--block_gzip', help='re-encode every hepmc file as block gzip before recasting it. otherwise run blockGzip.py mg5results later',
+                             action='store_true' )
+    argparser.add_argument ( '--compile_cache', help='cache the objects of the mg5 fortran/c++ compilations in compilecache/',
+                             action="store_true" )
+    argparser.add_argument ( '--compile_cache_size', help='maximum size of the compile cache, in GB [5.]',
+                             type=float, default=5. )
+    argparser.add_argument ( '--pipeline', help='pipelined mode: -p processes generate events, that many processes recast them. 0 means generate and recast in the same process [0]',
+                             type=int, default=0 )
+    argparser.add_argument ( '--queue_size', help='in pipelined mode, the maximum number of hepmc files waiting for the recasters. 0 means as many as there are recasters [0]',
+                             type=int, default=0 )
+    argparser.add_argument ( '--profile', help='profile the python code with cProfile, per process, write the results to profiles/',
+                             action="store_true" )
+    argparser.add_argument ( '--profile_sample', help='when profiling, also sample the stacks every so many seconds. 0 means no sampling [0.]',
+                             type=float, default=0. )
+    argparser.add_argument ( '--metrics_file', help='write the prometheus metrics to this file [metrics/emcreator_<host>.prom]',
+                             type=str, default=None )
+    argparser.add_argument ( '--serve', help='do not produce the points, but be the coordinator that hands them out to workers at this address, e.g. unix:/tmp/bake.sock or 0.0.0.0:5555 [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '--worker', help='ignore the mass ranges, get the points from the coordinator at this address, run -p workers [None]',
+                             type=str, default=None )
     argparser.add_argument ( '--copy', help='copy embaked file to smodels-database',
                              action="store_true" )
     argparser.add_argument ( '-l', '--list_analyses', help='print a list of MA5 analyses, then quit',
@@ -752,6 +980,13 @@ def main():
         bakeryHelpers.clean()
         sys.exit()
 
+    if args.metrics_file is not None:
+        metrics.textfile = args.metrics_file
+    if args.worker is not None:
+        import coordinator
+        coordinator.runWorkers ( args.worker, args.nprocesses )
+        sys.exit()
+
     hname = socket.gethostname()
     if hname.find(".")>0:
         hname=hname[:hname.find(".")]
@@ -813,7 +1048,15 @@ def main():
     if args.checkmate and args.cutlang:
         print ( "[mg5Wrapper] both checkmate and cutlang have been asked for. please choose!" )
         sys.exit()
+    if args.serve is not None:
+        import coordinator
+        items = [ { "topo": args.topo, "masses": m, "analyses": args.analyses,
+                    "recaster": recaster } for m in masses ]
+        coordinator.Coordinator ( items, vars(args),
+            statefile = f"coordinator_{args.topo}.{args.sqrts}.json" ).serve ( args.serve )
+        sys.exit()
 
+    t0 = time.time()
     mg5 = MG5Wrapper( vars(args), recaster )
     # mg5.info( "%d points to produce, in %d processes" % (nm,nprocesses) )
     djobs = int(len(masses)/nprocesses)
@@ -821,19 +1064,54 @@ def main():
     def runChunk ( chunk, pid ):
         for c in chunk:
             mg5.run ( c, args.analyses, pid )
+        if mg5.recastQueue is not None:
+            if not locker.waitForAdoption ( alive = mg5.recastersAlive ):
+                mg5.error ( f"not all points of chunk #{pid} were adopted by the recasters" )
         print ( "%s[runChunk] finished chunk #%d%s" % \
                 ( colorama.Fore.GREEN, pid, colorama.Fore.RESET ) )
 
+    def runRecaster ( pid ):
+        while True:
+            item = mg5.recastQueue.get()
+            if item is None:
+                break
+            try:
+                mg5.recastHandedOver ( item[0], item[1], pid, item[2] )
+            except Exception as e:
+                mg5.error ( f"recasting {item[0]} failed: {e}" )
+        print ( "%s[runRecaster] recaster #%d finished%s" % \
+                ( colorama.Fore.GREEN, pid, colorama.Fore.RESET ) )
+
+    recasters = []
+    if args.pipeline > 0 and args.recast:
+        queue_size = args.queue_size if args.queue_size > 0 else args.pipeline
+        mg5.recastQueue = multiprocessing.Queue ( maxsize = queue_size )
+        mg5.info ( f"pipelined mode: {nprocesses} generators, {args.pipeline} recasters, queue size {queue_size}" )
+        for i in range(args.pipeline):
+            p = multiprocessing.Process(target=profiler.wrap ( runRecaster,
+                    "mg5Wrapper", args.profile, args.profile_sample ),
+                    args=(nprocesses+i,))
+            recasters.append ( p )
+            p.start()
+        mg5.recasterSentinels = [ p.sentinel for p in recasters ]
     jobs=[]
     for i in range(nprocesses):
         chunk = masses[djobs*i:djobs*(i+1)]
         if i == nprocesses-1:
             chunk = masses[djobs*i:]
-        p = multiprocessing.Process(target=runChunk, args=(chunk,i))
+        p = multiprocessing.Process(target=profiler.wrap ( runChunk,
+                "mg5Wrapper", args.profile, args.profile_sample ), args=(chunk,i))
         jobs.append ( p )
         p.start()
     for j in jobs:
         j.join()
+    for r in recasters:
+        mg5.recastQueue.put ( None )
+    for r in recasters:
+        r.join()
+    if mg5.compileCache is not None:
+        mg5.compileCache.printStats()
+    profile, profile_sample = args.profile, args.profile_sample
     if args.bake:
         import emCreator
         from types import SimpleNamespace
@@ -843,7 +1121,10 @@ def main():
                 analyses = analyses, copy=args.copy, keep=args.keep, sqrts=args.sqrts,
                 verbose=False, ma5=not args.cutlang, cutlang=args.cutlang, stats=True,
                 cleanup = False, checkmate=args.checkmate )
-        emCreator.run ( args )
+        with profiler.profiled ( "mg5Wrapper", profile, profile_sample ):
+            emCreator.run ( args )
+    if profile:
+        print ( profiler.merge ( "mg5Wrapper", since = t0 ) )
     """
     with open(logfile,"a") as f:
         cmd = ""
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: pipeline
+   :synopsis: drive many external tools (mg5, delphes, cutlang, ma5,
+              checkmate) from one process, with asyncio: a point is a
+              sequence of steps, the points run concurrently, and every
+              resource class (the stage up to the first underscore, e.g.
+              mg5 for mg5_launch) has its own limit of concurrent
+              children. steps have timeouts, cancelling a point (or
+              ctrl-c) kills its children. the output of the children
+              goes to the log files of runner.py, every step is a span in
+              the traces. children are reaped by asyncio, so there is no
+              resourceUsage accounting here.
+
+              a job file for the command line is a json list of points:
+              [ { "context": { "topo": "T2", "masses": [ 1000, 100 ] },
+                  "steps": [ { "stage": "mg5_launch", "cmd": "...",
+                               "cwd": "...", "timeout": 3600 }, ... ] } ]
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, socket, asyncio, signal, json, functools
+import tracer, runner
+from typing import Dict, List, Union, Callable, Any
+
+def resourceClass ( stage : str ) -> str:
+    """ mg5_launch -> mg5, delphes_filter -> delphes """
+    return stage.split("_")[0]
+
+class Pipeline:
+    def __init__ ( self, limits : Dict = {}, default : int = 1,
+                   tailBytes : int = 4096 ):
+        """
+        :param limits: maximum number of concurrent steps, per resource
+                       class, e.g. { "mg5": 4, "delphes": 8 }
+        :param default: the limit of the classes not in limits
+        :param tailBytes: keep so many bytes of the output of a child
+        """
+        self.limits = dict ( limits )
+        self.default = default
+        self.tailBytes = tailBytes
+        self.semaphores = {}
+
+    def semaphore ( self, stage : str ) -> asyncio.Semaphore:
+        """ the semaphore of the resource class of stage,
+            must be called within the event loop """
+        rc = resourceClass ( stage )
+        if not rc in self.semaphores:
+            self.semaphores[rc] = asyncio.Semaphore ( self.limits.get ( rc, self.default ) )
+        return self.semaphores[rc]
+
+    def trace ( self, record : Dict ):
+        """ write the record of a step, like tracer.span does """
+        record["host"] = socket.gethostname()
+        record["pid"] = os.getpid()
+        tracer.write ( record )
+        import metrics
+        metrics.observe ( "emcreator_stage_duration_seconds", record["dt"],
+                          stage = record["stage"], topo = record.get ( "topo", "?" ) )
+
+    async def command ( self, stage : str, cmd : Union[str,List[str]],
+                        cwd : Union[str,None] = None, env : Union[Dict,None] = None,
+                        logfile : Union[str,None] = "auto",
+                        timeout : Union[float,None] = None,
+                        context : Dict = {} ) -> Dict:
+        """ run cmd as the stage, once the resource class has a free slot.
+        :param logfile: "auto" means the log file of the point in context
+        :returns: dictionary with returncode, seconds, outbytes, timedout,
+                  tail and logfile, like runner.run
+        """
+        if logfile == "auto":
+            logfile = runner.logFileName ( context )
+        async with self.semaphore ( stage ):
+            return await self._command ( stage, cmd, cwd, env, logfile, timeout, context )
+
+    async def _command ( self, stage, cmd, cwd, env, logfile, timeout, context ):
+        shell = type(cmd)==str
+        scmd = cmd if shell else " ".join ( cmd )
+        log = None
+        if logfile is not None:
+            os.makedirs ( os.path.dirname ( os.path.abspath ( logfile ) ), exist_ok=True )
+            log = open ( logfile, "ab" )
+        tail = runner.Tail ( self.tailBytes )
+        counter = { "outbytes": 0 }
+        record = { "stage": stage, "t0": time.time(), "ok": False }
+        record.update ( context )
+        kwargs = { "cwd": cwd, "env": env, "stdin": asyncio.subprocess.DEVNULL,
+                   "stdout": asyncio.subprocess.PIPE, "stderr": asyncio.subprocess.PIPE,
+                   "start_new_session": True }
+        try:
+            if shell:
+                proc = await asyncio.create_subprocess_shell ( cmd, **kwargs )
+            else:
+                proc = await asyncio.create_subprocess_exec ( *cmd, **kwargs )
+        except BaseException as e:
+            ## we could not start the child
+            if log is not None:
+                log.close()
+            raise
+        if log is not None:
+            log.write ( f"exec: [{cwd or os.getcwd()}] {scmd}\n".encode() )
+
+        async def drain ( stream ):
+            while True:
+                chunk = await stream.read ( runner.chunkSize )
+                if len(chunk)==0:
+                    break
+                counter["outbytes"] += len(chunk)
+                tail.write ( chunk )
+                if log is not None:
+                    log.write ( chunk )
+
+        async def finish ():
+            await asyncio.gather ( drain ( proc.stdout ), drain ( proc.stderr ) )
+            return await proc.wait()
+
+        timedOut = False
+        try:
+            await asyncio.wait_for ( finish(), timeout )
+        except asyncio.TimeoutError as e:
+            timedOut = True
+            record["error"] = f"killed after {timeout}s"
+            await self.kill ( proc )
+        except BaseException as e:
+            ## cancelled, or ctrl-c
+            record["error"] = "cancelled"
+            await self.kill ( proc )
+            raise
+        finally:
+            record["dt"] = time.time() - record["t0"]
+            record["ok"] = proc.returncode == 0 and not timedOut
+            record["outbytes"] = counter["outbytes"]
+            if log is not None:
+                if "error" in record:
+                    log.write ( f"\n{record['error']}\n".encode() )
+                log.close()
+            self.trace ( record )
+        return { "returncode": proc.returncode, "seconds": record["dt"],
+                 "outbytes": counter["outbytes"], "timedout": timedOut,
+                 "tail": tail.get().decode ( "latin1" ), "logfile": logfile }
+
+    async def kill ( self, proc ):
+        """ kill the session of the child, and reap it """
+        if proc.returncode is None:
+            try:
+                os.killpg ( proc.pid, signal.SIGKILL )
+            except ProcessLookupError as e:
+                pass
+        await asyncio.shield ( proc.wait() )
+
+    async def call ( self, stage : str, fn : Callable, *args,
+                     context : Dict = {}, **kwargs ) -> Any:
+        """ run the blocking python function fn in a thread, once the
+            resource class of stage has a free slot. fn must not change
+            the working directory """
+        async with self.semaphore ( stage ):
+            record = { "stage": stage, "t0": time.time(), "ok": False }
+            record.update ( context )
+            try:
+                loop = asyncio.get_running_loop()
+                ret = await loop.run_in_executor ( None, functools.partial ( fn, *args, **kwargs ) )
+                record["ok"] = True
+                return ret
+            except BaseException as e:
+                record["error"] = str(e)[:200]
+                raise
+            finally:
+                record["dt"] = time.time() - record["t0"]
+                self.trace ( record )
+
+    async def point ( self, steps : List[Dict], context : Dict = {} ) -> Dict:
+        """ run the steps of a point, one after the other. a step is
+            a dictionary with stage, cmd and optionally cwd, env, timeout.
+            a failing step ends the point.
+        :returns: dictionary with the context, ok, and the results of the steps
+        """
+        results = []
+        ok = True
+        for step in steps:
+            r = await self.command ( step["stage"], step["cmd"], step.get ( "cwd", None ),
+                    step.get ( "env", None ), step.get ( "logfile", "auto" ),
+                    step.get ( "timeout", None ), context )
+            r["stage"] = step["stage"]
+            results.append ( r )
+            if r["returncode"] != 0 or r["timedout"]:
+                ok = False
+                break
+        return { "context": context, "ok": ok, "steps": results }
+
+    async def points ( self, jobs : List[Dict] ) -> List[Dict]:
+        """ run all points concurrently, a job is a dictionary
+            with steps and context, see point """
+        tasks = [ asyncio.create_task ( self.point ( job["steps"], job.get ( "context", {} ) ) ) \
+                  for job in jobs ]
+        try:
+            return await asyncio.gather ( *tasks )
+        except BaseException as e:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather ( *tasks, return_exceptions = True )
+            raise
+
+    def run ( self, jobs : List[Dict] ) -> List[Dict]:
+        """ run the points, blocking """
+        return asyncio.run ( self.points ( jobs ) )
+
+def parseLimits ( limits : str ) -> Dict:
+    """ mg5=4,delphes=8 -> { "mg5": 4, "delphes": 8 } """
+    ret = {}
+    for token in limits.split(","):
+        if "=" in token:
+            k, v = token.split("=")
+            ret[k.strip()] = int(v)
+    return ret
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='run the steps of many points concurrently, from one process.')
+    argparser.add_argument ( 'jobs', help='the json job file, see the module documentation',
+                             type=str )
+    argparser.add_argument ( '-l', '--limits', help='concurrent steps per resource class, e.g. mg5=4,delphes=8 [None]',
+                             type=str, default="" )
+    argparser.add_argument ( '-d', '--default', help='the limit of all other resource classes [1]',
+                             type=int, default=1 )
+    argparser.add_argument ( '-t', '--timeout', help='timeout of the steps that have none, in seconds [None]',
+                             type=float, default=None )
+    args = argparser.parse_args()
+    with open ( args.jobs, "rt" ) as f:
+        jobs = json.load ( f )
+        f.close()
+    for job in jobs:
+        for step in job["steps"]:
+            if not "timeout" in step:
+                step["timeout"] = args.timeout
+    pipeline = Pipeline ( parseLimits ( args.limits ), args.default )
+    t0 = time.time()
+    results = pipeline.run ( jobs )
+    nok = len ( [ r for r in results if r["ok"] ] )
+    for r in results:
+        if not r["ok"]:
+            last = r["steps"][-1]
+            print ( f"[pipeline] {r['context']} failed in {last['stage']}: {last['tail'][-200:]}" )
+    print ( f"[pipeline] {nok}/{len(results)} points ok, in {time.time()-t0:.1f}s" )
+    sys.exit ( 0 if nok == len(results) else 1 )
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+""" print where the time goes: p50/p95 of the wall time per stage and
+    topology, from the spans in traces/*.jsonl """
+
+import os, time, subprocess, colorama
+import tracer
+
+def pprint ( text ):
+    if not os.path.exists ( "logs/" ):
+        subprocess.getoutput ( "mkdir logs" )
+    print ( text )
+    f=open("logs/trace_%s.txt" % time.asctime().replace(" ","_"), "a" )
+    f.write ( text +"\n" )
+    f.close()
+
+def percentile ( values, p ):
+    """ the p-th percentile of the (sorted) values, nearest rank """
+    if len(values)==0:
+        return float("nan")
+    idx = int ( round ( p / 100. * ( len(values) - 1 ) ) )
+    return values[idx]
+
+def aggregate ( spans, bytopo = True, analysis = None, since = None ):
+    """ collect the wall times per ( stage, topo )
+    :param analysis: consider only spans of this analysis
+    :param since: consider only spans that started after this unix time
+    """
+    stats = {}
+    for s in spans:
+        if analysis is not None and s.get ( "analysis", None ) != analysis:
+            continue
+        if since is not None and s.get ( "t0", 0. ) < since:
+            continue
+        topo = s.get ( "topo", "?" ) if bytopo else "*"
+        key = ( s["stage"], topo )
+        if not key in stats:
+            stats[key] = { "dt": [], "failed": 0 }
+        stats[key]["dt"].append ( s["dt"] )
+        if not s.get ( "ok", True ):
+            stats[key]["failed"] += 1
+    for v in stats.values():
+        v["dt"].sort()
+    return stats
+
+def report ( stats ):
+    """ print the table, stages with the largest total time first """
+    pprint ( "%-22s %-12s %7s %6s %10s %10s %10s %10s" % \
+             ( "stage", "topo", "n", "failed", "p50[s]", "p95[s]", "max[s]", "total[h]" ) )
+    keys = list ( stats.keys() )
+    keys.sort ( key = lambda k: -sum ( stats[k]["dt"] ) )
+    for k in keys:
+        dts = stats[k]["dt"]
+        beg,end="",""
+        if stats[k]["failed"]>0:
+            beg,end=colorama.Fore.RED,colorama.Fore.RESET
+        pprint ( "%s%-22s %-12s %7d %6d %10.2f %10.2f %10.2f %10.2f%s" % \
+                 ( beg, k[0], k[1], len(dts), stats[k]["failed"],
+                   percentile ( dts, 50 ), percentile ( dts, 95 ), dts[-1],
+                   sum(dts) / 3600., end ) )
+
+def main( analysis = None, bytopo = True, hours = None, dirname = None ):
+    since = None
+    if hours is not None:
+        since = time.time() - hours * 3600.
+    stats = aggregate ( tracer.readTraces ( dirname ), bytopo, analysis, since )
+    if len(stats)==0:
+        print ( f"[printTraceStats] no spans found in {dirname or tracer.traceDir()}" )
+        return
+    report ( stats )
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='report p50/p95 wall times per stage and topology, from the traces.')
+    argparser.add_argument ( '-a', '--analysis', help='consider only this analysis [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-d', '--dirname', help='directory with the trace files [traces/]',
+                             type=str, default=None )
+    argparser.add_argument ( '-H', '--hours', help='consider only the last so many hours [None]',
+                             type=float, default=None )
+    argparser.add_argument ( '-s', '--stages_only', help='aggregate over all topologies',
+                             action="store_true" )
+    args = argparser.parse_args()
+    main ( args.analysis, not args.stages_only, args.hours, args.dirname )
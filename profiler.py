@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: profiler
+   :synopsis: profile the python side of the bakery with cProfile, one
+              .pstats file per (worker) process in profiles/, merged into
+              a top-N summary. optionally, the stack of the main thread
+              is sampled periodically, written in the folded format of
+              flamegraph.pl, which is cheap enough for long runs.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, socket, threading, glob, cProfile, pstats, io
+from contextlib import contextmanager
+from typing import Union, Callable
+
+def profileDir() -> str:
+    import bakeryHelpers
+    return os.path.join ( bakeryHelpers.baseDir(), "profiles" )
+
+def baseName ( name : str ) -> str:
+    """ profiles/<name>_<host>_<pid>, with _<thread id> appended
+        if called from a worker thread """
+    host = socket.gethostname()
+    if host.find(".")>0:
+        host = host[:host.find(".")]
+    ret = f"{name}_{host}_{os.getpid()}"
+    if threading.current_thread() is not threading.main_thread():
+        ret += f"_{threading.get_native_id()}"
+    return os.path.join ( profileDir(), ret )
+
+class StackSampler:
+    """ sample the stack of a thread every interval seconds """
+    def __init__ ( self, interval : float, ident : Union[int,None] = None ):
+        self.interval = interval
+        self.ident = ident if ident is not None else threading.get_ident()
+        self.stacks = {}
+        self.stop = threading.Event()
+        self.thread = threading.Thread ( target = self.run, daemon = True )
+
+    def start ( self ):
+        self.thread.start()
+
+    def run ( self ):
+        while not self.stop.wait ( self.interval ):
+            frame = sys._current_frames().get ( self.ident, None )
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append ( f"{os.path.basename(code.co_filename)}:{code.co_name}" )
+                frame = frame.f_back
+            if len(stack)==0:
+                continue
+            folded = ";".join ( reversed ( stack ) )
+            self.stacks[folded] = self.stacks.get ( folded, 0 ) + 1
+
+    def finish ( self, filename : str ):
+        self.stop.set()
+        self.thread.join()
+        with open ( filename, "wt" ) as f:
+            for stack, n in sorted ( self.stacks.items(), key = lambda x: -x[1] ):
+                f.write ( f"{stack} {n}\n" )
+            f.close()
+
+@contextmanager
+def profiled ( name : str, enabled : bool = True, sample : float = 0. ):
+    """ profile the block, write profiles/<name>_<host>_<pid>.pstats
+    :param sample: if > 0, also sample the stack every so many seconds,
+                   into profiles/<name>_<host>_<pid>.folded
+    """
+    if not enabled:
+        yield
+        return
+    os.makedirs ( profileDir(), exist_ok=True )
+    sampler = None
+    if sample > 0.:
+        sampler = StackSampler ( sample )
+        sampler.start()
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        base = baseName ( name )
+        profile.dump_stats ( f"{base}.pstats" )
+        if sampler is not None:
+            sampler.finish ( f"{base}.folded" )
+
+def wrap ( fn : Callable, name : str, enabled : bool = True,
+           sample : float = 0. ) -> Callable:
+    """ wrap the target of a worker process or thread, so it is profiled.
+        cProfile only sees the thread it runs in, so every thread needs
+        its own wrap """
+    if not enabled:
+        return fn
+    def profiledFn ( *args, **kwargs ):
+        with profiled ( name, True, sample ):
+            return fn ( *args, **kwargs )
+    return profiledFn
+
+def merge ( name : str, topN : int = 30, since : Union[float,None] = None,
+            sortby : str = "cumulative" ) -> str:
+    """ merge the profiles of all processes of name into one summary,
+        written to profiles/<name>_summary.txt
+    :param since: consider only files written after this unix time
+    :returns: the summary
+    """
+    files = glob.glob ( f"{profileDir()}/{name}_*.pstats" )
+    if since is not None:
+        files = [ f for f in files if os.stat ( f ).st_mtime >= since ]
+    if len(files)==0:
+        return ""
+    stream = io.StringIO()
+    stats = pstats.Stats ( files[0], stream = stream )
+    for f in files[1:]:
+        stats.add ( f )
+    stream.write ( f"merged {len(files)} profiles of {name}\n" )
+    stats.sort_stats ( sortby ).print_stats ( topN )
+    stacks = {}
+    for f in glob.glob ( f"{profileDir()}/{name}_*.folded" ):
+        if since is not None and os.stat ( f ).st_mtime < since:
+            continue
+        with open ( f, "rt" ) as g:
+            for line in g:
+                stack, n = line.rsplit ( " ", 1 )
+                stacks[stack] = stacks.get ( stack, 0 ) + int(n)
+            g.close()
+    if len(stacks)>0:
+        nsamples = sum ( stacks.values() )
+        stream.write ( f"\ntop sampled stacks ({nsamples} samples):\n" )
+        for stack, n in sorted ( stacks.items(), key = lambda x: -x[1] )[:topN]:
+            stream.write ( "%5.1f%% %s\n" % ( 100. * n / nsamples, stack[-200:] ) )
+    summary = stream.getvalue()
+    with open ( f"{profileDir()}/{name}_summary.txt", "wt" ) as f:
+        f.write ( summary )
+        f.close()
+    return summary
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='merge the profiles of the bakery.')
+    argparser.add_argument ( '-n', '--name', help='the name of the profiles, e.g. mg5Wrapper, emCreator, ma5Wrapper, cm2Wrapper, cutlangWrapper [mg5Wrapper]',
+                             type=str, default="mg5Wrapper" )
+    argparser.add_argument ( '-N', '--topN', help='show the top N functions [30]',
+                             type=int, default=30 )
+    argparser.add_argument ( '-s', '--sortby', help='sort by [cumulative]',
+                             type=str, default="cumulative" )
+    args = argparser.parse_args()
+    print ( merge ( args.name, args.topN, sortby = args.sortby ) )
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: recastService
+   :synopsis: a long running service that watches mg5results/ for new
+              hepmc files, claims them via the locker, and recasts them
+              with a pool of workers. keeps count of the queue depth and
+              the throughput.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, re, multiprocessing, queue, colorama
+import bakeryHelpers, locker, checkpoint, metrics, tracer
+from typing import List, Dict, Union
+
+class RecastService:
+    def __init__ ( self, recaster : List, analyses : str, njets : int = 1,
+                   sqrts : int = 13, topos : Union[List,None] = None,
+                   nprocesses : int = 1, keep : bool = False,
+                   rerun : bool = False, keephepmc : bool = True,
+                   adl_file : Union[str,None] = None,
+                   event_condition : Union[str,None] = None,
+                   interval : float = 10., settle : float = 30. ):
+        """
+        :param recaster: list of recasters, e.g. [ "MA5" ], [ "adl" ], [ "cm2" ]
+        :param analyses: analyses, comma separated
+        :param topos: consider only these topologies, None means all
+        :param nprocesses: number of recasting workers
+        :param interval: poll mg5results/ every so many seconds
+        :param settle: consider hepmc files only if they have not been
+                       modified for that many seconds
+        """
+        self.recaster = recaster
+        self.analyses = analyses
+        self.njets = njets
+        self.sqrts = sqrts
+        self.topos = topos
+        self.nprocesses = nprocesses
+        self.keep = keep
+        self.rerun = rerun
+        self.keephepmc = keephepmc
+        self.adl_file = adl_file
+        self.event_condition = event_condition
+        self.interval = interval
+        self.settle = settle
+        self.resultsdir = os.path.join ( bakeryHelpers.baseDir(), "mg5results" )
+        self.pattern = re.compile ( r"^(.+?)_([0-9][0-9._]*)\.(\d+)\.hepmc\.gz$" )
+        self.index = {} ## all hepmc files we have seen, with their mtimes
+        self.lockers = {}
+        self.counters = { "queued": 0, "running": 0, "done": 0, "failed": 0 }
+        self.finished = [] ## timestamps of finished points, for the throughput
+        self.t0 = time.time()
+
+    def info ( self, *msg ):
+        print ( "%s[recastService] %s%s" % ( colorama.Fore.YELLOW, " ".join ( msg ), \
+                   colorama.Fore.RESET ) )
+
+    def msg ( self, *msg):
+        print ( "[recastService] %s" % " ".join ( msg ) )
+
+    def error ( self, *msg ):
+        print ( "%s[recastService] %s%s" % ( colorama.Fore.RED, " ".join ( msg ), \
+                   colorama.Fore.RESET ) )
+
+    def getLocker ( self, topo : str ) -> locker.Locker:
+        if not topo in self.lockers:
+            self.lockers[topo] = locker.Locker ( self.sqrts, topo, False )
+        return self.lockers[topo]
+
+    def parse ( self, filename : str ):
+        """ topo and masses from <topo>_<masses>.<sqrts>.hepmc.gz
+        :returns: topo, masses, or None if it is not a hepmc file of ours
+        """
+        m = self.pattern.match ( filename )
+        if m is None:
+            return None
+        topo, smasses, sqrts = m.groups()
+        if int(sqrts) != self.sqrts:
+            return None
+        if self.topos is not None and not topo in self.topos:
+            return None
+        try:
+            masses = tuple ( [ int(x) if x.isdigit() else float(x) \
+                               for x in smasses.split("_") ] )
+        except ValueError as e:
+            return None
+        return topo, masses
+
+    def scan ( self ) -> List:
+        """ scan mg5results/ for new hepmc files
+        :returns: list of ( topo, masses, path ) of the new files
+        """
+        ret = []
+        if not os.path.isdir ( self.resultsdir ):
+            return ret
+        t = time.time()
+        with os.scandir ( self.resultsdir ) as it:
+            for entry in it:
+                if not entry.name.endswith ( ".hepmc.gz" ):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError as e:
+                    continue
+                if t - stat.st_mtime < self.settle or stat.st_size < 100:
+                    continue ## still being written
+                if self.index.get ( entry.path, None ) == stat.st_mtime:
+                    continue ## seen it. failed points we retry when the file changes
+                parsed = self.parse ( entry.name )
+                if parsed is None:
+                    continue
+                self.index[entry.path] = stat.st_mtime
+                ret.append ( ( parsed[0], parsed[1], entry.path ) )
+        return ret
+
+    def isDone ( self, topo : str, masses ) -> bool:
+        """ has the point been recast already? """
+        if self.rerun:
+            return False
+        ckpt = checkpoint.Checkpoint ( topo, masses, self.sqrts )
+        if ckpt.has ( "recast" ):
+            return True
+        if "MA5" in self.recaster and self.getLocker ( topo ).hasMA5Files ( masses ):
+            return True
+        return False
+
+    def claim ( self, topo : str, masses, path : str ) -> bool:
+        """ claim a point for us via the locker """
+        if self.isDone ( topo, masses ):
+            return False
+        l = self.getLocker ( topo )
+        if l.lock ( masses ):
+            self.msg ( f"{topo}:{masses} is locked, skip it for now" )
+            self.index.pop ( path, None ) ## look at it again next time
+            return False
+        l.handOver ( masses )
+        return True
+
+    def collect ( self, results : multiprocessing.Queue ):
+        """ collect the reports of the workers """
+        while True:
+            try:
+                report = results.get_nowait()
+            except queue.Empty as e:
+                return
+            if report["status"] == "started":
+                self.counters["queued"] -= 1
+                self.counters["running"] += 1
+                continue
+            self.counters["running"] -= 1
+            self.counters[report["status"]] += 1
+            self.finished.append ( time.time() )
+
+    def throughput ( self, window : float = 3600. ) -> float:
+        """ points per hour, within the last window seconds """
+        t = time.time()
+        self.finished = [ x for x in self.finished if t - x < window ]
+        dt = min ( window, t - self.t0 )
+        if dt <= 0.:
+            return 0.
+        return len(self.finished) / dt * 3600.
+
+    def printStats ( self ):
+        c = self.counters
+        self.msg ( f"queue depth {c['queued']}, running {c['running']}, done {c['done']}, failed {c['failed']}, {self.throughput():.1f} points/h" )
+
+    def serve ( self, once : bool = False ):
+        """ the main loop
+        :param once: quit when we have nothing left to do, instead of
+                     waiting for new hepmc files
+        """
+        todo = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        workers = []
+        for i in range(self.nprocesses):
+            p = multiprocessing.Process ( target = work,
+                    args = ( self.config(), todo, results, i ) )
+            workers.append ( p )
+            p.start()
+        self.info ( f"watching {self.resultsdir} with {self.nprocesses} workers" )
+        lastStats = 0.
+        pending = []
+        try:
+            while True:
+                pending += self.scan()
+                ## dont claim more than we can chew
+                while len(pending)>0 and self.counters["queued"] < self.nprocesses:
+                    topo, masses, path = pending.pop ( 0 )
+                    if not self.claim ( topo, masses, path ):
+                        continue
+                    todo.put ( { "topo": topo, "masses": masses, "path": path } )
+                    self.counters["queued"] += 1
+                self.collect ( results )
+                if time.time() - lastStats > 60.:
+                    self.printStats()
+                    lastStats = time.time()
+                if once and len(pending)==0 and self.counters["queued"] + \
+                        self.counters["running"] == 0:
+                    break
+                locker.renewLeases()
+                time.sleep ( self.interval if not once else 1. )
+        except KeyboardInterrupt as e:
+            self.info ( "interrupted" )
+        for p in workers:
+            todo.put ( None )
+        for p in workers:
+            p.join()
+        self.collect ( results )
+        self.printStats()
+
+    def config ( self ) -> Dict:
+        """ what the workers need to know """
+        return { "recaster": self.recaster, "analyses": self.analyses,
+                 "njets": self.njets, "sqrts": self.sqrts, "keep": self.keep,
+                 "rerun": self.rerun, "keephepmc": self.keephepmc,
+                 "adl_file": self.adl_file,
+                 "event_condition": self.event_condition }
+
+def recast ( config : Dict, topo : str, masses, hepmcfile : str, pid : int ) -> bool:
+    """ run the configured recasters on hepmcfile
+    :returns: True if all succeeded
+    """
+    ok = True
+    analist = [ x.strip() for x in config["analyses"].split(",") ]
+    for i,recaster in enumerate ( config["recaster"] ):
+        ## only the last recaster may remove the hepmc file
+        keephepmc = config["keephepmc"] or i < len(config["recaster"])-1
+        rets = []
+        if recaster == "MA5":
+            from ma5Wrapper import MA5Wrapper
+            ma5 = MA5Wrapper ( topo, config["njets"], config["rerun"],
+                    config["analyses"], config["keep"], config["sqrts"],
+                    keephepmc = keephepmc )
+            rets.append ( ma5.run ( masses, hepmcfile, pid ) )
+        if recaster == "adl":
+            from cutlangWrapper import CutLangWrapper
+            for ana in analist:
+                cl = CutLangWrapper ( topo, config["njets"], config["rerun"],
+                        ana, auto_confirm = True, keep = config["keep"],
+                        adl_file = config["adl_file"],
+                        event_condition = config["event_condition"] )
+                rets.append ( cl.run ( masses, hepmcfile, pid ) )
+        if recaster == "cm2":
+            from cm2Wrapper import CM2Wrapper
+            for ana in analist:
+                cm2 = CM2Wrapper ( topo, config["njets"], config["rerun"], ana,
+                        keep = config["keep"], sqrts = config["sqrts"],
+                        keephepmc = keephepmc )
+                rets.append ( cm2.run ( masses, hepmcfile, pid ) )
+        if any ( [ r is not None and r < 0 for r in rets ] ):
+            ok = False
+    return ok
+
+def work ( config : Dict, todo : multiprocessing.Queue,
+           results : multiprocessing.Queue, pid : int ):
+    """ a worker: adopt the claimed points, recast them, report back """
+    while True:
+        item = todo.get()
+        if item is None:
+            break
+        topo, masses = item["topo"], item["masses"]
+        results.put ( { "status": "started", "path": item["path"] } )
+        l = locker.Locker ( config["sqrts"], topo, False )
+        if l.adopt ( masses ):
+            print ( f"[recastService] could not adopt {topo}:{masses}, skip it" )
+            for r in config["recaster"]:
+                metrics.pointFailed ( topo, config["analyses"], r )
+            results.put ( { "status": "failed", "path": item["path"] } )
+            continue
+        status = "failed"
+        tracer.setContext ( topo = topo, masses = masses,
+                            analysis = config["analyses"], sqrts = config["sqrts"] )
+        try:
+            with tracer.span ( "recast", recaster = ",".join ( config["recaster"] ) ) as s:
+                s["ok"] = recast ( config, topo, masses, item["path"], pid )
+            if s["ok"]:
+                checkpoint.Checkpoint ( topo, masses, config["sqrts"] ).done ( \
+                    "recast", analyses = config["analyses"],
+                    recaster = config["recaster"] )
+                status = "done"
+        except Exception as e:
+            print ( f"[recastService] recasting {topo}:{masses} failed: {e}" )
+        finally:
+            l.unlock ( masses )
+        for r in config["recaster"]:
+            if status == "done":
+                metrics.pointCompleted ( topo, config["analyses"], r )
+            else:
+                metrics.pointFailed ( topo, config["analyses"], r )
+        results.put ( { "status": status, "path": item["path"] } )
+
+if __name__ == "__main__":
+    import argparse
+    argparser = argparse.ArgumentParser(description='watch mg5results/ and recast the new hepmc files.')
+    argparser.add_argument ( '-a', '--analyses', help='analyses, comma separated [cms_sus_19_006]',
+                             type=str, default="cms_sus_19_006" )
+    argparser.add_argument ( '-j', '--njets', help='number of ISR jets [1]',
+                             type=int, default=1 )
+    argparser.add_argument ( '-s', '--sqrts', help='sqrts [13]',
+                             type=int, default=13 )
+    argparser.add_argument ( '-t', '--topo', help='consider only these topologies, comma separated. None means all [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-p', '--nprocesses', help='number of recasting workers. 0 means 1 per CPU [1]',
+                             type=int, default=1 )
+    argparser.add_argument ( '--cutlang', help='use cutlang instead of MA5',
+                             action="store_true" )
+    argparser.add_argument ( '--checkmate', help='use checkmate instead of MA5',
+                             action="store_true" )
+    argparser.add_argument ( '--adl_file', help='specify the name of the adl description to be used [if not specified, try to guess]',
+                             type=str, default=None )
+    argparser.add_argument ( '--event_condition', help='specify conditions on the events, filter out the rest, e.g. {"higgs":1}: one and only one higgs [None]',
+                             type=str, default=None )
+    argparser.add_argument ( '-k', '--keep', help='keep temporary files',
+                             action="store_true" )
+    argparser.add_argument ( '-K', '--keephepmc', help='keep hepmc files',
+                             action="store_true" )
+    argparser.add_argument ( '-r', '--rerun', help='force rerun, even if there is a summary file already',
+                             action="store_true" )
+    argparser.add_argument ( '-i', '--interval', help='poll every so many seconds [10.]',
+                             type=float, default=10. )
+    argparser.add_argument ( '--settle', help='consider hepmc files only after they have not been touched for that many seconds [30.]',
+                             type=float, default=30. )
+    argparser.add_argument ( '-o', '--once', help='quit when all current hepmc files are recast',
+                             action="store_true" )
+    args = argparser.parse_args()
+    if args.cutlang and args.checkmate:
+        print ( "[recastService] both checkmate and cutlang have been asked for. please choose!" )
+        sys.exit()
+    recaster = [ "MA5" ]
+    if args.cutlang:
+        recaster = [ "adl" ]
+    if args.checkmate:
+        recaster = [ "cm2" ]
+    topos = None
+    if args.topo is not None:
+        topos = [ x.strip() for x in args.topo.split(",") ]
+    nprocesses = bakeryHelpers.nJobs ( args.nprocesses, 10**6 )
+    service = RecastService ( recaster, args.analyses, args.njets, args.sqrts,
+            topos, nprocesses, args.keep, args.rerun, args.keephepmc,
+            args.adl_file, args.event_condition, args.interval, args.settle )
+    service.serve ( args.once )
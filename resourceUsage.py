@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: resourceUsage
+   :synopsis: account for the resources of the external tools we run:
+              user and system cpu time, peak rss, and bytes of output,
+              per point and stage. we wait for the children ourselves with
+              os.wait4, so we get the usage of exactly that child (and
+              all its descendants that it waited for).
+              the accounting of a point is kept in
+              resources/<topo>_<masses>.<sqrts>.json, the totals end up
+              as __cpu__ and __rss__ next to __nevents__ in the embaked files.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, json, fcntl, subprocess
+import tracer
+from typing import Dict, Union
+
+def wait ( pipe : subprocess.Popen ) -> Dict:
+    """ wait for the child of pipe, like pipe.wait(), but return its usage
+    :returns: dictionary with utime, stime (seconds), maxrss (bytes),
+              written (bytes written to disk)
+    """
+    try:
+        _, status, ru = os.wait4 ( pipe.pid, 0 )
+    except ChildProcessError as e:
+        ## someone else reaped it already
+        pipe.wait()
+        return { "utime": 0., "stime": 0., "maxrss": 0, "written": 0 }
+    pipe.returncode = os.waitstatus_to_exitcode ( status )
+    return { "utime": ru.ru_utime, "stime": ru.ru_stime,
+             "maxrss": ru.ru_maxrss * 1024, "written": ru.ru_oublock * 512 }
+
+def usageFileName ( topo : str, masses, sqrts : int = 13 ) -> str:
+    import bakeryHelpers
+    smasses = "_".join ( map ( str, masses ) )
+    return os.path.join ( bakeryHelpers.baseDir(), "resources",
+                          f"{topo}_{smasses}.{int(sqrts)}.json" )
+
+def load ( topo : str, masses, sqrts : int = 13 ) -> Dict:
+    """ the accounting of a point, per stage """
+    filename = usageFileName ( topo, masses, sqrts )
+    if not os.path.exists ( filename ):
+        return {}
+    try:
+        with open ( filename, "rt" ) as f:
+            ret = json.load ( f )
+            f.close()
+        return ret
+    except (OSError,ValueError) as e:
+        return {}
+
+def totals ( topo : str, masses, sqrts : int = 13 ) -> Dict:
+    """ the totals of a point, as they go into the embaked files:
+        __cpu__ is the cpu time in seconds, summed over all stages,
+        __rss__ is the peak rss in MB, of the largest process.
+    :returns: empty dictionary, if nothing was recorded
+    """
+    D = load ( topo, masses, sqrts )
+    if len(D)==0:
+        return {}
+    cpu = sum ( [ v["utime"] + v["stime"] for v in D.values() ] )
+    rss = max ( [ v["maxrss"] for v in D.values() ] )
+    return { "__cpu__": round ( cpu, 1 ), "__rss__": round ( rss / 2**20, 1 ) }
+
+def record ( usage : Dict, outbytes : int = 0, stage : Union[str,None] = None ):
+    """ book the usage of a child process, for the point in the context
+        of the tracer, and for its innermost span.
+    :param outbytes: bytes of output on stdout/stderr
+    :param stage: the stage, default is the innermost span
+    """
+    span = tracer.currentSpan()
+    if span is not None:
+        span["cpu"] = span.get ( "cpu", 0. ) + usage["utime"] + usage["stime"]
+        span["rss"] = max ( span.get ( "rss", 0 ), usage["maxrss"] )
+        span["outbytes"] = span.get ( "outbytes", 0 ) + outbytes
+        span["written"] = span.get ( "written", 0 ) + usage["written"]
+    context = tracer.getContext()
+    if not "topo" in context or not "masses" in context:
+        return
+    if stage is None:
+        stage = span["stage"] if span is not None else "other"
+    filename = usageFileName ( context["topo"], context["masses"],
+                               context.get ( "sqrts", 13 ) )
+    try:
+        os.makedirs ( os.path.dirname ( filename ), exist_ok=True )
+        with open ( filename, "a+" ) as f:
+            fcntl.flock ( f, fcntl.LOCK_EX )
+            f.seek ( 0 )
+            txt = f.read()
+            D = json.loads ( txt ) if len(txt)>0 else {}
+            if not stage in D:
+                D[stage] = { "n": 0, "utime": 0., "stime": 0., "maxrss": 0,
+                             "outbytes": 0, "written": 0 }
+            entry = D[stage]
+            entry["n"] += 1
+            entry["utime"] += usage["utime"]
+            entry["stime"] += usage["stime"]
+            entry["maxrss"] = max ( entry["maxrss"], usage["maxrss"] )
+            entry["outbytes"] += outbytes
+            entry["written"] += usage["written"]
+            f.seek ( 0 )
+            f.truncate ()
+            json.dump ( D, f )
+            f.flush()
+            fcntl.flock ( f, fcntl.LOCK_UN )
+            f.close()
+    except (OSError,ValueError) as e:
+        print ( f"[resourceUsage] cannot book usage in {filename}: {e}" )
+
+def reset ( topo : str, masses, sqrts : int = 13 ):
+    """ forget the accounting of a point, e.g. when we rerun it """
+    filename = usageFileName ( topo, masses, sqrts )
+    if os.path.exists ( filename ):
+        os.unlink ( filename )
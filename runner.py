@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: runner
+   :synopsis: run an external tool with bounded memory: stdout and stderr
+              are drained concurrently, in large chunks, into a log file,
+              only a tail of the output is kept for the console. the log
+              file of a point is logs/<topo>_<masses>.<sqrts>.log, if the
+              tracer knows the point, see tracer.setContext.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, sys, time, subprocess, threading, collections, signal
+import tracer, resourceUsage
+from typing import Dict, List, Union
+
+logdir = os.environ.get ( "EMCREATOR_LOGDIR", None )
+chunkSize = 1 << 16
+
+def logDir() -> str:
+    """ the directory of the per-point log files """
+    if logdir is not None:
+        return logdir
+    import bakeryHelpers
+    return os.path.join ( bakeryHelpers.baseDir(), "logs" )
+
+def logFileName( context : Union[Dict,None] = None ) -> Union[str,None]:
+    """ the log file of the point in context, default is the context of
+        the tracer. None if there is no point """
+    if context is None:
+        context = tracer.getContext()
+    if not "topo" in context or not "masses" in context:
+        return None
+    smasses = "_".join ( map ( str, context["masses"] ) )
+    return os.path.join ( logDir(), f"{context['topo']}_{smasses}.{int(context.get('sqrts',13))}.log" )
+
+class Tail:
+    """ ring buffer that keeps the last maxBytes bytes written to it """
+    def __init__ ( self, maxBytes : int ):
+        self.maxBytes = maxBytes
+        self.chunks = collections.deque()
+        self.size = 0
+
+    def write ( self, chunk : bytes ):
+        self.chunks.append ( chunk )
+        self.size += len(chunk)
+        while self.size - len(self.chunks[0]) >= self.maxBytes:
+            self.size -= len(self.chunks.popleft())
+
+    def get ( self ) -> bytes:
+        return b"".join ( self.chunks )[-self.maxBytes:]
+
+def run ( cmd : Union[str,List[str]], logfile : Union[str,None] = "auto",
+          cwd : Union[str,None] = None, env : Union[Dict,None] = None,
+          tailBytes : int = 4096, echo : bool = False,
+          timeout : Union[float,None] = None ) -> Dict:
+    """ run cmd, a string is run in a shell. the usage of the child is
+        booked with resourceUsage.record.
+    :param logfile: append all output to this file. "auto" means the log
+                    file of the point, see logFileName; None means no log file
+    :param tailBytes: keep so many bytes of output for the tail
+    :param echo: relay all output to our stdout, too
+    :param timeout: kill the child after so many seconds
+    :returns: dictionary with returncode, seconds, outbytes, the tail
+              (a string), and the logfile
+    """
+    if logfile == "auto":
+        logfile = logFileName()
+    shell = type(cmd)==str
+    scmd = cmd if shell else " ".join ( cmd )
+    log = None
+    if logfile is not None:
+        os.makedirs ( os.path.dirname ( os.path.abspath ( logfile ) ), exist_ok=True )
+        log = open ( logfile, "ab" )
+    tail = Tail ( tailBytes )
+    lock = threading.Lock()
+    counter = { "outbytes": 0 }
+    t0 = time.time()
+    try:
+        proc = subprocess.Popen ( cmd, shell = shell, cwd = cwd, env = env,
+                                  stdin = subprocess.DEVNULL,
+                                  stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                  start_new_session = timeout is not None )
+        if log is not None:
+            log.write ( f"exec: [{cwd or os.getcwd()}] {scmd}\n".encode() )
+            log.flush()
+
+        def drain ( stream ):
+            fd = stream.fileno()
+            while True:
+                chunk = os.read ( fd, chunkSize )
+                if len(chunk)==0:
+                    break
+                with lock:
+                    counter["outbytes"] += len(chunk)
+                    tail.write ( chunk )
+                    if log is not None:
+                        log.write ( chunk )
+                    if echo:
+                        sys.stdout.buffer.write ( chunk )
+                        sys.stdout.flush()
+            stream.close()
+
+        threads = [ threading.Thread ( target = drain, args = ( s, ), daemon = True ) \
+                    for s in [ proc.stdout, proc.stderr ] ]
+        for t in threads:
+            t.start()
+        timedOut = False
+        if timeout is not None:
+            for t in threads:
+                t.join ( max ( 0., t0 + timeout - time.time() ) )
+            if any ( [ t.is_alive() for t in threads ] ):
+                timedOut = True
+                ## the whole session, a shell may have children that hold the pipes
+                try:
+                    os.killpg ( proc.pid, signal.SIGKILL )
+                except ProcessLookupError as e:
+                    pass
+        for t in threads:
+            t.join()
+        usage = resourceUsage.wait ( proc )
+        resourceUsage.record ( usage, counter["outbytes"] )
+        if log is not None and timedOut:
+            log.write ( f"\nkilled after {timeout}s\n".encode() )
+    finally:
+        ## also if we could not start the child, e.g. BlockingIOError
+        if log is not None:
+            log.close()
+    return { "returncode": proc.returncode, "seconds": time.time() - t0,
+             "outbytes": counter["outbytes"], "timedout": timedOut,
+             "tail": tail.get().decode ( "latin1" ), "logfile": logfile }
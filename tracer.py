@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: tracer
+   :synopsis: spans around the stages of the life of a point
+              (cards, mg5 output, mg5 launch, delphes, recasting, ...).
+              every span is appended as one json line to
+              traces/<host>.jsonl, with wall time, host, pid, topo,
+              masses and analysis. use printTraceStats.py for a report.
+
+.. moduleauthor:: Wolfgang Waltenberger <wolfgang.waltenberger@gmail.com>
+"""
+
+import os, time, socket, json, threading, glob
+from contextlib import contextmanager
+from typing import Dict, Union, Iterator
+
+tracedir = os.environ.get ( "EMCREATOR_TRACEDIR", None )
+enabled = os.environ.get ( "EMCREATOR_TRACE", "1" ) not in [ "0", "" ]
+_local = threading.local()
+
+def traceDir() -> str:
+    """ the directory of the trace files """
+    if tracedir is not None:
+        return tracedir
+    import bakeryHelpers
+    return os.path.join ( bakeryHelpers.baseDir(), "traces" )
+
+def traceFile() -> str:
+    """ one trace file per host, so we never interleave writes over nfs """
+    host = socket.gethostname()
+    if host.find(".")>0:
+        host = host[:host.find(".")]
+    return os.path.join ( traceDir(), f"{host}.jsonl" )
+
+def setContext ( **context ):
+    """ set the context of this thread, e.g. topo, masses, analysis.
+        it is added to all spans that follow. """
+    _local.context = context
+
+def updateContext ( **context ):
+    """ add to the context of this thread """
+    D = getContext()
+    D.update ( context )
+    _local.context = D
+
+def getContext() -> Dict:
+    return dict ( getattr ( _local, "context", {} ) )
+
+def currentSpan() -> Union[Dict,None]:
+    """ the record of the innermost open span of this thread, None if none """
+    spans = getattr ( _local, "spans", [] )
+    if len(spans)==0:
+        return None
+    return spans[-1]
+
+def write ( record : Dict ):
+    """ append record to the trace file, in a single write """
+    if not enabled:
+        return
+    line = ( json.dumps ( record, default=str ) + "\n" ).encode()
+    try:
+        filename = traceFile()
+        os.makedirs ( os.path.dirname ( filename ), exist_ok=True )
+        fd = os.open ( filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644 )
+        try:
+            os.write ( fd, line )
+        finally:
+            os.close ( fd )
+    except OSError as e:
+        print ( f"[tracer] cannot write trace: {e}" )
+
+@contextmanager
+def span ( stage : str, **info ):
+    """ trace the stage. the record can be amended within the span:
+
+        with tracer.span ( "delphes" ) as s:
+            ...
+            s["nevents"] = 10000
+    """
+    record = { "stage": stage }
+    record.update ( getContext() )
+    record.update ( info )
+    t0 = time.time()
+    record["ok"] = True
+    if not hasattr ( _local, "spans" ):
+        _local.spans = []
+    _local.spans.append ( record )
+    try:
+        yield record
+    except BaseException as e:
+        record["ok"] = False
+        record["error"] = str(e)[:200]
+        raise
+    finally:
+        _local.spans.pop()
+        record["t0"] = t0
+        record["dt"] = time.time() - t0
+        record["host"] = socket.gethostname()
+        record["pid"] = os.getpid()
+        write ( record )
+        import metrics
+        metrics.observe ( "emcreator_stage_duration_seconds", record["dt"],
+                          stage = stage, topo = record.get ( "topo", "?" ) )
+
+def event ( stage : str, ok : bool = True, **info ):
+    """ a span without duration, e.g. to mark that a point failed """
+    record = { "stage": stage }
+    record.update ( getContext() )
+    record.update ( info )
+    record.update ( { "ok": ok, "t0": time.time(), "dt": 0.,
+                      "host": socket.gethostname(), "pid": os.getpid() } )
+    write ( record )
+
+def readTraces ( dirname : Union[str,None] = None ) -> Iterator[Dict]:
+    """ iterate over all the spans in all the trace files """
+    if dirname is None:
+        dirname = traceDir()
+    for filename in glob.glob ( f"{dirname}/*.jsonl" ):
+        with open ( filename, "rt" ) as f:
+            for line in f:
+                try:
+                    yield json.loads ( line )
+                except ValueError as e:
+                    ## partially written line
+                    continue
+            f.close()